@@ -0,0 +1,24 @@
+"""add binary latent vector + model version to user_features
+
+Revision ID: 0004_user_latent_blob
+Revises: 0003_add_cover_url
+Create Date: 2026-10-17
+"""
+from __future__ import annotations
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004_user_latent_blob'
+down_revision = '0003_add_cover_url'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table('user_features') as batch_op:
+        batch_op.add_column(sa.Column('latent_blob', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('model_version', sa.String(length=40), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table('user_features') as batch_op:
+        batch_op.drop_column('model_version')
+        batch_op.drop_column('latent_blob')
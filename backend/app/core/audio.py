@@ -0,0 +1,176 @@
+"""Audio probing and normalization for uploaded tracks.
+
+``probe`` reads duration / bitrate from the file headers in pure Python
+(RIFF/WAVE chunks; MPEG layer III frame header plus Xing/Info/VBRI frame
+counts, CBR estimate otherwise), or asks ``ffprobe`` for any other format.
+``transcode_preview`` normalizes an upload into the standard preview format
+(44.1 kHz stereo 128 kbps MP3) with a local ``ffmpeg``.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import struct
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+PREVIEW_FORMAT = 'mp3'
+PREVIEW_BITRATE = '128k'
+FFMPEG_TIMEOUT_SECONDS = 300
+
+# kbps by bitrate index, layer III
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),      # MPEG-2 / 2.5
+}
+_MP3_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+class ProbeError(ValueError):
+    """Not a readable audio file."""
+
+
+def ffmpeg_path() -> Optional[str]:
+    return shutil.which('ffmpeg')
+
+
+def _result(duration_s: float, bitrate: Optional[int], fmt: str, sample_rate: Optional[int]) -> dict:
+    return {
+        'format': fmt,
+        'duration_ms': int(round(duration_s * 1000)),
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+    }
+
+
+def probe_wav(path: Path) -> dict:
+    with open(path, 'rb') as f:
+        head = f.read(12)
+        if len(head) < 12 or head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+            raise ProbeError('not a RIFF/WAVE file')
+        byte_rate = sample_rate = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ProbeError('no data chunk')
+            cid, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if cid == b'fmt ':
+                fmt = f.read(size + (size & 1))
+                if len(fmt) < 16:
+                    raise ProbeError('short fmt chunk')
+                sample_rate, byte_rate = struct.unpack('<II', fmt[4:12])
+            elif cid == b'data':
+                if not byte_rate:
+                    raise ProbeError('data chunk before fmt')
+                # streaming writers leave the size at 0 / 0xFFFFFFFF: use what is on disk
+                available = os.fstat(f.fileno()).st_size - f.tell()
+                if size == 0 or size > available:
+                    size = available
+                return _result(size / byte_rate, byte_rate * 8, 'wav', sample_rate)
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def _id3_size(head: bytes) -> int:
+    if head[:3] != b'ID3' or len(head) < 10:
+        return 0
+    size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+
+def _mp3_frame(buf: bytes, i: int) -> Optional[tuple[int, int, int, bool, int]]:
+    """(version, bitrate, sample rate, mono, frame length) of a layer III header at ``buf[i]``."""
+    if i + 4 > len(buf) or buf[i] != 0xFF or (buf[i + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = buf[i + 1], buf[i + 2], buf[i + 3]
+    version = (b1 >> 3) & 0x3          # 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+    layer = (b1 >> 1) & 0x3            # 1 = layer III
+    br_idx, sr_idx = b2 >> 4, (b2 >> 2) & 0x3
+    if version == 1 or layer != 1 or br_idx in (0, 15) or sr_idx == 3:
+        return None
+    bitrate = _MP3_BITRATES[1 if version == 3 else 2][br_idx] * 1000
+    sample_rate = _MP3_RATES[version][sr_idx]
+    length = (144 if version == 3 else 72) * bitrate // sample_rate + ((b2 >> 1) & 1)
+    return version, bitrate, sample_rate, (b3 >> 6) == 3, length
+
+
+def probe_mp3(path: Path) -> dict:
+    """Duration / bitrate from the first frame whose successor header is where its
+    length says (a lone 0xFFEx pair in e.g. a non-MP3 file is not enough)."""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        start = _id3_size(f.read(10))
+        f.seek(start)
+        buf = f.read(64 * 1024)
+    for i in range(len(buf) - 4):
+        frame = _mp3_frame(buf, i)
+        if frame is None:
+            continue
+        version, bitrate, sample_rate, mono, length = frame
+        nxt = _mp3_frame(buf, i + length)
+        # a single-frame file ends right after it
+        if start + i + length != file_size and (nxt is None or nxt[0] != version or nxt[2] != sample_rate):
+            continue
+        samples = 1152 if version == 3 else 576
+        audio_bytes = file_size - start - i
+        # VBR files carry the frame count in a Xing/Info (or VBRI) header in the first frame
+        side = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+        frames = None
+        xing = buf[i + 4 + side:i + 4 + side + 12]
+        if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 1:
+            frames = struct.unpack('>I', xing[8:12])[0]
+        elif buf[i + 36:i + 40] == b'VBRI':
+            frames = struct.unpack('>I', buf[i + 50:i + 54])[0]
+        if frames:
+            duration = frames * samples / sample_rate
+            return _result(duration, int(audio_bytes * 8 / duration) if duration else bitrate, 'mp3', sample_rate)
+        return _result(audio_bytes * 8 / bitrate, bitrate, 'mp3', sample_rate)
+    raise ProbeError('no MPEG layer III frame found')
+
+
+def probe_ffprobe(path: Path) -> dict:
+    exe = shutil.which('ffprobe')
+    if exe is None:
+        raise ProbeError('ffprobe not available')
+    out = subprocess.run(
+        [exe, '-v', 'error', '-show_entries', 'format=format_name,duration,bit_rate:stream=sample_rate',
+         '-of', 'json', str(path)],
+        capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS,
+    )
+    if out.returncode != 0:
+        raise ProbeError(out.stderr.decode('utf-8', errors='replace')[:400])
+    info = json.loads(out.stdout)
+    fmt = info.get('format', {})
+    if 'duration' not in fmt:
+        raise ProbeError('no duration')
+    rate = next((int(s['sample_rate']) for s in info.get('streams', []) if s.get('sample_rate')), None)
+    bit_rate = int(fmt['bit_rate']) if fmt.get('bit_rate') else None
+    return _result(float(fmt['duration']), bit_rate, fmt.get('format_name', '').split(',')[0], rate)
+
+
+def probe(path: Path) -> dict:
+    """{format, duration_ms, bitrate, sample_rate} of an audio file; raises ``ProbeError``."""
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return probe_wav(path)
+    try:
+        return probe_mp3(path)
+    except ProbeError:
+        return probe_ffprobe(path)
+
+
+def transcode_preview(src: Path, dest: Path) -> None:
+    """Normalize ``src`` into the preview format with ffmpeg (raises ``ProbeError`` on failure)."""
+    exe = ffmpeg_path()
+    if exe is None:
+        raise ProbeError('ffmpeg not available')
+    out = subprocess.run(
+        [exe, '-v', 'error', '-y', '-i', str(src), '-vn', '-ac', '2', '-ar', '44100',
+         '-codec:a', 'libmp3lame', '-b:a', PREVIEW_BITRATE, '-f', PREVIEW_FORMAT, str(dest)],
+        capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS,
+    )
+    if out.returncode != 0:
+        raise ProbeError(out.stderr.decode('utf-8', errors='replace')[:400])
@@ -0,0 +1,199 @@
+"""HTTP caching / byte-range helpers for audio responses.
+
+Starlette 0.38's ``FileResponse`` has no Range support, so audio served from
+disk goes through ``serve_file`` (in-memory audio through ``serve_bytes``):
+
+  - strong ETag + Last-Modified on every response, ``Accept-Ranges: bytes``
+  - ``If-None-Match`` / ``If-Modified-Since`` -> 304 without a body
+  - single ``Range: bytes=...`` -> 206 with ``Content-Range`` (honouring
+    ``If-Range``), unsatisfiable ranges -> 416; multi-ranges get a plain 200
+  - file bodies are sent in 256 KB reads, or handed to the server via the
+    ASGI ``http.response.pathsend`` extension when it offers zero-copy sends
+
+``sine_wav`` builds the synthetic preview tones (NumPy, no per-sample Python).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from anyio import open_file
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """(start, end) inclusive for a single byte range, None to serve everything.
+
+    Raises ``RangeNotSatisfiable`` when the range starts past the end.
+    Malformed and multi-range headers are ignored (RFC 9110 allows that).
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    spec = header[6:].strip()
+    first, sep, last = spec.partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if start < 0 or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _matches_etag(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or any(t.removeprefix('W/') == etag for t in tags)
+
+
+def _http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float]) -> bool:
+    inm = request.headers.get('if-none-match')
+    if inm is not None:
+        return _matches_etag(inm, etag)
+    ims = request.headers.get('if-modified-since')
+    if ims and last_modified is not None:
+        since = _http_date(ims)
+        return since is not None and int(last_modified) <= since
+    return False
+
+
+def _range_applies(request: Request, etag: str, last_modified: Optional[float]) -> bool:
+    if_range = request.headers.get('if-range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag  # strong comparison only
+    since = _http_date(if_range)
+    return since is not None and last_modified is not None and int(last_modified) == since
+
+
+def _plan(request: Request, size: int, etag: str, last_modified: Optional[float],
+          media_type: str, headers: Optional[dict]) -> tuple[Optional[Response], int, int, dict]:
+    """(finished 304/416 response or None, body start, body length, response headers)."""
+    base = {'accept-ranges': 'bytes', 'etag': etag, **(headers or {})}
+    if last_modified is not None:
+        base['last-modified'] = formatdate(last_modified, usegmt=True)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=base), 0, 0, base
+    rng = None
+    if _range_applies(request, etag, last_modified):
+        try:
+            rng = parse_range(request.headers.get('range'), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**base, 'content-range': f'bytes */{size}'}), 0, 0, base
+    if rng is None:
+        return None, 0, size, {**base, 'content-length': str(size), 'content-type': media_type}
+    start, end = rng
+    base.update({
+        'content-range': f'bytes {start}-{end}/{size}',
+        'content-length': str(end - start + 1),
+        'content-type': media_type,
+    })
+    return None, start, end - start + 1, base
+
+
+class RangeFileResponse(Response):
+    """Sends ``length`` bytes of ``path`` starting at ``start`` (headers prepared by the caller)."""
+
+    def __init__(self, path: Union[str, Path], status_code: int, headers: dict, start: int, length: int,
+                 send_body: bool = True):
+        self.path = Path(path)
+        self.status_code = status_code
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+        self.background = None
+        self.body = b''
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        if self.status_code == 200 and 'http.response.pathsend' in scope.get('extensions', {}):
+            await send({'type': 'http.response.pathsend', 'path': str(self.path)})
+            return
+        remaining = self.length
+        async with await open_file(self.path, 'rb') as f:
+            if self.start:
+                await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        if remaining > 0:
+            # file shrank underneath us; close the response
+            await send({'type': 'http.response.body', 'body': b''})
+
+
+def file_etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def serve_file(request: Request, path: Union[str, Path], media_type: str, headers: Optional[dict] = None) -> Response:
+    """Conditional / ranged response for a file on disk."""
+    st = os.stat(path)
+    etag = file_etag(st)
+    done, start, length, hdrs = _plan(request, st.st_size, etag, st.st_mtime, media_type, headers)
+    if done is not None:
+        return done
+    status = 206 if 'content-range' in hdrs else 200
+    return RangeFileResponse(path, status, hdrs, start, length, send_body=request.method != 'HEAD')
+
+
+def serve_bytes(request: Request, data: bytes, media_type: str, etag: Optional[str] = None,
+                last_modified: Optional[float] = None, headers: Optional[dict] = None) -> Response:
+    """Conditional / ranged response for an in-memory body (ETag defaults to a content hash)."""
+    etag = etag or '"' + hashlib.blake2b(data, digest_size=12).hexdigest() + '"'
+    done, start, length, hdrs = _plan(request, len(data), etag, last_modified, media_type, headers)
+    if done is not None:
+        return done
+    status = 206 if 'content-range' in hdrs else 200
+    body = b'' if request.method == 'HEAD' else data[start:start + length]
+    return Response(content=body, status_code=status, headers=hdrs)
+
+
+def sine_wav(freq: float, seconds: float = 5, sample_rate: int = 44100, amplitude: int = 16000) -> bytes:
+    """16-bit mono PCM WAV of a sine tone."""
+    n = np.arange(int(sample_rate * seconds), dtype=np.float64)
+    # astype truncates toward zero, like int() on each sample
+    pcm = (amplitude * np.sin(2 * np.pi * freq * (n / sample_rate))).astype('<i2').tobytes()
+    header = struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + len(pcm), b'WAVE',
+        b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b'data', len(pcm),
+    )
+    return header + pcm
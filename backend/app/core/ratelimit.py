@@ -0,0 +1,174 @@
+"""Token-bucket rate limiting and a circuit breaker, shared by threads and asyncio tasks.
+
+``reserve`` takes the tokens immediately (the balance may go negative) and
+returns how long the caller has to wait, so concurrent callers queue up fairly
+without a background refill task: ``acquire`` sleeps that long, and
+``acquire_async`` awaits it.
+
+``CircuitBreaker`` opens after a run of consecutive failures so callers fail
+fast instead of piling onto an upstream that is down or out of quota; after
+``reset_seconds`` a single trial call decides whether it closes again.
+
+Both read time from ``clock`` (``time.monotonic`` by default), so tests can
+drive them with a fake one.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """``rate`` tokens per second (<= 0 = unlimited), bursts up to ``capacity`` (default: one second's worth)."""
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Take ``tokens`` now; seconds to wait before using them."""
+        if self.rate <= 0:
+            self.granted += 1
+            return 0.0
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens -= tokens
+            self.granted += 1
+            if self._tokens >= 0:
+                return 0.0
+            self.throttled += 1
+            return -self._tokens / self.rate
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take ``tokens`` only if available right now."""
+        if self.rate <= 0:
+            self.granted += 1
+            return True
+        with self._lock:
+            self._refill(self.clock())
+            if self._tokens < tokens:
+                self.rejected += 1
+                return False
+            self._tokens -= tokens
+            self.granted += 1
+            return True
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """Wait for ``tokens``; with ``timeout``, take nothing and return False if the wait would be longer."""
+        if timeout is None or self.rate <= 0:
+            delay = self.reserve(tokens)
+        else:
+            with self._lock:
+                self._refill(self.clock())
+                delay = (tokens - self._tokens) / self.rate
+                if delay > timeout:
+                    self.rejected += 1
+                    return False
+                self._tokens -= tokens
+                self.granted += 1
+                if delay > 0:
+                    self.throttled += 1
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    async def acquire_async(self, tokens: float = 1.0) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self.rate > 0:
+                self._refill(self.clock())
+            return {
+                'rate': self.rate,
+                'capacity': self.capacity,
+                'tokens': round(self._tokens, 3),
+                'granted': self.granted,
+                'throttled': self.throttled,
+                'rejected': self.rejected,
+            }
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """Open after ``failure_threshold`` consecutive failures (<= 0 = never), for ``reset_seconds``."""
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def retry_in(self) -> float:
+        """Seconds until calls are let through again (0 when closed or ready for a trial)."""
+        if self.state == self.CLOSED:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_seconds - self.clock())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; in half-open state only one trial call at a time."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() >= self._opened_at + self.reset_seconds:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def release(self) -> None:
+        """Give back a half-open trial that ``allow`` granted but was never made."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (0 < self.failure_threshold <= self.failures):
+                self._open()
+
+    def trip(self) -> None:
+        """Open right away (e.g. the upstream said the quota is exhausted)."""
+        with self._lock:
+            self._open()
+
+    def _open(self) -> None:
+        if self.state != self.OPEN:
+            self.opened += 1
+        self.state = self.OPEN
+        self._opened_at = self.clock()
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_in': round(self.retry_in(), 1),
+            'opened': self.opened,
+        }
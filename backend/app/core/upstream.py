@@ -0,0 +1,39 @@
+"""Constants and helpers for talking to Deezer's API and preview CDN.
+
+Kept free of service singletons so the API client, the preview cache and the
+tools can share them without importing each other.
+"""
+from __future__ import annotations
+
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+# Some CDNs block non-browser clients; look like a browser
+UPSTREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36',
+    'Accept': 'audio/*,*/*',
+}
+DEEZER_REFERER = 'https://www.deezer.com/'
+# refresh signed URLs this long before they expire
+EXPIRY_MARGIN_SECONDS = 60.0
+
+
+def preview_url_expiry(url: str) -> Optional[float]:
+    """Unix expiry of a signed preview URL (``hdnea=exp=...~acl=...~hmac=...`` or ``exp=``)."""
+    try:
+        query = parse_qs(urlsplit(url).query)
+    except ValueError:
+        return None
+    for token in query.get('hdnea', []):
+        for part in token.split('~'):
+            if part.startswith('exp='):
+                try:
+                    return float(part[4:])
+                except ValueError:
+                    return None
+    for value in query.get('exp', []):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
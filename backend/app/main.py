@@ -4,6 +4,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from .core.config import get_settings
 from .routers import recommend, tracks, health, auth, interactions, playlists, deezer
 from .core.db import engine, Base
+from .services.catalog import catalog_service
+from .services.content_service import content_service
+from .services.model_store import model_store
+from .services.deezer_service import deezer_client
+from .services.preview_cache import preview_cache
+from .services.search_index import search_service
+from .services.storage import audio_files, audio_storage
 
 settings = get_settings()
 
@@ -29,6 +36,7 @@ if settings.debug:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "Location"],
     )
 else:
     app.add_middleware(
@@ -37,12 +45,41 @@ else:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "Location"],
     )
 
 @app.on_event("startup")
 def on_startup():
     # Auto-create tables in dev (replace with Alembic in production)
     Base.metadata.create_all(bind=engine)
+    # Map the latest factor model and watch for new versions written by train_mf
+    model_store.refresh()
+    model_store.start_watcher(settings.model_reload_seconds)
+    # cold-start feature matrix, rebuilt every CONTENT_REFRESH_SECONDS off the request path
+    content_service.start_watcher()
+    # live-catalog snapshot (recommendations, track lists), refreshed off the request path
+    catalog_service.start_watcher()
+    # index the preview cache and keep it within PREVIEW_CACHE_MAX_BYTES
+    if preview_cache.manager is not None:
+        preview_cache.manager.start()
+    # load the saved /tracks/search index (or build it) without delaying startup
+    search_service.start()
+    # in-memory list of local track audio files (GET /tracks/ preview fallback)
+    audio_files.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    model_store.stop_watcher()
+    content_service.stop_watcher()
+    catalog_service.stop_watcher()
+    audio_files.stop()
+    if preview_cache.manager is not None:
+        preview_cache.manager.stop()
+    await preview_cache.aclose()
+    # finish background uploads to the object store (AUDIO_STORAGE=s3)
+    preview_cache.storage.flush()
+    audio_storage.flush()
+    deezer_client.close()
 
 app.include_router(health.router)
 app.include_router(auth.router)
@@ -0,0 +1,29 @@
+"""Implicit-feedback weighting shared by ALS training and online fold-in.
+
+NumPy only, so serving code can import it without the training stack.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+# Interaction strength: fraction of a 30s preview listened, plus bonuses for
+# completion / milestones. Likes are a strong explicit signal.
+FULL_LISTEN_SECONDS = 30.0
+COMPLETED_BONUS = 1.0
+MILESTONE_WEIGHT = 0.5
+LIKE_WEIGHT = 3.0
+DEFAULT_ALPHA = 40.0
+DEFAULT_REGULARIZATION = 0.05
+
+
+def interaction_strength(seconds_listened: np.ndarray, is_completed: np.ndarray, milestone: np.ndarray) -> np.ndarray:
+    """Vectorized raw feedback strength for interaction rows (milestone 0 = none)."""
+    s = np.clip(np.asarray(seconds_listened, dtype=np.float32) / FULL_LISTEN_SECONDS, 0.0, 1.0)
+    s += COMPLETED_BONUS * np.asarray(is_completed, dtype=np.float32)
+    s += MILESTONE_WEIGHT * np.asarray(milestone, dtype=np.float32) / 100.0
+    return s
+
+
+def confidence(strength: np.ndarray, alpha: float) -> np.ndarray:
+    """Confidence c_ui = 1 + alpha * log1p(r_ui) (log damps heavy repeat listening)."""
+    return (1.0 + alpha * np.log1p(strength)).astype(np.float32)
@@ -0,0 +1,77 @@
+"""Build the IVF similar-tracks index for a trained factor model.
+
+Run: python -m app.ml.training.build_ann [--version 20250101120000] [--lists 512] [--benchmark]
+
+The index is written next to the factor artifacts (``ann_*_{version}.npy``)
+and picked up by the serving model store on its next load. ``--benchmark``
+reports recall@k and latency of the IVF search against brute force.
+"""
+from __future__ import annotations
+import argparse
+import time
+import numpy as np
+from pathlib import Path
+
+from ...services.ann_index import IVFIndex, brute_force_search
+from ...services.model_store import read_latest_version
+from .train_mf import ARTIFACT_DIR
+
+
+def build_index(version: str, artifact_dir: Path = ARTIFACT_DIR, n_lists: int | None = None) -> IVFIndex:
+    item_factors = np.load(artifact_dir / f'item_factors_{version}.npy', mmap_mode='r')
+    index = IVFIndex.build(item_factors, n_lists=n_lists)
+    index.save(artifact_dir, version)
+    return index
+
+
+def benchmark(index: IVFIndex, item_factors: np.ndarray, k: int = 20, nprobe: int = 8,
+              queries: int = 200, seed: int = 0) -> dict:
+    """Mean recall@k of IVF vs brute force plus per-query latency of both."""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(item_factors.shape[0], size=min(queries, item_factors.shape[0]), replace=False)
+    recalls, t_ann, t_exact = [], [], []
+    for i in picks:
+        q = np.asarray(item_factors[i])
+        ex = np.array([i])
+        t0 = time.perf_counter()
+        approx, _ = index.search(item_factors, q, k, nprobe=nprobe, exclude=ex)
+        t1 = time.perf_counter()
+        exact, _ = brute_force_search(item_factors, index.norms, q, k, exclude=ex)
+        t2 = time.perf_counter()
+        t_ann.append(t1 - t0)
+        t_exact.append(t2 - t1)
+        if exact.size:
+            recalls.append(len(np.intersect1d(approx, exact)) / exact.size)
+    return {
+        'k': k,
+        'nprobe': nprobe,
+        'recall': round(float(np.mean(recalls)), 4) if recalls else None,
+        'ann_p50_ms': round(float(np.percentile(t_ann, 50)) * 1000, 3),
+        'exact_p50_ms': round(float(np.percentile(t_exact, 50)) * 1000, 3),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--version', default=None, help='Artifact version (default: latest.txt)')
+    p.add_argument('--lists', type=int, default=None, help='Number of IVF lists (default 4*sqrt(items))')
+    p.add_argument('--benchmark', action='store_true', help='Report recall@k vs brute force')
+    p.add_argument('--k', type=int, default=20)
+    p.add_argument('--nprobe', type=int, default=8)
+    args = p.parse_args()
+
+    version = args.version or read_latest_version(ARTIFACT_DIR)
+    if not version:
+        print('No model version found in', ARTIFACT_DIR)
+        return
+    t0 = time.perf_counter()
+    index = build_index(version, n_lists=args.lists)
+    print(f"Built IVF index for {version}: {index.n_lists} lists over {len(index.order)} items ({time.perf_counter() - t0:.1f}s)")
+    if args.benchmark:
+        item_factors = np.load(ARTIFACT_DIR / f'item_factors_{version}.npy', mmap_mode='r')
+        for nprobe in sorted({1, args.nprobe, args.nprobe * 4}):
+            print(benchmark(index, item_factors, k=args.k, nprobe=nprobe))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Offline evaluation + latency benchmark for the recommender engines.
+
+Run: python -m app.ml.training.evaluate --k 10,20 --test-fraction 0.2 --bench-sizes 10000,100000,1000000
+
+Quality: feedback (interactions by ``played_at``, likes by ``created_at``) is
+split at a time cutoff; ALS is fitted on the older part only and every engine
+(fallback, ALS, content) ranks the catalog for users that have history on both
+sides, excluding their training tracks. Reported per engine and k:
+recall@k, NDCG@k (binary relevance) and catalog coverage.
+
+Speed: single-query p50/p99 latency and batched throughput (users/s) of the
+factor scoring path at several catalog sizes. Sizes above the trained catalog
+are synthesized by resampling the item factors (with noise), so a small
+``tools/seed_large.py`` database is enough to benchmark large catalogs.
+
+Results are stored as a ``model_artifacts`` row with ``model_type='eval'``.
+"""
+from __future__ import annotations
+import argparse
+import json
+import time
+import numpy as np
+from datetime import datetime, timezone
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ...core.db import SessionLocal
+from ...models.music import Interaction, TrackLike, ModelArtifact
+from ...services.catalog import CatalogService
+from ...services.content_service import ContentService
+from ...services.model_store import FactorModel
+from ...services.recommendation_service import RecommendationService
+from ..feedback import COMPLETED_BONUS, DEFAULT_ALPHA, DEFAULT_REGULARIZATION, LIKE_WEIGHT, interaction_strength
+from .train_mf import ARTIFACT_DIR, als_fit, build_confidence_matrix
+
+
+def _utc_seconds(at: Optional[datetime]) -> float:
+    """Unix time of a DB timestamp; naive values are UTC (they come from ``datetime.utcnow``)."""
+    if at is None:
+        return 0.0
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return at.timestamp()
+
+
+def load_timed_feedback(db: Session, chunk_size: int = 200_000) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(user_id, track_id, strength, unix time) for all interactions and likes."""
+    cols: list[tuple[np.ndarray, ...]] = []
+    stmt = (
+        select(Interaction.user_id, Interaction.track_id, Interaction.seconds_listened,
+               Interaction.is_completed, Interaction.milestone, Interaction.played_at)
+        .where(Interaction.track_id.is_not(None))
+    )
+    for part in db.execute(stmt, execution_options={'yield_per': chunk_size}).partitions():
+        u, t, secs, done, ms, at = zip(*part)
+        cols.append((
+            np.array(u, dtype=np.int64), np.array(t, dtype=np.int64),
+            interaction_strength(
+                np.array([x or 0 for x in secs], dtype=np.float32),
+                np.array([bool(x) for x in done], dtype=np.float32),
+                np.array([x or 0 for x in ms], dtype=np.float32),
+            ),
+            np.array([_utc_seconds(x) for x in at], dtype=np.float64),
+        ))
+    stmt = select(TrackLike.user_id, TrackLike.track_id, TrackLike.created_at)
+    for part in db.execute(stmt, execution_options={'yield_per': chunk_size}).partitions():
+        u, t, at = zip(*part)
+        cols.append((
+            np.array(u, dtype=np.int64), np.array(t, dtype=np.int64),
+            np.full(len(u), LIKE_WEIGHT, dtype=np.float32),
+            np.array([_utc_seconds(x) for x in at], dtype=np.float64),
+        ))
+    if not cols:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float64)
+    return tuple(np.concatenate(c) for c in zip(*cols))
+
+
+def time_split(users: np.ndarray, items: np.ndarray, ts: np.ndarray, test_fraction: float,
+               max_users: int = 0, seed: int = 0):
+    """Train mask, evaluation user ids and their held-out tracks.
+
+    The cutoff is the ``1 - test_fraction`` quantile of the timestamps. A user's
+    held-out tracks are those first seen after the cutoff (re-listens of
+    training tracks are not counted as hits).
+    """
+    cutoff = float(np.quantile(ts, 1.0 - test_fraction))
+    train = ts < cutoff
+    train_pairs = set(zip(users[train].tolist(), items[train].tolist()))
+    train_users = set(users[train].tolist())
+    truth: dict[int, set[int]] = {}
+    for u, t in zip(users[~train].tolist(), items[~train].tolist()):
+        if u in train_users and (u, t) not in train_pairs:
+            truth.setdefault(u, set()).add(t)
+    eval_users = np.array(sorted(truth), dtype=np.int64)
+    if max_users and len(eval_users) > max_users:
+        eval_users = np.sort(np.random.default_rng(seed).choice(eval_users, max_users, replace=False))
+    return train, cutoff, eval_users, {int(u): np.array(sorted(truth[int(u)]), dtype=np.int64) for u in eval_users}
+
+
+def ranking_metrics(recs: np.ndarray, eval_users: np.ndarray, truth: dict[int, np.ndarray], k: int,
+                    n_catalog: int) -> dict:
+    """recall@k, NDCG@k and coverage for a (users x >=k) matrix of track ids (-1 = empty)."""
+    top = recs[:, :k]
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    recall, ndcg = [], []
+    for row, uid in zip(top, eval_users.tolist()):
+        rel = truth[uid]
+        hits = np.isin(row, rel)
+        recall.append(hits.sum() / len(rel))
+        ideal = discounts[:min(len(rel), k)].sum()
+        ndcg.append((discounts[hits]).sum() / ideal)
+    valid = top[top >= 0]
+    return {
+        f'recall@{k}': round(float(np.mean(recall)), 5) if recall else None,
+        f'ndcg@{k}': round(float(np.mean(ndcg)), 5) if ndcg else None,
+        f'coverage@{k}': round(len(np.unique(valid)) / n_catalog, 5) if n_catalog else None,
+    }
+
+
+def _train_items(users: np.ndarray, items: np.ndarray, strength: np.ndarray, eval_users: np.ndarray,
+                 min_strength: float = 0.0) -> list[np.ndarray]:
+    """Training track ids per evaluation user (optionally only strong positives)."""
+    keep = np.isin(users, eval_users) & (strength >= min_strength)
+    u, t = users[keep], items[keep]
+    order = np.argsort(u, kind='stable')
+    u, t = u[order], t[order]
+    bounds = np.searchsorted(u, np.r_[eval_users, np.iinfo(np.int64).max])
+    return [np.unique(t[bounds[i]:bounds[i + 1]]) for i in range(len(eval_users))]
+
+
+def _pad(rows: list[list[int]], k: int) -> np.ndarray:
+    out = np.full((len(rows), k), -1, dtype=np.int64)
+    for i, r in enumerate(rows):
+        out[i, :len(r)] = r[:k]
+    return out
+
+
+def eval_fallback(db: Session, eval_users: np.ndarray, k: int) -> np.ndarray:
+    snap = CatalogService.load(db, version=1)
+    return _pad([[t for t, _ in RecommendationService._fallback(snap, int(u), k, 1, None)] for u in eval_users], k)
+
+
+def eval_factors(model: FactorModel, vectors: np.ndarray, seen: list[np.ndarray], k: int) -> np.ndarray:
+    excludes = [model.item_indices(s) for s in seen]
+    ids, _ = model.score_vectors(vectors.astype(np.float32), k, excludes)
+    return ids.astype(np.int64)
+
+
+def fit_als(users: np.ndarray, items: np.ndarray, strength: np.ndarray, factors: int, iterations: int,
+            alpha: float = DEFAULT_ALPHA, regularization: float = DEFAULT_REGULARIZATION) -> FactorModel:
+    cui, user_ids, item_ids = build_confidence_matrix(users, items, strength, alpha=alpha)
+    x, y = als_fit(cui, factors=factors, iterations=iterations, regularization=regularization)
+    return FactorModel('eval', x, y, user_ids, item_ids)
+
+
+def benchmark(item_factors: np.ndarray, sizes: list[int], k: int = 20, queries: int = 200,
+              batch: int = 256, seed: int = 0) -> list[dict]:
+    """Latency / throughput of factor scoring at several catalog sizes."""
+    rng = np.random.default_rng(seed)
+    base = np.asarray(item_factors, dtype=np.float32)
+    dim = base.shape[1]
+    scale = float(base.std()) or 1.0
+    results = []
+    for n in sizes:
+        if n <= len(base):
+            items = base[:n]
+        else:
+            items = base[rng.integers(0, len(base), n)] + rng.normal(0, 0.1 * scale, (n, dim)).astype(np.float32)
+        model = FactorModel(f'bench-{n}', np.empty((0, dim), dtype=np.float32), items,
+                            np.empty(0, dtype=np.int64), np.arange(1, n + 1))
+        users = items[rng.integers(0, n, max(queries, batch))] + rng.normal(0, scale, (max(queries, batch), dim)).astype(np.float32)
+        exclude = rng.integers(0, n, 50)
+        lat = []
+        for q in users[:queries]:
+            t0 = time.perf_counter()
+            model.top_k_indices(q, k, exclude=exclude)
+            lat.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        model.score_vectors(users[:batch], k, [exclude] * batch)
+        batch_s = time.perf_counter() - t0
+        lat_ms = np.array(lat) * 1000.0
+        results.append({
+            'items': n,
+            'synthetic': n > len(base),
+            'p50_ms': round(float(np.percentile(lat_ms, 50)), 3),
+            'p99_ms': round(float(np.percentile(lat_ms, 99)), 3),
+            'single_users_per_second': round(queries / (lat_ms.sum() / 1000.0), 1),
+            'batch_users_per_second': round(batch / batch_s, 1) if batch_s > 0 else None,
+        })
+        print(f"[bench] {results[-1]}")
+    return results
+
+
+def evaluate(ks: list[int], test_fraction: float = 0.2, factors: int = 64, iterations: int = 15,
+             max_users: int = 5000, bench_sizes: list[int] | None = None, bench_queries: int = 200,
+             record: bool = True, seed: int = 0):
+    db = SessionLocal()
+    try:
+        users, items, strength, ts = load_timed_feedback(db)
+        if users.size == 0:
+            print("No interactions or likes found; nothing to evaluate.")
+            return None
+        train, cutoff, eval_users, truth = time_split(users, items, ts, test_fraction, max_users, seed)
+        if len(eval_users) == 0:
+            print("No user has feedback on both sides of the split; try a larger --test-fraction.")
+            return None
+        tr_u, tr_i, tr_s = users[train], items[train], strength[train]
+        seen = _train_items(tr_u, tr_i, tr_s, eval_users)
+        n_catalog = len(CatalogService.load(db))
+        kmax = max(ks)
+        metrics: dict = {
+            'cutoff': datetime.fromtimestamp(cutoff, tz=timezone.utc).isoformat(),
+            'test_fraction': test_fraction,
+            'train_rows': int(train.sum()),
+            'test_rows': int((~train).sum()),
+            'eval_users': int(len(eval_users)),
+            'catalog': n_catalog,
+            'engines': {},
+        }
+
+        def record_engine(name: str, recs: np.ndarray, seconds: float, **extra) -> None:
+            res = {'users_per_second': round(len(eval_users) / seconds, 1) if seconds > 0 else None, **extra}
+            for k in ks:
+                res.update(ranking_metrics(recs, eval_users, truth, k, n_catalog))
+            metrics['engines'][name] = res
+            print(f"[eval] {name}: {res}")
+
+        t0 = time.perf_counter()
+        recs = eval_fallback(db, eval_users, kmax)
+        record_engine('fallback', recs, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        als = fit_als(tr_u, tr_i, tr_s, factors, iterations)
+        fit_s = time.perf_counter() - t0
+        rows = np.searchsorted(als.user_ids, eval_users)
+        t0 = time.perf_counter()
+        recs = eval_factors(als, als.user_factors[rows], seen, kmax)
+        record_engine('als', recs, time.perf_counter() - t0, fit_seconds=round(fit_s, 3),
+                      factors=factors, iterations=iterations)
+
+        features = ContentService().reload(db)
+        if features is None:
+            metrics['engines']['content'] = {'skipped': 'no track_features rows'}
+        else:
+            t0 = time.perf_counter()
+            positives = _train_items(tr_u, tr_i, tr_s, eval_users, min_strength=COMPLETED_BONUS)
+            profiles = np.zeros((len(eval_users), features.item_factors.shape[1]), dtype=np.float32)
+            for j, pos in enumerate(positives):
+                prof = ContentService.profile(features, pos if pos.size else seen[j])
+                if prof is not None:
+                    profiles[j] = prof
+            recs = eval_factors(features, profiles, seen, kmax)
+            record_engine('content', recs, time.perf_counter() - t0)
+
+        if bench_sizes:
+            metrics['benchmark'] = benchmark(als.item_factors, bench_sizes, k=kmax, queries=bench_queries, seed=seed)
+        if record:
+            version = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+            db.add(ModelArtifact(model_type='eval', version=version, metrics_json=metrics, path_or_blob=str(ARTIFACT_DIR)))
+            db.commit()
+        print(json.dumps(metrics, indent=2))
+        return metrics
+    finally:
+        db.close()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--k', default='10,20', help='Comma separated cut-offs')
+    p.add_argument('--test-fraction', type=float, default=0.2, help='Newest share of feedback held out')
+    p.add_argument('--factors', type=int, default=64)
+    p.add_argument('--iterations', type=int, default=15)
+    p.add_argument('--max-users', type=int, default=5000, help='Sample of evaluation users (0 = all)')
+    p.add_argument('--bench-sizes', default='10000,100000,1000000', help='Catalog sizes to benchmark ("" = skip)')
+    p.add_argument('--bench-queries', type=int, default=200)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--no-record', action='store_true', help='Do not insert a model_artifacts row')
+    args = p.parse_args()
+    evaluate(
+        [int(k) for k in args.k.split(',') if k],
+        args.test_fraction, args.factors, args.iterations, args.max_users,
+        [int(n) for n in args.bench_sizes.split(',') if n], args.bench_queries,
+        record=not args.no_record, seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
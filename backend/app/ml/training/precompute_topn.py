@@ -0,0 +1,97 @@
+"""Offline top-N recommendations for all active users.
+
+Run (e.g. nightly, after train_mf): python -m app.ml.training.precompute_topn --top-n 100 --active-days 30
+
+Scores users in large batches (one matrix multiply per batch) and writes
+``topn_items_{version}.npy`` (int32 track ids, -1 padded) and
+``topn_scores_{version}.npy`` with one row per model user index. The serving
+model store attaches them to the active version and ``RecommendationService``
+reads them before scoring.
+"""
+from __future__ import annotations
+import argparse
+import os
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from sqlalchemy import select, union
+
+from ...core.db import SessionLocal
+from ...models.music import Interaction, TrackLike, ModelArtifact
+from ...services.model_store import load_factor_model
+from ...services.recommendation_service import RecommendationService
+from .train_mf import ARTIFACT_DIR
+
+
+def active_user_ids(db, days: int) -> np.ndarray:
+    """Users with a play or like in the last ``days`` days (0 = everyone with feedback)."""
+    plays = select(Interaction.user_id)
+    likes = select(TrackLike.user_id)
+    if days > 0:
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        plays = plays.where(Interaction.played_at >= cutoff)
+        likes = likes.where(TrackLike.created_at >= cutoff)
+    return np.array(sorted(db.execute(union(plays, likes)).scalars()), dtype=np.int64)
+
+
+def _save_atomic(path, arr: np.ndarray) -> None:
+    tmp = path.with_name(path.stem + '.tmp.npy')
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+def precompute(top_n: int = 100, active_days: int = 30, batch: int = 1024, record: bool = True):
+    model = load_factor_model(ARTIFACT_DIR, mmap=True)
+    if model is None:
+        print('No trained model found in', ARTIFACT_DIR)
+        return None
+    if len(model.user_ids) == 0:
+        print(f'Model {model.version} has no users, nothing to precompute')
+        return None
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        active = active_user_ids(db, active_days)
+        pos = np.searchsorted(model.user_ids, active)
+        pos[pos >= len(model.user_ids)] = 0
+        rows = pos[model.user_ids[pos] == active] if active.size else pos
+        items = np.full((len(model.user_ids), top_n), -1, dtype=np.int32)
+        scores = np.full((len(model.user_ids), top_n), -np.inf, dtype=np.float32)
+        for s in range(0, len(rows), batch):
+            chunk = rows[s:s + batch]
+            seen = RecommendationService.seen_track_ids_batch(db, model.user_ids[chunk].tolist())
+            excludes = [model.item_indices(seen.get(int(uid), ())) for uid in model.user_ids[chunk]]
+            ids, sc = model.score_users(chunk, top_n, excludes)
+            items[chunk] = ids
+            scores[chunk] = sc
+        _save_atomic(ARTIFACT_DIR / f'topn_items_{model.version}.npy', items)
+        _save_atomic(ARTIFACT_DIR / f'topn_scores_{model.version}.npy', scores)
+        elapsed = time.perf_counter() - t0
+        metrics = {
+            'users': int(len(rows)),
+            'top_n': top_n,
+            'active_days': active_days,
+            'seconds': round(elapsed, 3),
+            'users_per_second': round(len(rows) / elapsed, 1) if elapsed > 0 else None,
+        }
+        if record:
+            db.add(ModelArtifact(model_type='topn', version=model.version, metrics_json=metrics, path_or_blob=str(ARTIFACT_DIR)))
+            db.commit()
+        print(f"Precomputed top-{top_n} for {len(rows)} users of model {model.version}", metrics)
+        return metrics
+    finally:
+        db.close()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--top-n', type=int, default=100)
+    p.add_argument('--active-days', type=int, default=30, help='0 = all users with feedback')
+    p.add_argument('--batch', type=int, default=1024, help='Users scored per matrix multiply')
+    p.add_argument('--no-record', action='store_true', help='Do not insert a model_artifacts row')
+    args = p.parse_args()
+    precompute(args.top_n, args.active_days, args.batch, record=not args.no_record)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,234 @@
-"""ALS / Matrix Factorization training pipeline (placeholder).
-Run: python -m app.ml.training.train_mf
+"""ALS / Matrix Factorization training pipeline.
+
+Implicit-feedback ALS (Hu, Koren & Volinsky 2008) with conjugate-gradient
+updates, trained on the ``interactions`` and ``track_likes`` tables.
+Run: python -m app.ml.training.train_mf [--factors 64 --iterations 15 --threads 4]
 """
 from __future__ import annotations
+import argparse
+import os
+import time
 import numpy as np
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
+from scipy import sparse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ...core.config import get_settings
+from ...core.db import SessionLocal
+from ...models.music import Interaction, TrackLike, ModelArtifact
+from ..feedback import DEFAULT_ALPHA, DEFAULT_REGULARIZATION, LIKE_WEIGHT, confidence, interaction_strength
+from ...services.ann_index import IVFIndex
+
+ARTIFACT_DIR = Path(get_settings().model_dir)
+
+
+def stream_feedback(db: Session, chunk_size: int = 200_000) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Read (user_id, track_id, strength) for all interactions and likes.
+
+    Rows are fetched as plain column tuples in server-side chunks, never as ORM
+    objects, and converted to NumPy per chunk.
+    """
+    users: list[np.ndarray] = []
+    items: list[np.ndarray] = []
+    weights: list[np.ndarray] = []
+    stmt = (
+        select(Interaction.user_id, Interaction.track_id, Interaction.seconds_listened,
+               Interaction.is_completed, Interaction.milestone)
+        .where(Interaction.track_id.is_not(None))
+    )
+    result = db.execute(stmt, execution_options={'yield_per': chunk_size})
+    for part in result.partitions():
+        u, t, secs, done, ms = zip(*part)
+        users.append(np.array(u, dtype=np.int64))
+        items.append(np.array(t, dtype=np.int64))
+        weights.append(interaction_strength(
+            np.array([x or 0 for x in secs], dtype=np.float32),
+            np.array([bool(x) for x in done], dtype=np.float32),
+            np.array([x or 0 for x in ms], dtype=np.float32),
+        ))
+    result = db.execute(select(TrackLike.user_id, TrackLike.track_id), execution_options={'yield_per': chunk_size})
+    for part in result.partitions():
+        u, t = zip(*part)
+        users.append(np.array(u, dtype=np.int64))
+        items.append(np.array(t, dtype=np.int64))
+        weights.append(np.full(len(u), LIKE_WEIGHT, dtype=np.float32))
+    if not users:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+    return np.concatenate(users), np.concatenate(items), np.concatenate(weights)
+
+
+def build_confidence_matrix(
+    user_col: np.ndarray, item_col: np.ndarray, strength: np.ndarray, alpha: float = DEFAULT_ALPHA
+) -> tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """CSR user x item confidence matrix plus sorted index -> id maps.
+
+    Duplicate (user, item) pairs are summed before the confidence transform.
+    """
+    user_ids, u_idx = np.unique(user_col, return_inverse=True)
+    item_ids, i_idx = np.unique(item_col, return_inverse=True)
+    cui = sparse.csr_matrix(
+        (strength.astype(np.float32), (u_idx, i_idx)), shape=(len(user_ids), len(item_ids))
+    )
+    cui.sum_duplicates()
+    cui.data = confidence(cui.data, alpha)
+    return cui, user_ids, item_ids
+
+
+def _cg_update(cui: sparse.csr_matrix, X: np.ndarray, Y: np.ndarray, YtY: np.ndarray,
+               reg: float, rows: slice, cg_steps: int) -> None:
+    """Conjugate-gradient solve of the ALS normal equations for a block of rows of X.
+
+    Solves (YtY + Y^T (C_u - I) Y + reg I) x_u = Y^T C_u p_u for all users in
+    ``rows`` at once, warm-started from the current X.
+    """
+    sub = cui[rows]
+    if sub.shape[0] == 0:
+        return
+    x = X[rows].copy()
+    row_of = np.repeat(np.arange(sub.shape[0]), np.diff(sub.indptr))
+    y_nz = Y[sub.indices]
+    c_minus_1 = sub.data - 1.0
+
+    def matvec(v: np.ndarray) -> np.ndarray:
+        dots = np.einsum('ij,ij->i', y_nz, v[row_of])
+        w = sparse.csr_matrix((c_minus_1 * dots, sub.indices, sub.indptr), shape=sub.shape)
+        return v @ YtY + reg * v + w @ Y
+
+    r = sub @ Y - matvec(x)
+    p = r.copy()
+    rs_old = np.einsum('ij,ij->i', r, r)
+    for _ in range(cg_steps):
+        ap = matvec(p)
+        denom = np.einsum('ij,ij->i', p, ap)
+        step = np.divide(rs_old, denom, out=np.zeros_like(rs_old), where=denom > 1e-12)
+        x += step[:, None] * p
+        r -= step[:, None] * ap
+        rs_new = np.einsum('ij,ij->i', r, r)
+        beta = np.divide(rs_new, rs_old, out=np.zeros_like(rs_new), where=rs_old > 1e-12)
+        p = r + beta[:, None] * p
+        rs_old = rs_new
+    X[rows] = x
+
+
+def _als_half_step(cui: sparse.csr_matrix, X: np.ndarray, Y: np.ndarray, reg: float,
+                   cg_steps: int, pool: ThreadPoolExecutor, block: int) -> None:
+    YtY = (Y.T @ Y).astype(np.float32)
+    blocks = [slice(s, min(s + block, X.shape[0])) for s in range(0, X.shape[0], block)]
+    list(pool.map(lambda rows: _cg_update(cui, X, Y, YtY, reg, rows, cg_steps), blocks))
+
+
+def als_fit(
+    cui: sparse.csr_matrix,
+    factors: int = 64,
+    iterations: int = 15,
+    regularization: float = DEFAULT_REGULARIZATION,
+    cg_steps: int = 3,
+    threads: int | None = None,
+    block_size: int = 2048,
+    seed: int = 42,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fit implicit ALS on a confidence matrix; returns (user_factors, item_factors) float32."""
+    rng = np.random.default_rng(seed)
+    n_users, n_items = cui.shape
+    X = (rng.standard_normal((n_users, factors)) * 0.01).astype(np.float32)
+    Y = (rng.standard_normal((n_items, factors)) * 0.01).astype(np.float32)
+    cui = cui.astype(np.float32)
+    cit = cui.T.tocsr()
+    threads = threads or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in range(iterations):
+            _als_half_step(cui, X, Y, regularization, cg_steps, pool, block_size)
+            _als_half_step(cit, Y, X, regularization, cg_steps, pool, block_size)
+    return X, Y
+
+
+def save_artifacts(version: str, user_factors: np.ndarray, item_factors: np.ndarray,
+                   user_ids: np.ndarray, item_ids: np.ndarray, artifact_dir: Path = ARTIFACT_DIR,
+                   ann: bool = True) -> None:
+    """Write factor arrays + id maps (+ IVF similar-tracks index), then point
+    latest.txt at them (atomic rename) so servers never see a partial version."""
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    np.save(artifact_dir / f"user_factors_{version}.npy", user_factors)
+    np.save(artifact_dir / f"item_factors_{version}.npy", item_factors)
+    np.save(artifact_dir / f"user_ids_{version}.npy", user_ids.astype(np.int64))
+    np.save(artifact_dir / f"item_ids_{version}.npy", item_ids.astype(np.int64))
+    if ann and len(item_factors):
+        IVFIndex.build(item_factors).save(artifact_dir, version)
+    tmp = artifact_dir / 'latest.txt.tmp'
+    tmp.write_text(version)
+    tmp.replace(artifact_dir / 'latest.txt')
+
+
+def train(
+    factors: int = 64,
+    iterations: int = 15,
+    regularization: float = DEFAULT_REGULARIZATION,
+    alpha: float = DEFAULT_ALPHA,
+    cg_steps: int = 3,
+    threads: int | None = None,
+    chunk_size: int = 200_000,
+    record: bool = True,
+):
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        users, items, strength = stream_feedback(db, chunk_size=chunk_size)
+        if users.size == 0:
+            print("No interactions or likes found; nothing to train.")
+            return None
+        cui, user_ids, item_ids = build_confidence_matrix(users, items, strength, alpha=alpha)
+        t_load = time.perf_counter() - t0
+        print(f"Loaded {users.size} feedback rows -> {cui.shape[0]} users x {cui.shape[1]} items, nnz={cui.nnz} ({t_load:.1f}s)")
+
+        t1 = time.perf_counter()
+        user_factors, item_factors = als_fit(
+            cui, factors=factors, iterations=iterations, regularization=regularization,
+            cg_steps=cg_steps, threads=threads,
+        )
+        t_fit = time.perf_counter() - t1
+
+        version = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+        save_artifacts(version, user_factors, item_factors, user_ids, item_ids)
+        metrics = {
+            'users': int(cui.shape[0]),
+            'items': int(cui.shape[1]),
+            'nnz': int(cui.nnz),
+            'feedback_rows': int(users.size),
+            'factors': factors,
+            'iterations': iterations,
+            'regularization': regularization,
+            'alpha': alpha,
+            'cg_steps': cg_steps,
+            'load_seconds': round(t_load, 3),
+            'fit_seconds': round(t_fit, 3),
+        }
+        if record:
+            db.add(ModelArtifact(model_type='als', version=version, metrics_json=metrics, path_or_blob=str(ARTIFACT_DIR)))
+            db.commit()
+        print("Saved factors with timestamp", version, metrics)
+        return version
+    finally:
+        db.close()
 
-ARTIFACT_DIR = Path("app/ml/artifacts")
-ARTIFACT_DIR.mkdir(parents=True, exist_ok=True)
 
-# Placeholder training using random factors
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--factors', type=int, default=64)
+    p.add_argument('--iterations', type=int, default=15)
+    p.add_argument('--regularization', type=float, default=DEFAULT_REGULARIZATION)
+    p.add_argument('--alpha', type=float, default=DEFAULT_ALPHA)
+    p.add_argument('--cg-steps', type=int, default=3)
+    p.add_argument('--threads', type=int, default=None)
+    p.add_argument('--chunk-size', type=int, default=200_000)
+    p.add_argument('--no-record', action='store_true', help='Do not insert a model_artifacts row')
+    args = p.parse_args()
+    train(args.factors, args.iterations, args.regularization, args.alpha, args.cg_steps,
+          args.threads, args.chunk_size, record=not args.no_record)
 
-def train(factors: int = 64, users: int = 100, items: int = 500):
-    user_factors = np.random.rand(users, factors).astype(np.float32)
-    item_factors = np.random.rand(items, factors).astype(np.float32)
-    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-    np.save(ARTIFACT_DIR / f"user_factors_{timestamp}.npy", user_factors)
-    np.save(ARTIFACT_DIR / f"item_factors_{timestamp}.npy", item_factors)
-    (ARTIFACT_DIR / 'latest.txt').write_text(timestamp)
-    print("Saved factors with timestamp", timestamp)
 
 if __name__ == "__main__":
-    train()
+    main()
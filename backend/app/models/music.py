@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from sqlalchemy import String, Integer, ForeignKey, DateTime, Boolean, Float, JSON
+from sqlalchemy import String, Integer, ForeignKey, DateTime, Boolean, Float, JSON, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from typing import Optional
 from datetime import datetime
@@ -108,6 +108,9 @@ class UserFeatures(Base):
     __tablename__ = 'user_features'
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'), primary_key=True)
     latent_vector: Mapped[dict | None] = mapped_column(JSON)
+    # float32 little-endian vector folded in against the item factors of model_version
+    latent_blob: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    model_version: Mapped[str | None] = mapped_column(String(40), nullable=True)
     updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
 
 class ModelArtifact(Base):
@@ -1,234 +1,243 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
 from typing import Optional
-import requests
-from ..services.deezer_service import search_tracks, get_track
+import httpx
+from ..services.deezer_service import DeezerUnavailable, search_tracks, get_track
+from ..services.preview_cache import preview_cache, preview_urls, upstream_headers, UpstreamError
 from sqlalchemy.orm import Session
-from ..core.db import get_db
-from ..models.music import Track
-from pathlib import Path
-import shutil
+from ..core.config import get_settings
+from ..core.db import SessionLocal, get_db
+from ..core.media import serve_file
+from ..models.music import Album, Artist, Track
+from ..services.catalog import catalog_service
 
 router = APIRouter(prefix="/deezer", tags=["deezer"])
+settings = get_settings()
+
+
+def _unavailable(e: DeezerUnavailable) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={'Retry-After': str(max(1, round(e.retry_after)))})
+
+
+def _like_pattern(q: str) -> str:
+    """``%q%`` with LIKE wildcards in ``q`` escaped (use with ``escape='\\'``)."""
+    escaped = q.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _local_tracks(q: Optional[str] = None, track_id: Optional[int] = None, limit: int = 10) -> list[dict]:
+    """Tracks from our own catalog (imported Deezer ids) shaped like Deezer track objects.
+
+    Opens its own session: only needed when the Deezer API is unavailable.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(Track.id, Track.title, Track.duration_ms, Track.preview_url, Track.cover_url,
+                         Artist.id, Artist.name, Album.title).join(Artist, Artist.id == Track.artist_id) \
+            .outerjoin(Album, Album.id == Track.album_id)
+        if track_id is not None:
+            query = query.filter(Track.id == track_id)
+        if q:
+            query = query.filter(Track.title.ilike(_like_pattern(q), escape='\\'))
+        rows = query.limit(limit).all()
+    finally:
+        db.close()
+    return [
+        {'id': tid, 'title': title, 'duration': (duration_ms or 0) // 1000, 'preview': preview,
+         'artist': {'id': artist_id, 'name': artist_name},
+         'album': {'title': album_title, 'cover_medium': cover}}
+        for tid, title, duration_ms, preview, cover, artist_id, artist_name, album_title in rows
+    ]
 
 
 @router.get('/search')
 async def deezer_search(q: str, limit: Optional[int] = 10):
-    """Search Deezer tracks by query string."""
+    """Search Deezer tracks by query string.
+
+    While the Deezer API is unavailable (circuit open / over budget) matching
+    tracks of the local catalog are returned instead, flagged ``fallback``.
+    """
     try:
-        res = search_tracks(q, limit=limit)
-        return res
+        return await run_in_threadpool(search_tracks, q, limit)
+    except DeezerUnavailable:
+        data = await run_in_threadpool(_local_tracks, q, None, min(max(limit or 10, 1), 100))
+        return {'data': data, 'total': len(data), 'fallback': True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get('/track/{track_id}')
 async def deezer_track(track_id: int):
-    """Get Deezer track info (includes preview URL)."""
+    """Get Deezer track info (includes preview URL); the local copy while Deezer is unavailable."""
     try:
-        t = get_track(track_id)
+        t = await run_in_threadpool(get_track, track_id)
         if not t:
             raise HTTPException(status_code=404, detail='Track not found')
         return t
     except HTTPException:
         raise
+    except DeezerUnavailable as e:
+        local = await run_in_threadpool(_local_tracks, None, track_id, 1)
+        if not local:
+            raise _unavailable(e)
+        return {**local[0], 'fallback': True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _resolve_preview_url(db: Session, track_id: int, refresh: bool) -> Optional[str]:
+    """Stored ``Track.preview_url``, re-fetched from the Deezer API only when
+    ``refresh`` is forced, nothing is stored, or the signed URL is (nearly) expired.
+
+    Blocking (requests + DB); called through the threadpool. While the Deezer
+    API is unavailable the stored URL is returned as is (it may still work).
+    """
+    db_track = db.query(Track).filter(Track.id == track_id).first()
+    stored = db_track.preview_url if db_track else None
+    if stored and not refresh and (stored.startswith('/') or preview_urls.is_fresh(track_id, stored)):
+        return stored
+    try:
+        t = get_track(track_id, fresh=refresh)
+    except DeezerUnavailable:
+        if stored:
+            return stored
+        raise
+    if t and t.get('preview'):
+        preview_url = t.get('preview')
+        # If we have a DB row, update stored preview_url if changed
+        if db_track and db_track.preview_url != preview_url:
+            had_preview = db_track.preview_url is not None
+            db_track.preview_url = preview_url
+            db.add(db_track)
+            db.commit()
+            if not had_preview:
+                catalog_service.invalidate(full=True)
+        return preview_url
+    return stored
+
+
+def _refetch_preview_url(db: Session, track_id: int, current: str) -> Optional[str]:
+    """New signed preview URL after an upstream 403 (None if unchanged / unavailable)."""
+    refreshed = get_track(track_id, fresh=True)
+    new_preview = refreshed.get('preview') if refreshed else None
+    if not new_preview or new_preview == current:
+        return None
+    db_track = db.query(Track).filter(Track.id == track_id).first()
+    if db_track:
+        db_track.preview_url = new_preview
+        db.add(db_track)
+        db.commit()
+    return new_preview
+
+
 @router.get('/stream/{track_id}')
-async def deezer_stream(track_id: int, request: Request, db: Session = Depends(get_db), cache: bool = True, refresh: bool = True):
+async def deezer_stream(track_id: int, request: Request, db: Session = Depends(get_db), cache: bool = True, refresh: bool = False):
     """Proxy Deezer track preview as a streaming response.
 
     This avoids CORS or referrer-based blocking on the client by serving the
     preview MP3 through our backend. Only previews (30s mp3) are proxied.
+    Upstream downloads use the shared async client (``preview_cache``); a cache
+    miss starts one download per track that all concurrent plays stream from
+    while it is being written to the local cache.
+
+    A cached file is served without touching the network or the DB. Otherwise
+    the preview URL comes from the in-process freshness cache, then the DB,
+    and the Deezer API is only asked when the signed URL is about to expire,
+    after an upstream 403, or with ``refresh=true``. While the API is
+    unavailable (circuit open / over budget) the stored URL is tried anyway;
+    with none stored the answer is 503 with ``Retry-After``.
+
+    With ``AUDIO_STORAGE=s3`` a preview cached by another node is pulled from
+    the bucket (or, with ``STORAGE_REDIRECT=1``, answered with a 307 to a
+    presigned URL) instead of being downloaded from Deezer again.
     """
     try:
-        # Optionally refresh preview info from Deezer API on every play request.
-        # This ensures we try to use a fresh signed preview URL before streaming.
-        t = get_track(track_id) if refresh else None
-        preview_url = None
-
-        if t and t.get('preview'):
-            preview_url = t.get('preview')
-            # If we have a DB row, update stored preview_url if changed
-            db_track = db.query(Track).filter(Track.id == track_id).first()
-            if db_track and db_track.preview_url != preview_url:
-                db_track.preview_url = preview_url
-                db.add(db_track)
-                db.commit()
-        else:
-            # Fallback: check local DB for a stored preview_url (from our fill script)
-            db_track = db.query(Track).filter(Track.id == track_id).first()
-            if db_track and db_track.preview_url:
-                preview_url = db_track.preview_url
-                # If stored preview is a relative path (eg '/tracks/{id}/preview'), build absolute URL
-                if isinstance(preview_url, str) and preview_url.startswith('/'):
-                    base = str(request.base_url).rstrip('/')
-                    preview_url = base + preview_url
-            else:
-                raise HTTPException(status_code=404, detail='Preview not available')
-        # Local cache path
-        cache_dir = Path(__file__).resolve().parents[2] / 'app' / 'static' / 'audio' / 'deezer'
-        cache_dir.mkdir(parents=True, exist_ok=True)
-        cached_file = cache_dir / f'{track_id}.mp3'
-
-        # If refresh-on-play is enabled and the cached file exists but the
-        # stored preview URL differs from the freshly fetched preview URL,
-        # invalidate the cache so we download the new preview.
-        if refresh and cached_file.exists():
-            try:
-                db_track = db.query(Track).filter(Track.id == track_id).first()
-                stored_preview = db_track.preview_url if db_track else None
-                # If stored preview differs and the fresh preview_url is available, remove cache
-                if stored_preview and preview_url and stored_preview != preview_url:
-                    try:
-                        cached_file.unlink()
-                    except Exception:
-                        pass
-            except Exception:
-                # If any error reading DB or removing file, ignore and continue; we'll attempt to re-download below
-                pass
-
-        if cache and not cached_file.exists():
-            # Download preview into cache. Some CDNs block non-browser clients, so send
-            # browser-like headers (User-Agent, Accept, Referer). If the first attempt
-            # fails, retry once with a Referer header.
-            headers_try = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36',
-                'Accept': 'audio/*,*/*'
-            }
-            tried = False
-            success = False
-            last_exc = None
-            for attempt in range(2):
+        cached_file = preview_cache.locate(track_id)
+        manager = preview_cache.manager
+        if cache and not refresh:
+            resp = None
+            stored = await preview_cache.stored(track_id, redirect=settings.storage_redirect)
+            if isinstance(stored, str):
+                resp = RedirectResponse(stored, status_code=307)
+            elif stored is not None:
                 try:
-                    # add Referer on second attempt
-                    if attempt == 1:
-                        headers_try['Referer'] = 'https://www.deezer.com/'
-                    with requests.get(preview_url, stream=True, timeout=15, headers=headers_try) as resp:
-                        resp.raise_for_status()
-                        tmp = cache_dir / f'{track_id}.tmp'
-                        with tmp.open('wb') as fh:
-                            shutil.copyfileobj(resp.raw, fh)
-                        tmp.replace(cached_file)
-                        success = True
-                        break
-                except requests.exceptions.HTTPError as he:
-                    # Log upstream response when possible; keep last exception for later
-                    last_exc = he
-                    tried = True
-                    resp = getattr(he, 'response', None)
-                    # If upstream returned 403, attempt to refresh preview_url via Deezer API and retry once
-                    if resp is not None and resp.status_code == 403:
-                        try:
-                            refreshed = get_track(track_id)
-                            new_preview = None
-                            if refreshed and refreshed.get('preview'):
-                                new_preview = refreshed.get('preview')
-                            # If we got a new preview different from the current one, update DB and retry
-                            if new_preview and new_preview != preview_url:
-                                db_track = db.query(Track).filter(Track.id == track_id).first()
-                                if db_track:
-                                    db_track.preview_url = new_preview
-                                    db.add(db_track)
-                                    db.commit()
-                                preview_url = new_preview
-                                # retry current attempt with updated preview_url by continuing the loop
-                                continue
-                            # otherwise surface a clearer 403 to client
-                            body = None
-                            try:
-                                body = resp.content.decode('utf-8', errors='replace')
-                            except Exception:
-                                body = '<binary or undecodable body>'
-                            raise HTTPException(status_code=403, detail=f'Upstream CDN returned 403 for preview. Upstream body: {body[:400]}')
-                        except HTTPException:
-                            raise
-                        except Exception:
-                            # if refresh failed, re-raise original HTTPError as 502
-                            raise HTTPException(status_code=502, detail=str(he))
-                except Exception as e:
-                    last_exc = e
-                    tried = True
-
-            if not success:
-                # If caching fails, fall back to proxy streaming with browser-like headers.
-                # This may still fail if the preview URL token is expired.
+                    resp = serve_file(request, stored, 'audio/mpeg')
+                except FileNotFoundError:
+                    pass  # evicted in the meantime
+            if manager is not None:
+                if resp is not None:
+                    manager.hit(track_id)
+                else:
+                    manager.miss(track_id)
+            if resp is not None:
+                return resp
+
+        async def resolve() -> str:
+            preview_url = None if refresh else preview_urls.get(track_id)
+            if preview_url is None:
+                preview_url = await run_in_threadpool(_resolve_preview_url, db, track_id, refresh)
+                if not preview_url:
+                    raise HTTPException(status_code=404, detail='Preview not available')
+                preview_urls.put(track_id, preview_url)
+            # If stored preview is a relative path (eg '/tracks/{id}/preview'), build absolute URL
+            if preview_url.startswith('/'):
+                preview_url = str(request.base_url).rstrip('/') + preview_url
+            return preview_url
+
+        async def open_upstream() -> httpx.Response:
+            preview_url = await resolve()
+            try:
+                return await preview_cache.open(preview_url)
+            except UpstreamError as ue:
+                if ue.status_code != 403:
+                    raise HTTPException(status_code=502, detail=str(ue))
+                # signed URL expired: ask the Deezer API for a fresh one and retry once
+                preview_urls.forget(track_id)
+                new_preview = await run_in_threadpool(_refetch_preview_url, db, track_id, preview_url)
+                if not new_preview:
+                    raise HTTPException(status_code=403, detail=f'Upstream CDN returned 403 for preview. Upstream body: {ue.body}')
+                preview_urls.put(track_id, new_preview)
                 try:
-                    if 'Referer' not in headers_try:
-                        headers_try['Referer'] = 'https://www.deezer.com/'
-                    resp = requests.get(preview_url, stream=True, timeout=15, headers=headers_try)
-                    resp.raise_for_status()
-                    # If caching is disabled, stream directly from upstream
-                    if not cache:
-                        headers = {}
-                        if 'content-length' in resp.headers:
-                            headers['Content-Length'] = resp.headers['content-length']
-                        content_type = resp.headers.get('content-type', 'audio/mpeg')
-                        return StreamingResponse(resp.iter_content(chunk_size=1024), media_type=content_type, headers=headers)
-                    # otherwise the previous code handled writing to tmp -> cached_file and will fallthrough to serve disk file
-                except requests.exceptions.HTTPError as he:
-                    resp = getattr(he, 'response', None)
-                    # If 403, try to refresh preview via Deezer API and retry once
-                    if resp is not None and resp.status_code == 403:
-                        try:
-                            refreshed = get_track(track_id)
-                            new_preview = None
-                            if refreshed and refreshed.get('preview'):
-                                new_preview = refreshed.get('preview')
-                            if new_preview and new_preview != preview_url:
-                                db_track = db.query(Track).filter(Track.id == track_id).first()
-                                if db_track:
-                                    db_track.preview_url = new_preview
-                                    db.add(db_track)
-                                    db.commit()
-                                preview_url = new_preview
-                                # Try one direct proxy with the refreshed URL
-                                try:
-                                    headers_try['Referer'] = 'https://www.deezer.com/'
-                                    resp2 = requests.get(preview_url, stream=True, timeout=15, headers=headers_try)
-                                    resp2.raise_for_status()
-                                    if not cache:
-                                        headers = {}
-                                        if 'content-length' in resp2.headers:
-                                            headers['Content-Length'] = resp2.headers['content-length']
-                                        content_type = resp2.headers.get('content-type', 'audio/mpeg')
-                                        return StreamingResponse(resp2.iter_content(chunk_size=1024), media_type=content_type, headers=headers)
-                                    # if cache enabled, write to disk below via normal path
-                                except Exception as e:
-                                    raise HTTPException(status_code=502, detail=str(e))
-                            # if no new preview, raise clearer 403
-                            body = None
-                            try:
-                                body = resp.content.decode('utf-8', errors='replace')
-                            except Exception:
-                                body = '<binary or undecodable body>'
-                            raise HTTPException(status_code=403, detail=f'Upstream CDN returned 403 for preview. Upstream body: {body[:400]}')
-                        except HTTPException:
-                            raise
-                        except Exception as e:
-                            raise HTTPException(status_code=502, detail=str(e))
-                    # re-raise as a 502 to indicate bad gateway for other HTTP errors
-                    raise HTTPException(status_code=502, detail=str(he))
-                except Exception as e:
-                    # Unknown local error while proxying
-                    raise HTTPException(status_code=500, detail=str(e))
-
-        # Serve cached file (stream from disk)
-        f = cached_file.open('rb')
-        def file_iter():
+                    return await preview_cache.open(new_preview)
+                except (UpstreamError, httpx.HTTPError) as ue2:
+                    raise HTTPException(status_code=502, detail=str(ue2))
+            except httpx.HTTPError as he:
+                raise HTTPException(status_code=502, detail=str(he))
+
+        if not cache:
+            resp = await open_upstream()
+            return StreamingResponse(preview_cache.passthrough(resp), media_type=resp.headers.get('content-type', 'audio/mpeg'),
+                                     headers=upstream_headers(resp))
+        if cached_file is not None and cached_file.exists():
+            # refresh=true only re-validates the stored URL; the cached audio is still good
+            # even when the URL cannot be refreshed (API unavailable, no preview any more)
             try:
-                while True:
-                    chunk = f.read(1024)
-                    if not chunk:
-                        break
-                    yield chunk
-            finally:
-                f.close()
-
-        return StreamingResponse(file_iter(), media_type='audio/mpeg')
+                await resolve()
+            except (DeezerUnavailable, HTTPException):
+                pass
+            try:
+                return serve_file(request, cached_file, 'audio/mpeg')
+            except FileNotFoundError:
+                pass  # evicted in the meantime: download it again below
+        for _ in range(2):
+            dl = await preview_cache.fetch(track_id, open_upstream)
+            if dl is not None:
+                return StreamingResponse(dl.iter_bytes(), media_type=dl.media_type, headers=dl.headers)
+            # finished by a concurrent request in the meantime
+            path = preview_cache.locate(track_id)
+            if path is not None:
+                try:
+                    return serve_file(request, path, 'audio/mpeg')
+                except FileNotFoundError:
+                    pass  # and evicted again before we could open it
+        # the cache keeps losing the file (tiny budget): stream straight from upstream
+        resp = await open_upstream()
+        return StreamingResponse(preview_cache.passthrough(resp), media_type=resp.headers.get('content-type', 'audio/mpeg'),
+                                 headers=upstream_headers(resp))
     except HTTPException:
         raise
+    except DeezerUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,4 +1,7 @@
 from fastapi import APIRouter
+from ..services.model_store import model_store
+from ..services.deezer_service import deezer_client
+from ..services.preview_cache import preview_cache
 
 router = APIRouter(prefix="/health", tags=["health"])
 
@@ -15,6 +18,16 @@ async def root_health():
     """Alias to match older documentation that referenced GET /health.
 
     Some tooling probes /health by default, so we expose both /health and
-    /health/ping returning the same payload.
+    /health/ping returning the same payload, plus the active recommender
+    model version.
     """
-    return {"status": "ok"}
+    return {"status": "ok", "model": model_store.status()}
+
+@router.get("/metrics")
+async def metrics():
+    """Runtime counters: preview cache size / hits / misses / evictions, Deezer API cache hit rate."""
+    manager = preview_cache.manager
+    return {
+        "preview_cache": manager.stats() if manager is not None else None,
+        "deezer_api": deezer_client.stats(),
+    }
@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from ..core.db import get_db
 from ..models.music import Interaction, Track, User
 from ..core.security import decode_token
+from ..services.foldin import foldin_service
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 router = APIRouter(prefix="/interactions", tags=["interactions"])
@@ -55,6 +56,9 @@ def create_interaction(payload: InteractionCreate, user_id: int = Depends(get_cu
     db.add(interaction)
     db.commit()
     db.refresh(interaction)
+    if interaction.track_id is not None:
+        # refresh the user's latent vector off the request path
+        foldin_service.enqueue(user_id)
     return interaction
 
 
@@ -1,18 +1,58 @@
-from fastapi import APIRouter, Depends
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from ..core.db import get_db
 from ..services.recommendation_service import recommendation_service
-from ..schemas.music import RecommendationOut
+from ..schemas.music import RecommendationOut, BatchRecommendIn, UserRecommendationsOut
 
 router = APIRouter(prefix="/recommend", tags=["recommend"])
 
+# most items returned per user (single and batch requests)
+MAX_LIMIT = 200
+
 @router.get("/user/{user_id}", response_model=list[RecommendationOut])
-async def recommend_for_user(
+def recommend_for_user(
     user_id: int,
-    limit: int = 20,
+    response: Response,
+    limit: int = Query(20, ge=1, le=MAX_LIMIT),
     start_id: int = 1,
     max_track_id: int | None = None,
+    explicit: bool = True,
     db: Session = Depends(get_db),
 ):
-    scores = recommendation_service.recommend_for_user(db, user_id, limit, start_id=start_id, max_track_id=max_track_id)
+    # sync handler: numpy scoring + DB lookup run in the threadpool, not on the event loop
+    timings: dict[str, float] = {}
+    scores = recommendation_service.recommend_for_user(
+        db, user_id, limit, start_id=start_id, max_track_id=max_track_id, allow_explicit=explicit, timings=timings,
+    )
+    # per-stage timings (ms) for browser devtools / load tests
+    response.headers["Server-Timing"] = ", ".join(f"{name};dur={ms:.3f}" for name, ms in timings.items())
+    return [{"track_id": tid, "score": score} for tid, score in scores]
+
+MAX_BATCH_USERS = 1000
+
+@router.post("/batch", response_model=list[UserRecommendationsOut])
+def recommend_batch(payload: BatchRecommendIn, db: Session = Depends(get_db)):
+    """Recommendations for many users in one call (scored as one matrix multiply)."""
+    if len(payload.user_ids) > MAX_BATCH_USERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_USERS} user_ids per batch")
+    limit = min(max(payload.limit, 1), MAX_LIMIT)
+    results = recommendation_service.recommend_batch(db, payload.user_ids, limit)
+    return [
+        {"user_id": uid, "items": [{"track_id": tid, "score": score} for tid, score in items]}
+        for uid, items in results.items()
+    ]
+
+@router.get("/similar/{track_id}", response_model=list[RecommendationOut])
+def similar_tracks(track_id: int, limit: int = 20, mode: Literal['ann', 'exact'] = 'ann',
+                   nprobe: int = Query(8, ge=1)):
+    """Tracks similar to ``track_id`` (cosine over item factors).
+
+    mode: 'ann' (IVF index, default) | 'exact' (brute force, for recall checks)
+    """
+    limit = min(max(limit, 1), 200)
+    scores = recommendation_service.similar_tracks(track_id, limit, exact=mode == 'exact', nprobe=nprobe)
+    if scores is None:
+        raise HTTPException(status_code=404, detail="Track not in recommendation model")
     return [{"track_id": tid, "score": score} for tid, score in scores]
@@ -1,90 +1,258 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, UploadFile, File, Form
-from fastapi.responses import FileResponse
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, RedirectResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from ..core.config import get_settings
 from ..core.db import get_db
-from ..models.music import Track, TrackLike
-import math
-from io import BytesIO
-import struct
+from ..core.media import serve_bytes, serve_file, sine_wav
+from ..models.music import Album, Artist, Track, TrackLike
+import base64
+import hashlib
 import os
+import uuid
+from functools import lru_cache
 from typing import List
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from ..core.security import decode_token
-from ..schemas.music import TrackOut
+from ..schemas.music import TrackBatchIn, TrackBriefOut, TrackOut
+from ..services.catalog import catalog_service
+from ..services.foldin import foldin_service
+from ..services.search_index import search_service
+from ..services.storage import audio_files, audio_storage, media_type
+from ..services.upload_jobs import upload_jobs
 
 router = APIRouter(prefix="/tracks", tags=["tracks"])
+settings = get_settings()
 auth_scheme = HTTPBearer()
 
+# columns of TrackOut: list endpoints select these instead of loading ORM objects
+TRACK_COLUMNS = (Track.id, Track.title, Track.artist_id, Track.album_id, Track.duration_ms,
+                 Track.preview_url, Track.cover_url)
+
+
+def _encode_cursor(last_id: int, descending: bool) -> str:
+    raw = f"{'d' if descending else 'a'}{last_id}".encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[int, bool]:
+    """(last id of the previous page, descending)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        if raw[:1] not in ('a', 'd'):
+            raise ValueError(raw)
+        return int(raw[1:]), raw[0] == 'd'
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
 @router.get("/", response_model=list[TrackOut])
-async def list_tracks(
+def list_tracks(
+    response: Response,
     db: Session = Depends(get_db),
     limit: int = 50,
+    cursor: str | None = None,
     offset: int = 0,
     order: str = 'desc',
 ):
-    """List tracks with simple offset pagination.
+    """List tracks with keyset pagination on id.
 
     Params:
       - limit: max rows (capped at 200)
-      - offset: skip rows
+      - cursor: ``X-Next-Cursor`` header of the previous page (sent while more rows may follow);
+        it carries the sort order, so ``order`` is ignored with it
+      - offset: skip rows (older clients; translated to an id bound via the catalog snapshot)
       - order: 'asc' | 'desc' by id (defaults to newest first)
+
+    Every page is one range scan of the primary key, so deep pages cost the
+    same as the first. Tracks without a stored ``preview_url`` but with an
+    audio file on disk get ``/tracks/{id}/preview`` (from the in-memory file
+    index; nothing is written back).
     """
     limit = min(max(limit, 1), 200)
-    base = db.query(Track)
-    if order.lower() == 'asc':
-        base = base.order_by(Track.id.asc())
+    stmt = select(*TRACK_COLUMNS)
+    if cursor:
+        after, descending = _decode_cursor(cursor)
+        stmt = stmt.where(Track.id < after if descending else Track.id > after)
     else:
-        base = base.order_by(Track.id.desc())
-    rows = base.offset(offset).limit(limit).all()
-    # Ensure preview_url fallback if none stored and file exists
-    dirty = False
-    for t in rows:
-        if not t.preview_url:
-            for ext in ('wav','mp3'):
-                file_path = f'app/static/audio/{t.id}.{ext}'
-                if os.path.exists(file_path):
-                    t.preview_url = f'/tracks/{t.id}/preview'
-                    dirty = True
-                    break
-    if dirty:
+        descending = order.lower() != 'asc'
+        if offset > 0:
+            bound = catalog_service.get().id_at_offset(offset, descending=descending)
+            if bound is None:
+                return []
+            stmt = stmt.where(Track.id <= bound if descending else Track.id >= bound)
+    stmt = stmt.order_by(Track.id.desc() if descending else Track.id.asc()).limit(limit)
+    rows = db.execute(stmt).all()
+    if len(rows) == limit:
+        response.headers['X-Next-Cursor'] = _encode_cursor(rows[-1].id, descending)
+    return [_row_out(row) for row in rows]
+
+
+def _row_out(row) -> dict:
+    """Selected columns as a dict; tracks with only an audio file on disk get the local preview URL."""
+    item = dict(row._mapping)
+    if not item['preview_url'] and item['id'] in audio_files:
+        item['preview_url'] = f"/tracks/{item['id']}/preview"
+    return item
+
+
+BATCH_MAX_IDS = 500
+
+
+@router.post('/batch', response_model=list[TrackBriefOut])
+def tracks_batch(body: TrackBatchIn, db: Session = Depends(get_db)):
+    """Many tracks in one round-trip (recommendation and playlist screens).
+
+    One ``IN`` query joined with the artist and album names; rows come back
+    in request order, unknown ids are left out and repeated ids appear once.
+    Serialized with orjson, at most ``BATCH_MAX_IDS`` ids per call.
+    """
+    ids = list(dict.fromkeys(body.ids))
+    if len(ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f'At most {BATCH_MAX_IDS} ids per request')
+    if not ids:
+        return ORJSONResponse([])
+    stmt = (
+        select(*TRACK_COLUMNS, Artist.name.label('artist_name'), Album.title.label('album_title'))
+        .join(Artist, Artist.id == Track.artist_id, isouter=True)
+        .join(Album, Album.id == Track.album_id, isouter=True)
+        .where(Track.id.in_(ids))
+    )
+    found = {row.id: row for row in db.execute(stmt)}
+    return ORJSONResponse([_row_out(found[tid]) for tid in ids if tid in found])
+
+# deepest result reachable through /tracks/search paging
+SEARCH_MAX_RESULTS = 500
+
+
+@router.get('/search', response_model=list[TrackOut])
+def search_tracks(q: str, limit: int = 20, offset: int = 0, db: Session = Depends(get_db)):
+    """Typeahead search over track titles, artist names and album titles.
+
+    Served from the in-process index (``services/search_index``): every word
+    must match, the last one also as a prefix; misspelt words fall back to
+    trigram similarity. Best matches first, at most 100 per page and
+    ``SEARCH_MAX_RESULTS`` in total (``offset`` pages through them).
+    """
+    limit = min(max(limit, 1), 100)
+    offset = max(offset, 0)
+    if offset >= SEARCH_MAX_RESULTS:
+        return []
+    hits = search_service.get().search(q, limit=min(offset + limit, SEARCH_MAX_RESULTS) * 2)
+    if not hits:
+        return []
+    ids = [tid for tid, _ in hits]
+    # the index keeps deleted tracks; drop them via the catalog snapshot
+    ids = [tid for tid, live in zip(ids, catalog_service.get().contains(ids)) if live]
+    ids = ids[offset:min(offset + limit, SEARCH_MAX_RESULTS)]
+    if not ids:
+        return []
+    rows = {row.id: row for row in db.execute(select(*TRACK_COLUMNS).where(Track.id.in_(ids)))}
+    return [_row_out(rows[tid]) for tid in ids if tid in rows]
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+COVER_MAX_BYTES = 10 * 1024 * 1024
+COVER_DIR = 'app/static/covers'
+
+
+async def _save_upload(upload: UploadFile, path, limit: int) -> int:
+    """Copy an upload to ``path`` in chunks (off the event loop); 413 past ``limit`` bytes."""
+    size = 0
+    try:
+        async with await anyio.open_file(path, 'wb') as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=f'File larger than {limit} bytes')
+                await out.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        raise
+    return size
+
+
+def _create_uploaded_track(db: Session, title: str, artist_id: int, duration_ms: int | None,
+                           cover: tuple[str, str] | None) -> Track:
+    """Insert the track row; ``cover`` is a staged (path, ext) renamed to the track id.
+
+    Blocking (SQLAlchemy session); called through the threadpool.
+    """
+    try:
+        track = Track(title=title, artist_id=artist_id, album_id=None, duration_ms=duration_ms or 0,
+                      preview_url=None, cover_url=None, is_explicit=False)
+        db.add(track)
+        db.flush()  # assigns the id
+        if cover:
+            staged_cover, cover_ext = cover
+            os.replace(staged_cover, os.path.join(COVER_DIR, f'{track.id}{cover_ext}'))
+            track.cover_url = f'/static/covers/{track.id}{cover_ext}'
         db.commit()
-    return rows
+        db.refresh(track)
+    except BaseException:
+        db.rollback()
+        raise
+    return track
+
 
-@router.post('/upload', response_model=TrackOut)
+@router.post('/upload', response_model=TrackOut, status_code=202)
 async def upload_track(
+    response: Response,
     title: str = Form(...),
     artist_id: int = Form(...),
-    duration_ms: int = Form(...),
+    duration_ms: int | None = Form(None),
     audio: UploadFile = File(...),
     cover: UploadFile | None = File(None),
     db: Session = Depends(get_db),
 ):
-    # Save audio file as {new_id}.wav (or keep extension)
-    track = Track(title=title, artist_id=artist_id, album_id=None, duration_ms=duration_ms, preview_url=None, cover_url=None, is_explicit=False)
-    db.add(track)
-    db.commit()
-    db.refresh(track)
-    audio_dir = 'app/static/audio'
-    os.makedirs(audio_dir, exist_ok=True)
-    ext = os.path.splitext(audio.filename or '')[1] or '.wav'
-    audio_path = os.path.join(audio_dir, f'{track.id}{ext}')
-    with open(audio_path, 'wb') as f:
-        f.write(await audio.read())
-    # set preview_url
-    track.preview_url = f'/tracks/{track.id}/preview'
-    if cover:
-        cover_dir = 'app/static/covers'
-        os.makedirs(cover_dir, exist_ok=True)
-        cover_ext = os.path.splitext(cover.filename or '')[1] or '.jpg'
-        cover_path = os.path.join(cover_dir, f'{track.id}{cover_ext}')
-        with open(cover_path, 'wb') as f:
-            f.write(await cover.read())
-        track.cover_url = f'/static/covers/{track.id}{cover_ext}'
-    db.add(track)
-    db.commit()
-    db.refresh(track)
+    """Create the track and queue its audio for processing.
+
+    The audio is streamed to a staging file (capped at ``UPLOAD_MAX_BYTES``);
+    duration, bitrate and the preview file are filled in by a background job
+    whose state is at ``GET /tracks/{id}/upload-status`` (``Location`` header).
+    ``duration_ms`` from the client is only a placeholder until then.
+
+    Files are written asynchronously before the row is inserted (in the
+    threadpool), so the event loop never waits on the database.
+    """
+    ext = (os.path.splitext(audio.filename or '')[1] or '.wav').lower()
+    if not upload_jobs.can_store(ext):
+        raise HTTPException(status_code=415, detail=f'Unsupported audio format {ext}')
+    staged = audio_storage.staging_path(ext)
+    staged_cover = None
+    await _save_upload(audio, staged, settings.upload_max_bytes)
+    try:
+        if cover:
+            os.makedirs(COVER_DIR, exist_ok=True)
+            cover_ext = os.path.splitext(cover.filename or '')[1] or '.jpg'
+            cover_tmp = os.path.join(COVER_DIR, f'.{uuid.uuid4().hex}{cover_ext}.tmp')
+            await _save_upload(cover, cover_tmp, COVER_MAX_BYTES)
+            staged_cover = (cover_tmp, cover_ext)
+        track = await run_in_threadpool(_create_uploaded_track, db, title, artist_id, duration_ms, staged_cover)
+    except BaseException:
+        staged.unlink(missing_ok=True)
+        if staged_cover is not None and os.path.exists(staged_cover[0]):
+            os.unlink(staged_cover[0])
+        raise
+    upload_jobs.submit(track.id, staged, ext)
+    catalog_service.invalidate()
+    search_service.invalidate()
+    response.headers['Location'] = f'/tracks/{track.id}/upload-status'
     return track
 
+
+@router.get('/{track_id}/upload-status')
+def upload_status(track_id: int):
+    """State of the background processing of an upload (this API process only)."""
+    job = upload_jobs.status(track_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='No upload job for this track')
+    return job
+
 @router.post('/bulk', response_model=list[TrackOut])
 async def bulk_create_tracks(
     titles: List[str] = Form(...),
@@ -102,53 +270,37 @@ async def bulk_create_tracks(
     db.commit()
     for tr in created:
         db.refresh(tr)
+    catalog_service.invalidate()
+    search_service.invalidate()
     return created
 
+# tracks without audio get one of TONE_VARIANTS generated tones (frequency from track_id % TONE_VARIANTS)
+TONE_VARIANTS = 5
+
+
+@lru_cache(maxsize=TONE_VARIANTS)
+def _preview_tone(variant: int) -> tuple[bytes, str]:
+    """5 s 44.1 kHz tone WAV and its ETag, built once per process."""
+    data = sine_wav(440.0 + variant * 110)
+    return data, f'"tone-{variant}-{hashlib.blake2b(data, digest_size=8).hexdigest()}"'
+
+
 @router.api_route('/{track_id}/preview', methods=['GET', 'HEAD'])
-def track_preview(track_id: int, db: Session = Depends(get_db)):
-    track = db.query(Track).filter(Track.id == track_id).first()
-    if not track:
-        raise HTTPException(status_code=404, detail='Track not found')
+def track_preview(track_id: int, request: Request, db: Session = Depends(get_db)):
+    # live ids come from the in-memory catalog; only ids it does not know hit the DB
+    if not catalog_service.get().contains([track_id])[0]:
+        track = db.query(Track.id).filter(Track.id == track_id).first()
+        if not track:
+            raise HTTPException(status_code=404, detail='Track not found')
     # If a real audio file exists (wav or mp3) serve it instead of generated tone
-    for ext, mime in [('wav','audio/wav'), ('mp3','audio/mpeg')]:
-        static_path = f'app/static/audio/{track_id}.{ext}'
-        if os.path.exists(static_path):
-            return FileResponse(static_path, media_type=mime)
-    # Simple generated sine wave tone 5 seconds, 44.1kHz, 16-bit mono
-    sample_rate = 44100
-    duration_s = 5
-    freq = 440.0 + (track_id % 5) * 110  # vary a little
-    num_samples = sample_rate * duration_s
-    amplitude = 16000
-    buf = BytesIO()
-    # WAV header
-    def write_fmt(fmt, *vals):
-        buf.write(struct.pack(fmt, *vals))
-    # RIFF header
-    buf.write(b'RIFF')
-    buf.write(b'0000')  # placeholder for size
-    buf.write(b'WAVE')
-    # fmt chunk
-    buf.write(b'fmt ')
-    write_fmt('<I', 16)  # PCM chunk size
-    write_fmt('<H', 1)   # PCM format
-    write_fmt('<H', 1)   # channels
-    write_fmt('<I', sample_rate)
-    write_fmt('<I', sample_rate * 2)  # byte rate (sample_rate * block_align)
-    write_fmt('<H', 2)   # block align (channels * bytes/sample)
-    write_fmt('<H', 16)  # bits per sample
-    # data chunk
-    buf.write(b'data')
-    buf.write(b'0000')  # placeholder for data size
-    for n in range(num_samples):
-        sample = int(amplitude * math.sin(2 * math.pi * freq * (n / sample_rate)))
-        write_fmt('<h', sample)
-    data = buf.getvalue()
-    # fill sizes
-    data_size = num_samples * 2
-    riff_size = 4 + (8 + 16) + (8 + data_size)
-    data = data[:4] + struct.pack('<I', riff_size) + data[8:40] + struct.pack('<I', data_size) + data[44:]
-    return Response(content=data, media_type='audio/wav')
+    for ext in ('wav', 'mp3'):
+        found = audio_storage.resolve(f'{track_id}.{ext}', redirect=settings.storage_redirect)
+        if isinstance(found, str):
+            return RedirectResponse(found, status_code=307)
+        if found is not None:
+            return serve_file(request, found, media_type(found.name))
+    data, etag = _preview_tone(track_id % TONE_VARIANTS)
+    return serve_bytes(request, data, 'audio/wav', etag=etag)
 
 def _current_user_id(cred: HTTPAuthorizationCredentials = Depends(auth_scheme)) -> int:
     sub = decode_token(cred.credentials)
@@ -167,6 +319,7 @@ def like_track(track_id: int, db: Session = Depends(get_db), user_id: int = Depe
     like = TrackLike(user_id=user_id, track_id=track_id)
     db.add(like)
     db.commit()
+    foldin_service.enqueue(user_id)
     return {"liked": True}
 
 @router.delete('/{track_id}/like')
@@ -176,6 +329,7 @@ def unlike_track(track_id: int, db: Session = Depends(get_db), user_id: int = De
         raise HTTPException(status_code=404, detail="Not liked")
     db.delete(row)
     db.commit()
+    foldin_service.enqueue(user_id)
     return {"liked": False}
 
 @router.get('/liked')
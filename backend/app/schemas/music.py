@@ -13,10 +13,26 @@ class TrackOut(BaseModel):
     class Config:
         from_attributes = True
 
+class TrackBriefOut(TrackOut):
+    """TrackOut plus display names, for screens that render many tracks at once."""
+    artist_name: Optional[str] = None
+    album_title: Optional[str] = None
+
+class TrackBatchIn(BaseModel):
+    ids: list[int]
+
 class RecommendationOut(BaseModel):
     track_id: int
     score: float
 
+class BatchRecommendIn(BaseModel):
+    user_ids: list[int]
+    limit: int = 20
+
+class UserRecommendationsOut(BaseModel):
+    user_id: int
+    items: list[RecommendationOut]
+
 class PlaylistOut(BaseModel):
     id: int
     name: str
@@ -0,0 +1,115 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index over item vectors.
+
+Cosine similarity. Items are clustered with spherical k-means; a query scores
+the centroids, probes the ``nprobe`` closest lists and ranks only their members.
+Built offline by ``app.ml.training.build_ann`` next to the factor artifacts and
+persisted as ``ann_{centroids,order,offsets,norms}_{version}.npy``.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .model_store import select_top_k
+
+ANN_PARTS = ('centroids', 'order', 'offsets', 'norms')
+
+
+def _normalize(x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    norms = np.linalg.norm(x, axis=1).astype(np.float32)
+    safe = np.where(norms > 0, norms, 1.0)
+    return (x / safe[:, None]).astype(np.float32), norms
+
+
+def spherical_kmeans(x: np.ndarray, n_clusters: int, iterations: int = 20,
+                     sample: int = 256, seed: int = 0) -> np.ndarray:
+    """Centroids (unit length) of L2-normalized rows, trained on a sample."""
+    rng = np.random.default_rng(seed)
+    n = x.shape[0]
+    train = x[rng.choice(n, size=min(n, n_clusters * sample), replace=False)]
+    centroids = train[rng.choice(train.shape[0], size=n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty clusters from random training points
+            sums[empty] = train[rng.choice(train.shape[0], size=int(empty.sum()), replace=False)]
+        centroids, _ = _normalize(sums)
+    return centroids
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    out = np.empty(x.shape[0], dtype=np.int32)
+    for s in range(0, x.shape[0], batch):
+        out[s:s + batch] = np.argmax(x[s:s + batch] @ centroids.T, axis=1)
+    return out
+
+
+class IVFIndex:
+    """IVF lists over the rows of an item-vector matrix (row index = item index)."""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, norms: np.ndarray):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.norms = norms
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_lists: Optional[int] = None, iterations: int = 20, seed: int = 0) -> 'IVFIndex':
+        unit, norms = _normalize(np.asarray(vectors, dtype=np.float32))
+        n = unit.shape[0]
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(n))
+        n_lists = max(1, min(n_lists, n))
+        centroids = spherical_kmeans(unit, n_lists, iterations=iterations, seed=seed)
+        assign = _assign(unit, centroids)
+        order = np.argsort(assign, kind='stable').astype(np.int64)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=offsets[1:])
+        return cls(centroids, order, offsets, norms)
+
+    def save(self, model_dir: Path, version: str) -> None:
+        for part in ANN_PARTS:
+            np.save(model_dir / f'ann_{part}_{version}.npy', getattr(self, part))
+
+    @classmethod
+    def load(cls, model_dir: Path, version: str, mmap: bool = True) -> Optional['IVFIndex']:
+        paths = [model_dir / f'ann_{part}_{version}.npy' for part in ANN_PARTS]
+        if not all(p.exists() for p in paths):
+            return None
+        mode = 'r' if mmap else None
+        return cls(*(np.load(p, mmap_mode=mode) for p in paths))
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, k: int, nprobe: int = 8,
+               exclude: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k item indices and cosine scores for ``query``."""
+        q = query / (np.linalg.norm(query) or 1.0)
+        probe = select_top_k(self.centroids @ q, max(1, min(nprobe, self.n_lists)))
+        cand = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        if exclude is not None and exclude.size:
+            cand = cand[~np.isin(cand, exclude)]
+        if cand.size == 0:
+            return cand, np.empty(0, dtype=np.float32)
+        scores = (vectors[cand] @ q) / np.where(self.norms[cand] > 0, self.norms[cand], 1.0)
+        top = select_top_k(scores, k)
+        return cand[top], scores[top]
+
+
+def brute_force_search(vectors: np.ndarray, norms: np.ndarray, query: np.ndarray, k: int,
+                       exclude: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+    """Exact cosine top-k over every row (reference for recall benchmarks)."""
+    q = query / (np.linalg.norm(query) or 1.0)
+    scores = (vectors @ q) / np.where(norms > 0, norms, 1.0)
+    if exclude is not None and exclude.size:
+        scores[exclude] = -np.inf
+    top = select_top_k(scores, k)
+    return top, scores[top]
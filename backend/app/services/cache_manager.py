@@ -0,0 +1,213 @@
+"""Byte-budgeted eviction for the preview audio cache.
+
+Keeps an in-memory index ``track_id -> [size, last_access, hits]`` of the
+cached previews, persisted to a small JSON sidecar (``.index.json``) so
+access history survives restarts. A background thread saves the index when it
+changed and, once the cache grows past ``max_bytes``, deletes the least
+recently used (``lru``) or least frequently used (``lfu``, ties by recency)
+files down to ``LOW_WATERMARK`` of the budget. Files are found and deleted
+through the cache's ``LocalStorage`` (sharded layout).
+
+Hits only update the entry in place (no lock, no I/O); adds, removals and
+evictions take the lock. Counters are exposed through ``stats()``.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .storage import LocalStorage
+
+SIDECAR_NAME = '.index.json'
+# evict down to this fraction of the budget so eviction does not run on every add
+LOW_WATERMARK = 0.9
+# leftovers of crashed downloads older than this are removed on startup
+STALE_TMP_SECONDS = 3600
+
+
+class CacheManager:
+    def __init__(self, storage: LocalStorage, max_bytes: int = 0, policy: str = 'lru', sweep_seconds: float = 30.0):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'unknown cache policy {policy!r}')
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.sweep_seconds = sweep_seconds
+        self._entries: dict[int, list] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._loaded = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0}
+
+    @property
+    def cache_dir(self) -> Path:
+        return self.storage.root
+
+    @property
+    def sidecar(self) -> Path:
+        return self.cache_dir / SIDECAR_NAME
+
+    @staticmethod
+    def _track_id(name: str) -> Optional[int]:
+        stem, _, ext = name.partition('.')
+        return int(stem) if ext == 'mp3' and stem.isdigit() else None
+
+    def load(self) -> None:
+        """Read the sidecar and reconcile it with the files actually on disk (one scan of the shards)."""
+        saved: dict = {}
+        try:
+            saved = json.loads(self.sidecar.read_text()).get('entries', {})
+        except (OSError, ValueError):
+            pass
+        entries: dict[int, list] = {}
+        now = time.time()
+        for e in self.storage.scan():
+            if e.name.endswith('.tmp'):
+                try:
+                    if now - e.stat().st_mtime > STALE_TMP_SECONDS:
+                        os.unlink(e.path)
+                except OSError:
+                    pass
+                continue
+            tid = self._track_id(e.name)
+            if tid is None:
+                continue
+            st = e.stat()
+            prev = saved.get(str(tid))
+            last, hits = (prev[1], prev[2]) if prev else (st.st_mtime, 0)
+            entries[tid] = [st.st_size, last, hits]
+        with self._lock:
+            self._entries = entries
+            self._bytes = sum(v[0] for v in entries.values())
+            self._dirty = True
+            self._loaded = True
+
+    def hit(self, track_id: int) -> None:
+        self.counters['hits'] += 1
+        entry = self._entries.get(track_id)
+        if entry is not None:
+            entry[1] = time.time()
+            entry[2] += 1
+            self._dirty = True
+
+    def miss(self, track_id: int) -> None:
+        self.counters['misses'] += 1
+
+    def added(self, track_id: int, size: int) -> None:
+        """A file finished downloading into the cache."""
+        with self._lock:
+            old = self._entries.get(track_id)
+            hits = old[2] if old else 0
+            self._bytes += size - (old[0] if old else 0)
+            self._entries[track_id] = [size, time.time(), hits + 1]
+            self._dirty = True
+        if self.max_bytes and self._bytes > self.max_bytes:
+            self._wake.set()
+
+    def removed(self, track_id: int) -> None:
+        with self._lock:
+            old = self._entries.pop(track_id, None)
+            if old is not None:
+                self._bytes -= old[0]
+                self._dirty = True
+
+    def victims(self, need: int) -> list[int]:
+        """Track ids to delete to free at least ``need`` bytes, per the policy."""
+        with self._lock:
+            if need <= 0 or not self._entries:
+                return []
+            ids = np.fromiter(self._entries.keys(), dtype=np.int64, count=len(self._entries))
+            vals = np.array(list(self._entries.values()), dtype=np.float64)
+        if self.policy == 'lfu':
+            order = np.lexsort((vals[:, 1], vals[:, 2]))
+        else:
+            order = np.argsort(vals[:, 1], kind='stable')
+        freed = np.cumsum(vals[order, 0])
+        n = int(np.searchsorted(freed, need, side='left')) + 1
+        return ids[order[:n]].tolist()
+
+    def evict(self) -> int:
+        """Delete files until the cache is under ``LOW_WATERMARK`` of the budget; returns bytes freed."""
+        if not self.max_bytes or self._bytes <= self.max_bytes:
+            return 0
+        freed = 0
+        for tid in self.victims(self._bytes - int(self.max_bytes * LOW_WATERMARK)):
+            entry = self._entries.get(tid)
+            if entry is None:
+                continue
+            try:
+                self.storage.delete(f'{tid}.mp3')
+            except OSError as e:
+                print(f"[cache] cannot evict {tid}: {e}")
+                continue
+            self.removed(tid)
+            freed += entry[0]
+            self.counters['evictions'] += 1
+        self.counters['evicted_bytes'] += freed
+        return freed
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        with self._lock:
+            data = {'version': 1, 'entries': {str(k): v for k, v in self._entries.items()}}
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = self.sidecar.with_name(SIDECAR_NAME + '.tmp')
+            tmp.write_text(json.dumps(data, separators=(',', ':')))
+            os.replace(tmp, self.sidecar)
+        except OSError as e:
+            self._dirty = True
+            print(f"[cache] cannot save index: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {
+            'policy': self.policy,
+            'max_bytes': self.max_bytes,
+            'bytes': self._bytes,
+            'files': len(self._entries),
+            'hit_ratio': round(self.counters['hits'] / lookups, 4) if lookups else None,
+            **self.counters,
+        }
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='preview-cache-manager', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.save()
+
+    def _run(self) -> None:
+        if not self._loaded:
+            try:
+                self.load()
+            except OSError as e:
+                print(f"[cache] cannot index {self.cache_dir}: {e}")
+        while not self._stop.is_set():
+            try:
+                self.evict()
+                self.save()
+            except Exception as e:
+                print(f"[cache] sweep failed: {e}")
+            self._wake.wait(self.sweep_seconds)
+            self._wake.clear()
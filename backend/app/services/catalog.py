@@ -0,0 +1,224 @@
+"""In-memory snapshot of the live track catalog.
+
+A sorted NumPy array of existing track ids plus per-track flags, shared by the
+recommender (candidate generation / filtering of deleted ids) and the list
+endpoints, so neither needs a per-request SQL probe of the tracks table.
+
+Refresh is incremental: rows with ``id > max_id`` are appended, and a row count
+check catches deletions (e.g. ``tools/prune_tracks_keep_first_n.py``), which
+trigger a full reload. A periodic full reload also picks up changed flags.
+Refreshes run on a background watcher thread; requests read the last snapshot.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..core.db import SessionLocal
+from ..models.music import Track
+
+
+class CatalogSnapshot:
+    """Immutable view of the catalog; arrays are aligned and sorted by id."""
+
+    def __init__(self, ids: np.ndarray, has_preview: np.ndarray, is_explicit: np.ndarray,
+                 artist_ids: np.ndarray, version: int = 0):
+        self.ids = ids
+        self.has_preview = has_preview
+        self.is_explicit = is_explicit
+        self.artist_ids = artist_ids
+        self.version = version
+
+    @classmethod
+    def empty(cls) -> 'CatalogSnapshot':
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=bool), np.empty(0, dtype=bool), np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple], version: int) -> 'CatalogSnapshot':
+        if not rows:
+            snap = cls.empty()
+            snap.version = version
+            return snap
+        ids, preview, explicit, artists = zip(*rows)
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array([bool(x) for x in preview], dtype=bool),
+            np.array([bool(x) for x in explicit], dtype=bool),
+            np.array(artists, dtype=np.int64),
+            version,
+        )
+
+    def extended(self, other: 'CatalogSnapshot', version: int) -> 'CatalogSnapshot':
+        return CatalogSnapshot(
+            np.concatenate([self.ids, other.ids]),
+            np.concatenate([self.has_preview, other.has_preview]),
+            np.concatenate([self.is_explicit, other.is_explicit]),
+            np.concatenate([self.artist_ids, other.artist_ids]),
+            version,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def max_id(self) -> int:
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    def id_slice(self, start_id: int = 1, max_id: Optional[int] = None) -> np.ndarray:
+        """Live ids in [start_id, max_id]."""
+        lo = int(np.searchsorted(self.ids, start_id, side='left'))
+        hi = len(self.ids) if max_id is None else int(np.searchsorted(self.ids, max_id, side='right'))
+        return self.ids[lo:max(lo, hi)]
+
+    def contains(self, track_ids: np.ndarray) -> np.ndarray:
+        """Boolean mask: which of ``track_ids`` are live."""
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.zeros(track_ids.shape, dtype=bool)
+        pos = np.searchsorted(self.ids, track_ids)
+        pos[pos >= len(self.ids)] = 0
+        return self.ids[pos] == track_ids
+
+    def id_at_offset(self, offset: int, descending: bool = True) -> Optional[int]:
+        """Id of the row ``offset`` positions from the newest (or oldest) track."""
+        if offset < 0 or offset >= len(self.ids):
+            return None
+        return int(self.ids[-1 - offset] if descending else self.ids[offset])
+
+
+class CatalogService:
+    """Process-wide catalog snapshot, refreshed by a background watcher.
+
+    With the watcher running (``start_watcher``), requests only read the
+    current snapshot; refreshes happen every ``refresh_seconds`` on the watcher
+    thread, or right away after ``invalidate``, and are swapped in with one
+    assignment. Without it (tools, tests) ``get`` refreshes inline when due.
+
+    Flag edits on existing rows (``preview_url`` / ``is_explicit``) are not seen
+    by the incremental refresh: write paths call ``invalidate(full=True)``,
+    otherwise they show up with the next periodic full reload.
+    """
+
+    def __init__(self, refresh_seconds: float = 60.0, full_refresh_seconds: float = 600.0):
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._checked_at = 0.0
+        self._full_at = 0.0
+        self._stale = True
+        self._full_pending = False
+        # last refresh failed: wait refresh_seconds before retrying inline, even when stale
+        self._failing = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def _watching(self) -> bool:
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def _due(self) -> bool:
+        if self._snapshot is not None and self._watching():
+            return False
+        return (self._stale and not self._failing) or time.monotonic() - self._checked_at > self.refresh_seconds
+
+    def get(self) -> CatalogSnapshot:
+        if self._due():
+            with self._lock:
+                # another request may have refreshed while we waited for the lock
+                if self._due():
+                    try:
+                        self._refresh(None)
+                    except Exception as e:
+                        print(f"[catalog] refresh failed: {e}")
+                        self._checked_at = time.monotonic()
+                        self._failing = True
+        snap = self._snapshot
+        return snap if snap is not None else CatalogSnapshot.empty()
+
+    def invalidate(self, full: bool = False) -> None:
+        """Mark the snapshot stale (call after inserting / deleting tracks; ``full``
+        after changing flags of existing rows) and wake the watcher."""
+        if full:
+            self._full_pending = True
+        self._stale = True
+        self._wake.set()
+
+    @staticmethod
+    def load(db: Session, after: int = 0, version: int = 0) -> CatalogSnapshot:
+        """Snapshot of the tracks with ``id > after`` read straight from the DB (not cached)."""
+        stmt = (
+            select(Track.id, Track.preview_url.is_not(None), Track.is_explicit, Track.artist_id)
+            .where(Track.id > after)
+            .order_by(Track.id)
+        )
+        return CatalogSnapshot.from_rows(db.execute(stmt).all(), version)
+
+    def refresh(self, db: Optional[Session] = None, full: bool = False) -> CatalogSnapshot:
+        with self._lock:
+            return self._refresh(db, full)
+
+    def _refresh(self, db: Optional[Session], full: bool = False) -> CatalogSnapshot:
+        own = db is None
+        db = db or SessionLocal()
+        pending, self._full_pending = self._full_pending, False
+        try:
+            snap = self._snapshot
+            now = time.monotonic()
+            version = (snap.version + 1) if snap is not None else 1
+            if snap is None or full or pending or now - self._full_at > self.full_refresh_seconds:
+                snap = self.load(db, version=version)
+                self._full_at = now
+            else:
+                new = self.load(db, after=snap.max_id, version=version)
+                count = db.execute(select(func.count(Track.id))).scalar() or 0
+                if count != len(snap) + len(new):
+                    # rows were deleted somewhere below max_id
+                    snap = self.load(db, version=version)
+                    self._full_at = now
+                elif len(new):
+                    snap = snap.extended(new, version)
+            self._snapshot = snap
+            self._checked_at = now
+            self._stale = self._failing = False
+            return snap
+        except BaseException:
+            self._full_pending = self._full_pending or pending
+            raise
+        finally:
+            if own:
+                db.close()
+
+    def start_watcher(self) -> None:
+        """Refresh every ``refresh_seconds`` (and on ``invalidate``) on a daemon thread."""
+        if self._watching():
+            return
+        self._stop.clear()
+
+        def run():
+            while True:
+                self._wake.wait(self.refresh_seconds)
+                self._wake.clear()
+                if self._stop.is_set():
+                    return
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"[catalog] refresh failed: {e}")
+
+        self._watcher = threading.Thread(target=run, name='catalog-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+
+_settings = get_settings()
+catalog_service = CatalogService(_settings.catalog_refresh_seconds, _settings.catalog_full_refresh_seconds)
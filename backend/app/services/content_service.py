@@ -0,0 +1,154 @@
+"""Content-based cold-start scoring over ``TrackFeatures``.
+
+The audio feature columns (+ one-hot genre) are loaded into a normalized
+float32 matrix, rebuilt periodically by a background watcher and swapped in
+with one assignment (like ``ModelStore``). A user's profile is the mean feature row of their liked or
+completed tracks, and the whole catalog is scored with one matrix-vector
+product, so users with only a handful of likes get sensible results without
+any ALS factors.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import or_, select, union
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..core.db import SessionLocal
+from ..models.music import Interaction, Track, TrackFeatures, TrackLike
+from .model_store import FactorModel
+
+FEATURE_COLUMNS = (
+    'danceability', 'energy', 'valence', 'tempo', 'acousticness',
+    'instrumentalness', 'liveness', 'speechiness', 'loudness',
+)
+# weight of the genre one-hot block relative to the (z-scored) audio features
+GENRE_WEIGHT = 1.0
+# most recent positive tracks used to build a profile
+PROFILE_TRACKS = 200
+
+
+def build_feature_matrix(rows: list[tuple], version: str = 'content') -> Optional[FactorModel]:
+    """Rows of (track_id, *FEATURE_COLUMNS, genre) -> item "factor" model.
+
+    Numeric columns are z-scored (missing values -> column mean), genres become
+    a weighted one-hot block, and every row is L2-normalized so scores are cosines.
+    The result reuses ``FactorModel`` (no users) for id lookups and top-k.
+    """
+    if not rows:
+        return None
+    n_feat = len(FEATURE_COLUMNS)
+    table = np.array(rows, dtype=object)
+    track_ids = table[:, 0].astype(np.int64)
+    # None -> nan
+    numeric = table[:, 1:1 + n_feat].astype(np.float64)
+    present = ~np.isnan(numeric)
+    mean = np.nansum(numeric, axis=0) / np.maximum(present.sum(axis=0), 1)
+    numeric = np.where(present, numeric, mean)
+    std = numeric.std(axis=0)
+    numeric = (numeric - numeric.mean(axis=0)) / np.where(std > 0, std, 1.0)
+    raw = table[:, 1 + n_feat]
+    # normalize each distinct genre string once
+    distinct, inverse = np.unique(np.where(np.equal(raw, None), '', raw).astype(str), return_inverse=True)
+    names = [g.strip().lower() for g in distinct.tolist()]
+    vocab = sorted({g for g in names if g})
+    col = {g: i for i, g in enumerate(vocab)}
+    genre_col = np.array([col.get(g, -1) for g in names], dtype=np.int64)[inverse.reshape(-1)]
+    onehot = np.zeros((len(rows), len(vocab)), dtype=np.float64)
+    has = genre_col >= 0
+    onehot[np.flatnonzero(has), genre_col[has]] = GENRE_WEIGHT
+    matrix = np.hstack([numeric, onehot]).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    matrix /= np.where(norms > 0, norms, 1.0)[:, None]
+    return FactorModel(version, np.empty((0, matrix.shape[1]), dtype=np.float32), matrix,
+                       np.empty(0, dtype=np.int64), track_ids, kind='content')
+
+
+class ContentService:
+    """Feature matrix loaded on first use, then rebuilt every ``refresh_seconds``
+    by ``start_watcher`` off the request path; readers never wait for a reload."""
+
+    def __init__(self, refresh_seconds: float = 600.0):
+        self.refresh_seconds = refresh_seconds
+        self._model: Optional[FactorModel] = None
+        self._attempted = False
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self) -> Optional[FactorModel]:
+        if not self._attempted:
+            with self._lock:
+                if not self._attempted:
+                    self._load(None)
+        return self._model
+
+    def reload(self, db: Optional[Session] = None) -> Optional[FactorModel]:
+        """Rebuild the matrix from the DB and swap it in (the old one stays on failure)."""
+        with self._lock:
+            return self._load(db)
+
+    def _load(self, db: Optional[Session]) -> Optional[FactorModel]:
+        self._attempted = True
+        own = db is None
+        db = db or SessionLocal()
+        try:
+            cols = [getattr(TrackFeatures, c) for c in FEATURE_COLUMNS]
+            stmt = (
+                select(TrackFeatures.track_id, *cols, TrackFeatures.genre)
+                .join(Track, Track.id == TrackFeatures.track_id)
+                .order_by(TrackFeatures.track_id)
+            )
+            rows = db.execute(stmt).all()
+            self._model = build_feature_matrix(rows, version=f'content-{int(time.time())}')
+        except Exception as e:
+            print(f"[content] failed to load track features: {e}")
+        finally:
+            if own:
+                db.close()
+        return self._model
+
+    def start_watcher(self) -> None:
+        """Reload every ``refresh_seconds`` on a daemon thread."""
+        if self.refresh_seconds <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.refresh_seconds):
+                self.reload()
+
+        self._watcher = threading.Thread(target=run, name='content-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+
+    @staticmethod
+    def positive_track_ids(db: Session, user_id: int, limit: int = PROFILE_TRACKS) -> list[int]:
+        """Liked or fully listened tracks of the user (up to ``limit`` most recent of each)."""
+        liked = select(TrackLike.track_id).where(TrackLike.user_id == user_id).order_by(TrackLike.created_at.desc()).limit(limit)
+        completed = (
+            select(Interaction.track_id)
+            .where(Interaction.user_id == user_id, Interaction.track_id.is_not(None),
+                   or_(Interaction.is_completed.is_(True), Interaction.milestone >= 100))
+            .order_by(Interaction.played_at.desc())
+            .limit(limit)
+        )
+        return list(db.execute(union(liked.subquery().select(), completed.subquery().select())).scalars())
+
+    @staticmethod
+    def profile(model: FactorModel, track_ids: list[int]) -> Optional[np.ndarray]:
+        idx = model.item_indices(track_ids)
+        if idx.size == 0:
+            return None
+        vec = np.asarray(model.item_factors[idx]).mean(axis=0)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else None
+
+
+content_service = ContentService(get_settings().content_refresh_seconds)
@@ -1,19 +1,299 @@
+"""Deezer public API client with connection pooling and response caching.
+
+``DeezerClient`` keeps one pooled ``requests.Session`` (keep-alive) and an
+in-process TTL + LRU cache of decoded responses keyed by endpoint and
+parameters (``search:<query>:<limit>``, ``track:<id>``). Missing tracks
+(HTTP 404 or Deezer's ``{"error": {"code": 800}}``) are cached too, for a
+shorter time. Track entries never outlive the signed preview URL they
+contain. With ``DEEZER_CACHE_REDIS_URL`` set, entries are also shared
+between workers through redis (second level, checked after the local
+cache).
+
+Every upstream call goes through a per-endpoint token bucket (``/search``,
+``/track``, everything else) and one circuit breaker: live requests wait at
+most ``max_wait`` seconds for a token and fail fast with ``DeezerUnavailable``
+while the circuit is open, so callers can fall back to the DB or cached
+previews; with ``max_wait=None`` (batch tools) calls wait for both instead.
+
+The module-level ``search_tracks`` / ``get_track`` functions use the shared
+``deezer_client``.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+
+from ..core.config import get_settings
+from ..core.ratelimit import CircuitBreaker, TokenBucket
+from ..core.upstream import EXPIRY_MARGIN_SECONDS, preview_url_expiry
 
 BASE = "https://api.deezer.com"
+# Deezer answers HTTP 200 with these error codes for unknown ids / an exhausted quota
+NOT_FOUND_CODE = 800
+QUOTA_CODE = 4
+ENDPOINTS = ('search', 'track', 'other')
+_MISSING = object()
+
+
+class DeezerUnavailable(Exception):
+    """Deezer is not being called right now (circuit open or over the rate budget)."""
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(f"Deezer API unavailable: {reason}")
+        self.retry_after = retry_after
+
+
+def _expiry_of_preview(data: Any) -> Optional[float]:
+    if isinstance(data, dict) and data.get('preview'):
+        exp = preview_url_expiry(data['preview'])
+        if exp is not None:
+            return exp - EXPIRY_MARGIN_SECONDS
+    return None
+
+
+class TTLCache:
+    """Thread-safe LRU map whose entries also expire after their own TTL."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """Value, or ``_MISSING`` when absent / expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.time():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisCache:
+    """Optional shared second level (JSON values, native redis TTLs)."""
+
+    def __init__(self, url: str, prefix: str = 'deezer:'):
+        import redis  # optional dependency, only needed with DEEZER_CACHE_REDIS_URL
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key: str) -> Any:
+        raw = self._redis.get(self.prefix + key)
+        return _MISSING if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl >= 1:
+            self._redis.set(self.prefix + key, json.dumps(value, separators=(',', ':')), ex=int(ttl))
+
+
+class DeezerClient:
+    def __init__(self, base_url: str = BASE, timeout: float = 10.0, pool_size: int = 32,
+                 cache_size: int = 10000, search_ttl: float = 600.0, track_ttl: float = 3600.0,
+                 negative_ttl: float = 300.0, shared: Optional[Any] = None,
+                 rates: Optional[dict[str, float]] = None, max_wait: Optional[float] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.search_ttl = search_ttl
+        self.track_ttl = track_ttl
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(cache_size)
+        self.shared = shared
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # requests/s per endpoint (missing / <= 0 = unlimited)
+        self.buckets = {name: TokenBucket((rates or {}).get(name, 0.0)) for name in ENDPOINTS}
+        self.max_wait = max_wait
+        self.breaker = breaker or CircuitBreaker()
+        self.counters = {'hits': 0, 'shared_hits': 0, 'negative_hits': 0, 'misses': 0,
+                         'upstream_calls': 0, 'upstream_errors': 0, 'shared_errors': 0,
+                         'rate_limited': 0, 'short_circuited': 0}
+
+    def _cached(self, key: str) -> Any:
+        value = self.cache.get(key)
+        if value is not _MISSING:
+            self.counters['negative_hits' if value is None else 'hits'] += 1
+            return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                self.counters['shared_errors'] += 1
+                print(f"[deezer] shared cache unavailable: {e}")
+                return _MISSING
+            if value is not _MISSING:
+                self.counters['shared_hits'] += 1
+                # keep it locally for a short while (the shared entry owns the real TTL)
+                self.cache.set(key, value, self._capped(value, self.negative_ttl))
+                return value
+        self.counters['misses'] += 1
+        return _MISSING
+
+    @staticmethod
+    def _capped(value: Any, ttl: float) -> float:
+        """``ttl``, shortened so a cached signed preview URL is never handed out after it expires."""
+        good_until = _expiry_of_preview(value)
+        return ttl if good_until is None else min(ttl, good_until - time.time())
+
+    def _store(self, key: str, value: Any, ttl: float) -> None:
+        self.cache.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                self.counters['shared_errors'] += 1
+                print(f"[deezer] shared cache unavailable: {e}")
+
+    def _admit(self, path: str) -> None:
+        """Block until the call is within budget and the circuit lets it through."""
+        endpoint = path.strip('/').split('/', 1)[0]
+        bucket = self.buckets[endpoint if endpoint in self.buckets else 'other']
+        while True:
+            wait = self.breaker.retry_in()
+            if wait > 0:
+                if self.max_wait is not None:
+                    self.counters['short_circuited'] += 1
+                    raise DeezerUnavailable('circuit open', wait)
+                time.sleep(wait)
+                continue
+            # ask the breaker first, so calls it turns away do not spend the budget
+            if not self.breaker.allow():
+                # another caller holds the half-open trial
+                if self.max_wait is not None:
+                    self.counters['short_circuited'] += 1
+                    raise DeezerUnavailable('circuit half-open', 1.0)
+                time.sleep(0.5)
+                continue
+            if bucket.acquire(timeout=self.max_wait):
+                return
+            self.breaker.release()
+            self.counters['rate_limited'] += 1
+            raise DeezerUnavailable(f'{endpoint} rate budget exhausted', 1.0 / max(bucket.rate, 1e-3))
+
+    def get_json(self, path: str, params: Optional[dict] = None) -> Optional[Any]:
+        """Decoded JSON of an (uncached) API call, or None when Deezer reports the object as missing."""
+        self._admit(path)
+        self.counters['upstream_calls'] += 1
+        try:
+            resp = self.session.get(f'{self.base_url}{path}', params=params, timeout=self.timeout)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if resp.status_code == 404:
+                return None
+            resp.raise_for_status()
+            data = resp.json()
+        except requests.RequestException as e:
+            if e.response is None:  # connection error / timeout
+                self.breaker.record_failure()
+            self.counters['upstream_errors'] += 1
+            raise
+        except Exception:
+            self.counters['upstream_errors'] += 1
+            raise
+        err = data.get('error') if isinstance(data, dict) else None
+        if err:
+            code = err.get('code') if isinstance(err, dict) else None
+            if code == NOT_FOUND_CODE:
+                return None
+            if code == QUOTA_CODE:
+                self.breaker.trip()
+            self.counters['upstream_errors'] += 1
+            raise requests.HTTPError(f"Deezer API error: {err}")
+        return data
+
+    def search_tracks(self, q: str, limit: Optional[int] = 10) -> dict:
+        key = f'search:{" ".join(q.lower().split())}:{limit}'
+        value = self._cached(key)
+        if value is not _MISSING:
+            return value
+        data = self.get_json('/search', {'q': q, 'limit': limit}) or {'data': [], 'total': 0}
+        self._store(key, data, self.search_ttl)
+        return data
+
+    def get_track(self, track_id: int, fresh: bool = False) -> Optional[dict]:
+        """Track JSON (None if unknown); ``fresh`` skips the cache, e.g. after a CDN 403."""
+        key = f'track:{int(track_id)}'
+        if not fresh:
+            value = self._cached(key)
+            if value is not _MISSING:
+                return value
+        data = self.get_json(f'/track/{int(track_id)}')
+        if data is None:
+            self._store(key, None, self.negative_ttl)
+            return None
+        self._store(key, data, self._capped(data, self.track_ttl))
+        return data
+
+    def stats(self) -> dict:
+        c = self.counters
+        lookups = c['hits'] + c['shared_hits'] + c['negative_hits'] + c['misses']
+        served = lookups - c['misses']
+        return {
+            'entries': len(self.cache),
+            'hit_ratio': round(served / lookups, 4) if lookups else None,
+            'shared': self.shared is not None,
+            **c,
+            'circuit': self.breaker.stats(),
+            'limits': {name: bucket.stats() for name, bucket in self.buckets.items()},
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def _build_client() -> DeezerClient:
+    s = get_settings()
+    shared = None
+    if s.deezer_cache_redis_url:
+        try:
+            shared = RedisCache(s.deezer_cache_redis_url)
+        except Exception as e:
+            print(f"[deezer] redis cache disabled: {e}")
+    return DeezerClient(
+        base_url=s.deezer_api_base, cache_size=s.deezer_cache_size, search_ttl=s.deezer_search_ttl_seconds,
+        track_ttl=s.deezer_track_ttl_seconds, negative_ttl=s.deezer_negative_ttl_seconds, shared=shared,
+        rates={'search': s.deezer_search_rate, 'track': s.deezer_track_rate, 'other': s.deezer_other_rate},
+        max_wait=s.deezer_max_wait_seconds,
+        breaker=CircuitBreaker(s.deezer_breaker_failures, s.deezer_breaker_reset_seconds),
+    )
+
+
+deezer_client = _build_client()
 
 
 def search_tracks(q: str, limit: Optional[int] = 10):
-    params = {"q": q, "limit": limit}
-    resp = requests.get(f"{BASE}/search", params=params, timeout=10)
-    resp.raise_for_status()
-    return resp.json()
-
-
-def get_track(track_id: int):
-    resp = requests.get(f"{BASE}/track/{track_id}", timeout=10)
-    if resp.status_code == 404:
-        return None
-    resp.raise_for_status()
-    return resp.json()
+    return deezer_client.search_tracks(q, limit=limit)
+
+
+def get_track(track_id: int, fresh: bool = False):
+    return deezer_client.get_track(track_id, fresh=fresh)
@@ -0,0 +1,164 @@
+"""Online fold-in of user vectors against fixed item factors.
+
+When new interactions arrive, the user's latent vector is re-solved from the
+current item factors with one k x k least-squares solve (the ALS user step):
+
+    (YtY + Y_u^T (C_u - I) Y_u + reg I) x_u = Y_u^T C_u 1
+
+YtY is computed once per model version. Results are stored as compact float32
+bytes in ``UserFeatures.latent_blob`` (tagged with the model version) by a
+background worker thread, so recommendations stay fresh between retrains.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..core.db import SessionLocal
+from ..ml.feedback import DEFAULT_ALPHA, DEFAULT_REGULARIZATION, LIKE_WEIGHT, confidence, interaction_strength
+from ..models.music import Interaction, TrackLike, UserFeatures
+from .model_store import FactorModel, ModelStore, model_store
+
+VECTOR_DTYPE = np.dtype('<f4')
+
+
+def encode_vector(vec: np.ndarray) -> bytes:
+    return np.asarray(vec, dtype=VECTOR_DTYPE).tobytes()
+
+
+def decode_vector(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=VECTOR_DTYPE)
+
+
+def solve_user_vector(item_factors: np.ndarray, yty: np.ndarray, item_idx: np.ndarray,
+                      conf: np.ndarray, regularization: float) -> np.ndarray:
+    """Exact ALS user update for one user given its item indices and confidences."""
+    y_u = np.asarray(item_factors[item_idx], dtype=np.float64)
+    a = yty + (y_u.T * (conf - 1.0)) @ y_u + regularization * np.eye(yty.shape[0])
+    b = y_u.T @ conf
+    return np.linalg.solve(a, b).astype(np.float32)
+
+
+class FoldInService:
+    """Computes, stores and reads folded-in user vectors; owns the background worker."""
+
+    def __init__(self, store: ModelStore = model_store, regularization: float = DEFAULT_REGULARIZATION,
+                 alpha: float = DEFAULT_ALPHA):
+        self.store = store
+        self.regularization = regularization
+        self.alpha = alpha
+        self._gram: Optional[tuple[str, np.ndarray]] = None
+        self._queue: queue.Queue[int] = queue.Queue()
+        self._pending: set[int] = set()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def gram(self, model: FactorModel) -> np.ndarray:
+        cached = self._gram
+        if cached is not None and cached[0] == model.version:
+            return cached[1]
+        y = np.asarray(model.item_factors, dtype=np.float64)
+        yty = y.T @ y
+        self._gram = (model.version, yty)
+        return yty
+
+    def user_confidences(self, db: Session, model: FactorModel, user_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """Model item indices + aggregated confidences from the user's full history."""
+        rows = db.execute(
+            select(Interaction.track_id, Interaction.seconds_listened, Interaction.is_completed, Interaction.milestone)
+            .where(Interaction.user_id == user_id, Interaction.track_id.is_not(None))
+        ).all()
+        likes = db.execute(select(TrackLike.track_id).where(TrackLike.user_id == user_id)).scalars().all()
+        track_ids = np.array([r[0] for r in rows] + list(likes), dtype=np.int64)
+        if track_ids.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        strength = np.concatenate([
+            interaction_strength(
+                np.array([r[1] or 0 for r in rows], dtype=np.float32),
+                np.array([bool(r[2]) for r in rows], dtype=np.float32),
+                np.array([r[3] or 0 for r in rows], dtype=np.float32),
+            ),
+            np.full(len(likes), LIKE_WEIGHT, dtype=np.float32),
+        ])
+        uniq, inverse = np.unique(track_ids, return_inverse=True)
+        summed = np.bincount(inverse, weights=strength).astype(np.float32)
+        pos = np.searchsorted(model.item_ids, uniq)
+        pos[pos >= model.n_items] = 0
+        known = model.item_ids[pos] == uniq
+        return pos[known], confidence(summed[known], self.alpha)
+
+    def fold_in(self, db: Session, user_id: int) -> Optional[np.ndarray]:
+        """Recompute and persist the user's vector against the active model."""
+        model = self.store.get()
+        if model is None:
+            return None
+        idx, conf = self.user_confidences(db, model, user_id)
+        if idx.size == 0:
+            return None
+        vec = solve_user_vector(model.item_factors, self.gram(model), idx, conf.astype(np.float64), self.regularization)
+        row = db.get(UserFeatures, user_id)
+        if row is None:
+            row = UserFeatures(user_id=user_id)
+            db.add(row)
+        row.latent_blob = encode_vector(vec)
+        row.model_version = model.version
+        row.updated_at = datetime.utcnow()
+        db.commit()
+        return vec
+
+    def vectors_for(self, db: Session, model: FactorModel, user_ids: list[int]) -> dict[int, np.ndarray]:
+        """Folded-in vectors of these users that match the active model version."""
+        if not user_ids:
+            return {}
+        try:
+            rows = db.execute(
+                select(UserFeatures.user_id, UserFeatures.latent_blob)
+                .where(UserFeatures.user_id.in_(user_ids), UserFeatures.model_version == model.version,
+                       UserFeatures.latent_blob.is_not(None))
+            ).all()
+        except Exception as e:
+            # e.g. migration 0004 not applied yet: serve from the trained factors only
+            db.rollback()
+            print(f"[foldin] cannot read user_features: {e}")
+            return {}
+        dim = model.item_factors.shape[1]
+        out = {}
+        for uid, blob in rows:
+            vec = decode_vector(blob)
+            if vec.shape[0] == dim:
+                out[uid] = vec
+        return out
+
+    def enqueue(self, user_id: int) -> None:
+        """Schedule a fold-in; repeated events for a queued user are coalesced."""
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='foldin-worker', daemon=True)
+                self._worker.start()
+        self._queue.put(user_id)
+
+    def _run(self) -> None:
+        while True:
+            user_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(user_id)
+            db = SessionLocal()
+            try:
+                self.fold_in(db, user_id)
+            except Exception as e:
+                db.rollback()
+                print(f"[foldin] user {user_id} failed: {e}")
+            finally:
+                db.close()
+
+
+foldin_service = FoldInService()
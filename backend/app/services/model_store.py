@@ -0,0 +1,419 @@
+"""Matrix-factorization artifacts for serving.
+
+Loads the ``user_factors_*.npy`` / ``item_factors_*.npy`` pair written by
+``app.ml.training.train_mf`` (version chosen via ``latest.txt``) and exposes
+vectorized top-k scoring over the item factors.
+"""
+from __future__ import annotations
+
+import copy
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Optional
+
+import numpy as np
+
+from ..core.config import get_settings
+
+if TYPE_CHECKING:
+    from .ann_index import IVFIndex
+
+
+class FactorModel:
+    """Immutable snapshot of one trained factor model.
+
+    ``user_ids`` / ``item_ids`` map row index -> database id and are kept
+    sorted so id -> index lookups are a ``searchsorted``.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        user_factors: np.ndarray,
+        item_factors: np.ndarray,
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        ann: Optional['IVFIndex'] = None,
+        topn_items: Optional[np.ndarray] = None,
+        topn_scores: Optional[np.ndarray] = None,
+        kind: str = 'mf',
+    ):
+        if len(user_ids) != len(user_factors) or len(item_ids) != len(item_factors):
+            raise ValueError("id maps do not match factor shapes")
+        if len(user_ids) > 1 and np.any(np.diff(user_ids) <= 0):
+            order = np.argsort(user_ids, kind='stable')
+            user_ids, user_factors = user_ids[order], user_factors[order]
+            topn_items = topn_scores = None
+        if len(item_ids) > 1 and np.any(np.diff(item_ids) <= 0):
+            order = np.argsort(item_ids, kind='stable')
+            item_ids, item_factors = item_ids[order], item_factors[order]
+            ann = topn_items = topn_scores = None  # built against the on-disk row order
+        self.version = version
+        # 'mf' (trained factors) or 'content' (TrackFeatures matrix)
+        self.kind = kind
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.ann = ann
+        # offline top-N per user index (-1 padded rows = not precomputed)
+        self.topn_items = topn_items
+        self.topn_scores = topn_scores
+
+    def with_topn(self, topn_items: np.ndarray, topn_scores: np.ndarray) -> 'FactorModel':
+        """Copy of this snapshot (sharing all arrays) with precomputed lists attached."""
+        clone = copy.copy(self)
+        clone.topn_items, clone.topn_scores = topn_items, topn_scores
+        return clone
+
+    @property
+    def n_items(self) -> int:
+        return len(self.item_ids)
+
+    def user_index(self, user_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.user_ids, user_id))
+        if pos < len(self.user_ids) and self.user_ids[pos] == user_id:
+            return pos
+        return None
+
+    def user_vector(self, user_id: int) -> Optional[np.ndarray]:
+        idx = self.user_index(user_id)
+        return None if idx is None else self.user_factors[idx]
+
+    def item_indices(self, track_ids: Iterable[int]) -> np.ndarray:
+        """Indices of the given track ids that exist in the model."""
+        ids = np.fromiter(track_ids, dtype=np.int64)
+        if ids.size == 0 or self.n_items == 0:
+            return np.empty(0, dtype=np.int64)
+        pos = np.searchsorted(self.item_ids, ids)
+        pos[pos >= self.n_items] = 0
+        return pos[self.item_ids[pos] == ids]
+
+    def id_range(self, start_id: int = 1, max_id: Optional[int] = None) -> tuple[int, int]:
+        """Index slice [lo, hi) covering track ids in [start_id, max_id]."""
+        lo = int(np.searchsorted(self.item_ids, start_id, side='left'))
+        hi = self.n_items if max_id is None else int(np.searchsorted(self.item_ids, max_id, side='right'))
+        return lo, max(lo, hi)
+
+    def top_k(
+        self,
+        user_vec: np.ndarray,
+        k: int,
+        exclude: Optional[np.ndarray] = None,
+        start_id: int = 1,
+        max_id: Optional[int] = None,
+    ) -> list[tuple[int, float]]:
+        """Score every item with one dot product and return the k best.
+
+        ``exclude`` holds item indices (see ``item_indices``) that must not be returned.
+        """
+        idx, scores = self.top_k_indices(user_vec, k, exclude, start_id, max_id)
+        return list(zip(self.item_ids[idx].tolist(), scores.tolist()))
+
+    def top_k_indices(
+        self,
+        user_vec: np.ndarray,
+        k: int,
+        exclude: Optional[np.ndarray] = None,
+        start_id: int = 1,
+        max_id: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """``top_k`` as arrays: (item indices, scores), best first."""
+        lo, hi = self.id_range(start_id, max_id)
+        if k <= 0 or hi <= lo:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.item_factors[lo:hi] @ user_vec
+        if exclude is not None and exclude.size:
+            ex = exclude[(exclude >= lo) & (exclude < hi)] - lo
+            scores[ex] = -np.inf
+        top = select_top_k(scores, k)
+        return top + lo, scores[top]
+
+    def precomputed(self, user_idx: int, k: int, seen: Iterable[int] = (),
+                    min_k: Optional[int] = None) -> Optional[list[tuple[int, float]]]:
+        """Top-k from the offline lists, minus tracks seen since they were built.
+
+        None when no list exists for the user or fewer than ``min_k`` (default k)
+        entries remain.
+        """
+        if self.topn_items is None or user_idx >= len(self.topn_items):
+            return None
+        row = np.asarray(self.topn_items[user_idx])
+        if row.size == 0 or row[0] < 0:
+            return None
+        keep = row >= 0
+        seen_ids = np.asarray(seen if isinstance(seen, np.ndarray) else list(seen), dtype=np.int64)
+        if seen_ids.size:
+            keep &= ~np.isin(row, seen_ids)
+        picked = np.flatnonzero(keep)[:k]
+        if picked.size < min(k if min_k is None else min_k, self.n_items):
+            return None
+        scores = self.topn_scores[user_idx]
+        return [(int(row[i]), float(scores[i])) for i in picked]
+
+    def score_users(self, user_idx: np.ndarray, k: int, excludes: Optional[list[np.ndarray]] = None,
+                    max_cells: int = 16_000_000) -> tuple[np.ndarray, np.ndarray]:
+        """Batched top-k for model users (by index); see ``score_vectors``."""
+        return self.score_vectors(self.user_factors, k, excludes, rows=user_idx, max_cells=max_cells)
+
+    def score_vectors(self, vectors: np.ndarray, k: int, excludes: Optional[list[np.ndarray]] = None,
+                      rows: Optional[np.ndarray] = None, max_cells: int = 16_000_000) -> tuple[np.ndarray, np.ndarray]:
+        """Batched top-k for many user vectors with one matrix multiply per chunk.
+
+        Scores ``vectors[rows]`` (all rows when ``rows`` is None). Returns
+        (track ids, scores) of shape (n, k), best first, padded with id -1 /
+        score -inf. Chunks keep users x items <= ``max_cells``.
+        """
+        n_users = len(vectors) if rows is None else len(rows)
+        n = self.n_items
+        ids = np.full((n_users, k), -1, dtype=np.int64)
+        out_scores = np.full((n_users, k), -np.inf, dtype=np.float32)
+        if n == 0 or k <= 0:
+            return ids, out_scores
+        k_eff = min(k, n)
+        chunk = max(1, max_cells // n)
+        for s in range(0, n_users, chunk):
+            sel = slice(s, s + chunk) if rows is None else rows[s:s + chunk]
+            block = np.asarray(vectors[sel])
+            scores = block @ self.item_factors.T
+            if excludes is not None:
+                for j, ex in enumerate(excludes[s:s + chunk]):
+                    if ex.size:
+                        scores[j, ex] = -np.inf
+            if k_eff < n:
+                part = np.argpartition(-scores, k_eff - 1, axis=1)[:, :k_eff]
+            else:
+                part = np.broadcast_to(np.arange(n), (len(block), n))
+            part_scores = np.take_along_axis(scores, part, axis=1)
+            order = np.argsort(-part_scores, axis=1, kind='stable')
+            top = np.take_along_axis(part, order, axis=1)
+            top_scores = np.take_along_axis(part_scores, order, axis=1)
+            finite = np.isfinite(top_scores)
+            ids[s:s + len(block), :k_eff] = np.where(finite, self.item_ids[top], -1)
+            out_scores[s:s + len(block), :k_eff] = top_scores
+        return ids, out_scores
+
+    def similar_items(self, track_id: int, k: int, exact: bool = False, nprobe: int = 8,
+                      exclude: Optional[np.ndarray] = None) -> Optional[list[tuple[int, float]]]:
+        """Tracks closest to ``track_id`` by cosine over item factors.
+
+        Uses the IVF index when one was built for this version, otherwise (or
+        with ``exact``) a brute-force scan. None if the track is not in the model.
+        """
+        from .ann_index import brute_force_search
+        idx = self.item_indices([track_id])
+        if idx.size == 0:
+            return None
+        query = np.asarray(self.item_factors[idx[0]])
+        if exclude is not None and exclude.size:
+            idx = np.concatenate([idx, exclude])
+        if self.ann is not None and not exact:
+            top, scores = self.ann.search(self.item_factors, query, k, nprobe=nprobe, exclude=idx)
+        else:
+            norms = self.ann.norms if self.ann is not None else np.linalg.norm(self.item_factors, axis=1)
+            top, scores = brute_force_search(self.item_factors, norms, query, k, exclude=idx)
+        return [(int(self.item_ids[i]), float(s)) for i, s in zip(top, scores)]
+
+
+def select_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest finite scores, best first (argpartition + small sort)."""
+    n = scores.shape[0]
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(n)
+    part = part[np.isfinite(scores[part])]
+    return part[np.argsort(-scores[part], kind='stable')]
+
+
+def load_factor_model(model_dir: Path, version: Optional[str] = None, mmap: bool = True) -> Optional[FactorModel]:
+    """Load the factor model ``version`` (or the one named in ``latest.txt``).
+
+    With ``mmap`` the arrays are opened read-only with ``mmap_mode='r'`` so every
+    worker process maps the same page-cache pages instead of holding a copy.
+    """
+    if version is None:
+        version = read_latest_version(model_dir)
+    if not version:
+        return None
+    uf_path = model_dir / f'user_factors_{version}.npy'
+    if_path = model_dir / f'item_factors_{version}.npy'
+    if not uf_path.exists() or not if_path.exists():
+        return None
+    mode = 'r' if mmap else None
+    user_factors = np.load(uf_path, mmap_mode=mode)
+    item_factors = np.load(if_path, mmap_mode=mode)
+    # Older placeholder artifacts have no id maps: rows are ids 1..n.
+    uid_path = model_dir / f'user_ids_{version}.npy'
+    iid_path = model_dir / f'item_ids_{version}.npy'
+    user_ids = np.load(uid_path) if uid_path.exists() else np.arange(1, len(user_factors) + 1)
+    item_ids = np.load(iid_path) if iid_path.exists() else np.arange(1, len(item_factors) + 1)
+    from .ann_index import IVFIndex
+    ann = IVFIndex.load(model_dir, version, mmap=mmap)
+    topn = load_topn(model_dir, version, mmap=mmap) or (None, None)
+    # asanyarray is a no-op (keeps the memmap) when the trainer already wrote float32
+    return FactorModel(
+        version,
+        np.asanyarray(user_factors, dtype=np.float32),
+        np.asanyarray(item_factors, dtype=np.float32),
+        np.asarray(user_ids, dtype=np.int64),
+        np.asarray(item_ids, dtype=np.int64),
+        ann=ann,
+        topn_items=topn[0],
+        topn_scores=topn[1],
+    )
+
+
+def load_topn(model_dir: Path, version: str, mmap: bool = True) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """Offline top-N arrays written by ``app.ml.training.precompute_topn``."""
+    items_path = model_dir / f'topn_items_{version}.npy'
+    scores_path = model_dir / f'topn_scores_{version}.npy'
+    if not items_path.exists() or not scores_path.exists():
+        return None
+    mode = 'r' if mmap else None
+    return np.load(items_path, mmap_mode=mode), np.load(scores_path, mmap_mode=mode)
+
+
+def topn_stamp(model_dir: Path, version: str) -> Optional[int]:
+    """Generation of the top-N files: mtime of the scores file, which precompute_topn writes last."""
+    try:
+        return (model_dir / f'topn_scores_{version}.npy').stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_latest_version(model_dir: Path) -> Optional[str]:
+    latest = model_dir / 'latest.txt'
+    try:
+        return latest.read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class ModelStore:
+    """Process-wide holder of the active factor model with hot swapping.
+
+    The active model is a single immutable ``FactorModel`` reference: readers
+    grab it once per request, and ``refresh`` swaps in a fully loaded new version
+    with one assignment, so in-flight requests finish on the version they started
+    with. The target version comes from ``latest.txt`` (written atomically by
+    ``train_mf``), falling back to the newest ``als`` row in ``model_artifacts``.
+    """
+
+    def __init__(self, model_dir: str | Path, mmap: bool = True):
+        self.model_dir = Path(model_dir)
+        self.mmap = mmap
+        self._model: Optional[FactorModel] = None
+        self._loaded_at: Optional[datetime] = None
+        # topn_stamp of the precomputed lists attached to the active model
+        self._topn_stamp: Optional[int] = None
+        self._attempted = False
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self) -> Optional[FactorModel]:
+        if not self._attempted:
+            self.refresh()
+        return self._model
+
+    @property
+    def version(self) -> Optional[str]:
+        model = self._model
+        return model.version if model is not None else None
+
+    def _target_version(self) -> Optional[str]:
+        if (self.model_dir / 'latest.txt').exists():
+            return read_latest_version(self.model_dir)
+        return self._artifact_table_version()
+
+    def _artifact_table_version(self) -> Optional[str]:
+        from ..core.db import SessionLocal
+        from ..models.music import ModelArtifact
+        db = SessionLocal()
+        try:
+            row = (
+                db.query(ModelArtifact.version)
+                .filter(ModelArtifact.model_type == 'als')
+                .order_by(ModelArtifact.created_at.desc(), ModelArtifact.id.desc())
+                .first()
+            )
+            return row[0] if row else None
+        except Exception:
+            return None
+        finally:
+            db.close()
+
+    def refresh(self) -> bool:
+        """Load and activate the target version if it changed. Returns True on swap."""
+        with self._lock:
+            self._attempted = True
+            try:
+                version = self._target_version()
+                if version is None:
+                    return False
+                if version == self.version:
+                    return self._attach_topn()
+                stamp = topn_stamp(self.model_dir, version)
+                model = load_factor_model(self.model_dir, version, mmap=self.mmap)
+            except Exception as e:
+                print(f"[model_store] failed to load factors from {self.model_dir}: {e}")
+                return False
+            if model is None:
+                return False
+            self._model = model
+            self._topn_stamp = stamp if model.topn_items is not None else None
+            self._loaded_at = datetime.utcnow()
+            print(f"[model_store] activated model version {model.version}")
+            return True
+
+    def _attach_topn(self) -> bool:
+        # precompute_topn runs after training (and may be re-run), so its lists show up
+        # or change for an already-active version
+        model = self._model
+        if model is None:
+            return False
+        stamp = topn_stamp(self.model_dir, model.version)
+        if stamp is None or stamp == self._topn_stamp:
+            return False
+        topn = load_topn(self.model_dir, model.version, mmap=self.mmap)
+        if topn is None or len(topn[0]) != len(model.user_ids):
+            return False
+        self._model = model.with_topn(*topn)
+        self._topn_stamp = stamp
+        print(f"[model_store] attached precomputed top-N for {model.version}")
+        return True
+
+    def start_watcher(self, interval: float) -> None:
+        """Poll for new versions every ``interval`` seconds on a daemon thread."""
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.refresh()
+
+        self._watcher = threading.Thread(target=run, name='model-store-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+
+    def status(self) -> dict:
+        model = self._model
+        if model is None:
+            return {"version": None}
+        return {
+            "version": model.version,
+            "loaded_at": self._loaded_at.isoformat() if self._loaded_at else None,
+            "users": len(model.user_ids),
+            "items": model.n_items,
+            "mmap": isinstance(model.item_factors, np.memmap),
+            "ann_lists": model.ann.n_lists if model.ann is not None else 0,
+            "precomputed_top_n": model.topn_items.shape[1] if model.topn_items is not None else 0,
+        }
+
+
+model_store = ModelStore(get_settings().model_dir)
@@ -0,0 +1,288 @@
+"""Async upstream fetch + tee-to-cache for Deezer preview MP3s.
+
+``PreviewUrls`` remembers the signed preview URL of each track together with
+its expiry (the ``exp`` field of Deezer's ``hdnea`` token, or a TTL for URLs
+without one), so plays only ask api.deezer.com for a new URL when the known
+one is about to expire or the CDN answered 403.
+
+One shared ``httpx.AsyncClient`` (connection pool, keep-alive) is used for all
+preview downloads, so a worker can proxy hundreds of concurrent plays without
+blocking the event loop.
+
+Cache misses are single-flight per track: the first request starts one
+background ``Download`` and every concurrent request for the same track
+streams from it. Chunks are kept in memory while the download runs (a preview
+is well under 1 MB) and written, in a worker thread, to a uniquely named temp
+file that is renamed into the cache once complete; requests arriving after
+that are served from the cached file. Cache files live in the sharded
+``preview_storage`` layout (``deezer/ab/cd/{id}.mp3``); with a tiered storage
+they are also uploaded to the object store, and a node that misses locally
+pulls them from there (or redirects to a presigned URL) instead of Deezer.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
+
+import anyio
+import httpx
+
+from ..core.config import get_settings
+from ..core.upstream import DEEZER_REFERER, EXPIRY_MARGIN_SECONDS, UPSTREAM_HEADERS, preview_url_expiry
+from .cache_manager import CacheManager
+from .storage import StorageBackend, preview_storage
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PreviewUrls:
+    """In-process track id -> (preview URL, good-until) map, LRU-bounded.
+
+    A URL without an expiry token is good for ``ttl_seconds`` from when it was
+    first resolved (``put``, or first seen by ``is_fresh``). Expired entries
+    are kept until replaced or evicted, so that clock is not restarted by the
+    next lookup of the same stored URL.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0, margin_seconds: float = EXPIRY_MARGIN_SECONDS,
+                 maxsize: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.margin_seconds = margin_seconds
+        self.maxsize = maxsize
+        self._urls: OrderedDict[int, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def good_until(self, url: str) -> float:
+        exp = preview_url_expiry(url)
+        if exp is None:
+            return time.time() + self.ttl_seconds
+        return exp - self.margin_seconds
+
+    def is_fresh(self, track_id: int, url: str) -> bool:
+        """Whether ``url`` (e.g. the one stored in the DB) can still be used for the track."""
+        with self._lock:
+            entry = self._urls.get(track_id)
+            if entry is None or entry[0] != url:
+                entry = self._store(track_id, url)
+        return entry[1] > time.time()
+
+    def get(self, track_id: int) -> Optional[str]:
+        with self._lock:
+            entry = self._urls.get(track_id)
+            if entry is None:
+                return None
+            self._urls.move_to_end(track_id)
+        return entry[0] if entry[1] > time.time() else None
+
+    def put(self, track_id: int, url: str) -> None:
+        """Record ``url`` as just resolved."""
+        with self._lock:
+            self._store(track_id, url)
+
+    def _store(self, track_id: int, url: str) -> tuple[str, float]:
+        entry = self._urls[track_id] = (url, self.good_until(url))
+        self._urls.move_to_end(track_id)
+        while len(self._urls) > self.maxsize:
+            self._urls.popitem(last=False)
+        return entry
+
+    def forget(self, track_id: int) -> None:
+        with self._lock:
+            self._urls.pop(track_id, None)
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+
+class UpstreamError(Exception):
+    """Upstream (CDN) answered with an error status."""
+
+    def __init__(self, status_code: int, body: str = ''):
+        super().__init__(f'upstream returned {status_code}')
+        self.status_code = status_code
+        self.body = body
+
+
+def upstream_headers(resp: httpx.Response) -> dict:
+    headers = {}
+    # body is decoded by httpx, so the upstream length only holds without content-encoding
+    if 'content-length' in resp.headers and 'content-encoding' not in resp.headers:
+        headers['Content-Length'] = resp.headers['content-length']
+    return headers
+
+
+class Download:
+    """One in-flight upstream fetch, shared by every request for the track."""
+
+    def __init__(self, track_id: int):
+        self.track_id = track_id
+        self.chunks: list[bytes] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.media_type = 'audio/mpeg'
+        self.headers: dict = {}
+        self.opened = anyio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = anyio.Event()
+
+    def notify(self) -> None:
+        changed, self._changed = self._changed, anyio.Event()
+        changed.set()
+
+    async def iter_bytes(self) -> AsyncIterator[bytes]:
+        """All chunks from the start, then new ones as they arrive."""
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.error is not None:
+                raise self.error
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class PreviewCache:
+    def __init__(self, storage: StorageBackend = preview_storage, max_connections: int = 256, timeout: float = 15.0,
+                 manager: Optional[CacheManager] = None):
+        self.storage = storage
+        # size budget / eviction (optional)
+        self.manager = manager
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: dict[int, Download] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=UPSTREAM_HEADERS,
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=64),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def path_for(self, track_id: int) -> Path:
+        """Where the cached preview of the track is written."""
+        return self.storage.path_for(f'{track_id}.mp3')
+
+    def locate(self, track_id: int) -> Optional[Path]:
+        """Cached preview file of the track on local disk, or None."""
+        return self.storage.locate(f'{track_id}.mp3')
+
+    async def stored(self, track_id: int, redirect: bool = False) -> Union[Path, str, None]:
+        """Local file of a stored preview, pulling it from the object-store tier on a
+        local miss; with ``redirect`` a presigned URL of the remote copy instead."""
+        path = self.locate(track_id)
+        if path is not None or self.storage.remote is None:
+            return path
+        found = await anyio.to_thread.run_sync(self.storage.resolve, f'{track_id}.mp3', redirect)
+        if isinstance(found, Path) and self.manager is not None:
+            self.manager.added(track_id, found.stat().st_size)
+        return found
+
+    async def open(self, url: str) -> httpx.Response:
+        """Start a streaming GET; retries once with a Deezer Referer on error.
+
+        Raises ``UpstreamError`` with the last status when both attempts fail.
+        """
+        last: Optional[UpstreamError] = None
+        for referer in (None, DEEZER_REFERER):
+            request = self.client.build_request('GET', url, headers={'Referer': referer} if referer else None)
+            resp = await self.client.send(request, stream=True)
+            if resp.status_code < 400:
+                return resp
+            body = await resp.aread()
+            await resp.aclose()
+            last = UpstreamError(resp.status_code, body[:400].decode('utf-8', errors='replace'))
+        raise last
+
+    async def passthrough(self, resp: httpx.Response) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                yield chunk
+        finally:
+            with anyio.CancelScope(shield=True):
+                await resp.aclose()
+
+    async def fetch(self, track_id: int, open_upstream: Callable[[], Awaitable[httpx.Response]]) -> Optional[Download]:
+        """Join the in-flight download of the track, or start one with ``open_upstream``.
+
+        Returns None when the file is already cached. Errors raised while
+        opening the upstream response are re-raised to every waiting request.
+        """
+        dl = self._inflight.get(track_id)
+        if dl is not None:
+            await dl.opened.wait()
+            if dl.error is not None and not dl.chunks:
+                raise dl.error
+            return dl
+        if self.locate(track_id) is not None:
+            return None
+        dl = Download(track_id)
+        self._inflight[track_id] = dl
+        try:
+            resp = await open_upstream()
+        except BaseException as e:
+            dl.error = e
+            self._inflight.pop(track_id, None)
+            dl.opened.set()
+            raise
+        dl.media_type = resp.headers.get('content-type', 'audio/mpeg')
+        dl.headers = upstream_headers(resp)
+        dl.opened.set()
+        # runs to completion even if the request that started it goes away
+        dl.task = asyncio.get_running_loop().create_task(self._download(dl, resp))
+        return dl
+
+    async def _download(self, dl: Download, resp: httpx.Response) -> None:
+        name = f'{dl.track_id}.mp3'
+        tmp = self.storage.temp_path(name)
+        fh = None
+        try:
+            await anyio.to_thread.run_sync(self.storage.prepare, name)
+            fh = await anyio.to_thread.run_sync(tmp.open, 'wb')
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                dl.chunks.append(chunk)
+                dl.notify()
+                await anyio.to_thread.run_sync(fh.write, chunk)
+            fh.close()
+            await anyio.to_thread.run_sync(self.storage.put_file, name, tmp)
+            dl.done = True
+            if self.manager is not None:
+                self.manager.added(dl.track_id, sum(len(c) for c in dl.chunks))
+        except BaseException as e:
+            dl.error = e if isinstance(e, Exception) else UpstreamError(499, 'download cancelled')
+            if fh is not None:
+                fh.close()
+            tmp.unlink(missing_ok=True)
+            if not isinstance(e, Exception):
+                raise
+            print(f"[preview_cache] download of {dl.track_id} failed: {e}")
+        finally:
+            if self._inflight.get(dl.track_id) is dl:
+                del self._inflight[dl.track_id]
+            dl.notify()
+            with anyio.CancelScope(shield=True):
+                await resp.aclose()
+
+
+_settings = get_settings()
+preview_cache = PreviewCache(manager=CacheManager(
+    preview_storage.local, _settings.preview_cache_max_bytes, _settings.preview_cache_policy,
+    _settings.preview_cache_sweep_seconds,
+))
+preview_urls = PreviewUrls(_settings.preview_url_ttl_seconds, maxsize=_settings.preview_url_cache_size)
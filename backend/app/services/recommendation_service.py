@@ -1,15 +1,77 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, union
 from sqlalchemy.orm import Session
-import math, random
 from typing import Optional
+import threading
+import time
+
+import numpy as np
+
+from ..core.config import get_settings
+from ..models.music import Interaction, TrackLike
+from .catalog import CatalogService, CatalogSnapshot, catalog_service
+from .content_service import ContentService, content_service
+from .foldin import FoldInService, foldin_service
+from .model_store import FactorModel, ModelStore, model_store
+from .reranking import ArtistCap, Candidates, ExplicitFilter, MMRSelect, RecentPlayDemotion, Reranker
+
 
 class RecommendationService:
-    """Fallback recommendation logic.
-    Later this will load ALS factors. Current behavior:
-      - Deterministic pseudo-random ranking per user.
-      - Score = base (inverse log) + small jitter.
-      - Optional start_id / max_track_id filtering parameters.
+    """User recommendations.
+
+    Serving order:
+      - Offline top-N list for the user (``precompute_topn``), when present
+        and no fresher folded-in vector exists.
+      - Matrix-factorization scores from the latest trained factors, using
+        the user's folded-in vector (``foldin``) when one matches the model
+        (one dot product over the item factors + argpartition top-k),
+        skipping tracks the user already liked or played.
+      - Content-based cold start for users without factors: cosine between
+        the mean TrackFeatures row of their liked/completed tracks and the
+        whole feature matrix (one matmul).
+      - Fallback when no model / no profile: deterministic pseudo-random
+        ranking per user (score = base inverse log + small jitter).
+    Candidates always come from the live catalog snapshot, so tracks deleted
+    since training are never returned and no per-request id probe is needed.
+
+    For a single user the engine retrieves a pool of ``rerank_pool`` candidates
+    (liked and played tracks excluded) which then goes through the re-ranking
+    stages (``reranking``): explicit filter, recent-play demotion (for sources
+    that do not exclude plays, e.g. the fallback), per-artist cap and MMR
+    diversity.
     """
 
+    def __init__(self, store: ModelStore = model_store, catalog: CatalogService = catalog_service,
+                 content: ContentService = content_service, foldin: FoldInService = foldin_service):
+        self.store = store
+        self.catalog = catalog
+        self.content = content
+        self.foldin = foldin
+        # model kind -> (model version, catalog version, dead item indices)
+        self._dead_cache: dict[str, tuple[str, int, np.ndarray]] = {}
+        self._dead_lock = threading.Lock()
+        settings = get_settings()
+        self.rerank_pool = settings.rerank_pool
+        self.artist_cap = settings.rerank_artist_cap
+        self.mmr_lambda = settings.rerank_mmr_lambda
+        self.recent_days = settings.rerank_recent_days
+        self.recent_half_life_hours = settings.rerank_recent_half_life_hours
+
+    def _dead_items(self, model: FactorModel, snap: CatalogSnapshot) -> np.ndarray:
+        """Model item indices whose track no longer exists (cached per model/catalog version)."""
+        with self._dead_lock:
+            cached = self._dead_cache.get(model.kind)
+        if cached is not None and cached[0] == model.version and cached[1] == snap.version:
+            return cached[2]
+        if len(snap) == 0:
+            dead = np.empty(0, dtype=np.int64)
+        else:
+            dead = np.flatnonzero(~snap.contains(model.item_ids))
+        dead.setflags(write=False)
+        with self._dead_lock:
+            self._dead_cache[model.kind] = (model.version, snap.version, dead)
+        return dead
+
     def recommend_for_user(
         self,
         db: Session,
@@ -17,22 +79,205 @@ class RecommendationService:
         limit: int = 20,
         start_id: int = 1,
         max_track_id: Optional[int] = None,
+        allow_explicit: bool = True,
+        timings: Optional[dict[str, float]] = None,
+    ) -> list[tuple[int, float]]:
+        """Top ``limit`` tracks for the user after re-ranking.
+
+        ``timings`` (if given) is filled with per-stage wall times in milliseconds.
+        """
+        t0 = time.perf_counter()
+        snap = self.catalog.get()
+        try:
+            seen = np.array(self.seen_track_ids(db, user_id), dtype=np.int64)
+            played, ages = self.recent_plays(db, user_id, self.recent_days)
+        except Exception as e:
+            # history unavailable: still serve (model / fallback), just without these rules
+            db.rollback()
+            print(f"[recommend] cannot read history of user {user_id}: {e}")
+            seen = played = np.empty(0, dtype=np.int64)
+            ages = np.empty(0, dtype=np.float64)
+        cand = self._retrieve(db, user_id, limit, start_id, max_track_id, snap, seen)
+        cand.attach_catalog(snap)
+        t1 = time.perf_counter()
+        stages = [] if allow_explicit else [ExplicitFilter()]
+        stages += [
+            RecentPlayDemotion(played, ages, self.recent_half_life_hours),
+            ArtistCap(self.artist_cap),
+            MMRSelect(self.mmr_lambda),
+        ]
+        result = Reranker(stages).run(cand, limit)
+        if timings is not None:
+            timings['retrieve'] = (t1 - t0) * 1000.0
+            timings.update(cand.timings)
+        return result
+
+    def _retrieve(
+        self,
+        db: Session,
+        user_id: int,
+        limit: int,
+        start_id: int,
+        max_track_id: Optional[int],
+        snap: CatalogSnapshot,
+        seen: np.ndarray,
+    ) -> Candidates:
+        """Candidate pool from the first engine that covers the user."""
+        pool = max(limit, self.rerank_pool)
+        model = self.store.get()
+        if model is not None:
+            user_idx = model.user_index(user_id)
+            folded = self.foldin.vectors_for(db, model, [user_id]).get(user_id)
+            if user_idx is not None or folded is not None:
+                dead = self._dead_items(model, snap)
+                if folded is None and start_id <= 1 and max_track_id is None:
+                    pre = model.precomputed(user_idx, pool, np.concatenate([seen, model.item_ids[dead]]), min_k=limit)
+                    if pre is not None:
+                        cand = Candidates.from_pairs(pre)
+                        cand.vectors = model.item_factors[model.item_indices(cand.ids)]
+                        return cand
+                idx, scores = model.top_k_indices(
+                    folded if folded is not None else model.user_factors[user_idx], pool,
+                    exclude=np.concatenate([model.item_indices(seen), dead]),
+                    start_id=start_id, max_id=max_track_id,
+                )
+                return Candidates(model.item_ids[idx], scores, vectors=model.item_factors[idx])
+        cold = self._content_candidates(db, user_id, pool, seen, start_id, max_track_id, snap)
+        if cold is not None and len(cold):
+            return cold
+        return Candidates.from_pairs(self._fallback(snap, user_id, pool, start_id, max_track_id))
+
+    def _content_candidates(
+        self,
+        db: Session,
+        user_id: int,
+        k: int,
+        exclude_ids,
+        start_id: int,
+        max_track_id: Optional[int],
+        snap: CatalogSnapshot,
+    ) -> Optional[Candidates]:
+        features = self.content.get()
+        if features is None:
+            return None
+        profile = self.content.profile(features, self.content.positive_track_ids(db, user_id))
+        if profile is None:
+            return None
+        dead = self._dead_items(features, snap)
+        exclude = np.concatenate([features.item_indices(exclude_ids), dead])
+        idx, scores = features.top_k_indices(profile, k, exclude=exclude, start_id=start_id, max_id=max_track_id)
+        return Candidates(features.item_ids[idx], scores, vectors=features.item_factors[idx])
+
+    def recommend_content(
+        self,
+        db: Session,
+        user_id: int,
+        limit: int = 20,
+        start_id: int = 1,
+        max_track_id: Optional[int] = None,
+        snap: Optional[CatalogSnapshot] = None,
+    ) -> list[tuple[int, float]]:
+        """Content-based ranking from the user's liked/completed tracks ([] if no profile)."""
+        cand = self._content_candidates(db, user_id, limit, self.seen_track_ids(db, user_id), start_id, max_track_id,
+                                        snap if snap is not None else self.catalog.get())
+        return cand.top(limit) if cand is not None else []
+
+    def recommend_batch(self, db: Session, user_ids: list[int], limit: int = 20) -> dict[int, list[tuple[int, float]]]:
+        """Recommendations for many users: precomputed lists first, then every
+        remaining model user scored together in one matrix multiply."""
+        out: dict[int, list[tuple[int, float]]] = {}
+        model = self.store.get()
+        snap = self.catalog.get()
+        user_ids = list(dict.fromkeys(user_ids))
+        seen = self.seen_track_ids_batch(db, user_ids) if model is not None else {}
+        folded = self.foldin.vectors_for(db, model, user_ids) if model is not None else {}
+        dead = self._dead_items(model, snap) if model is not None else None
+        to_score: list[tuple[int, np.ndarray]] = []
+        for uid in user_ids:
+            idx = model.user_index(uid) if model is not None else None
+            if uid in folded:
+                to_score.append((uid, folded[uid]))
+                continue
+            if idx is None:
+                out[uid] = self.recommend_content(db, uid, limit, snap=snap) or self._fallback(snap, uid, limit, 1, None)
+                continue
+            pre = model.precomputed(idx, limit, np.concatenate([np.asarray(seen.get(uid, []), dtype=np.int64), model.item_ids[dead]]))
+            if pre is not None:
+                out[uid] = pre
+            else:
+                to_score.append((uid, model.user_factors[idx]))
+        if to_score:
+            vectors = np.vstack([vec for _, vec in to_score]).astype(np.float32)
+            excludes = [np.concatenate([model.item_indices(seen.get(uid, ())), dead]) for uid, _ in to_score]
+            ids, scores = model.score_vectors(vectors, limit, excludes)
+            for j, (uid, _) in enumerate(to_score):
+                valid = ids[j] >= 0
+                out[uid] = list(zip(ids[j][valid].tolist(), scores[j][valid].tolist()))
+        return {uid: out[uid] for uid in user_ids}
+
+    def similar_tracks(self, track_id: int, limit: int = 20, exact: bool = False, nprobe: int = 8) -> Optional[list[tuple[int, float]]]:
+        """Nearest tracks in item-factor space; None when no model covers the track."""
+        model = self.store.get()
+        if model is None:
+            return None
+        dead = self._dead_items(model, self.catalog.get())
+        return model.similar_items(track_id, limit, exact=exact, nprobe=nprobe, exclude=dead)
+
+    @staticmethod
+    def recent_plays(db: Session, user_id: int, days: int) -> tuple[np.ndarray, np.ndarray]:
+        """(track ids, hours since last play) for tracks played in the last ``days`` days."""
+        now = datetime.utcnow()
+        rows = db.execute(
+            select(Interaction.track_id, func.max(Interaction.played_at))
+            .where(Interaction.user_id == user_id, Interaction.track_id.is_not(None),
+                   Interaction.played_at >= now - timedelta(days=days))
+            .group_by(Interaction.track_id)
+        ).all()
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        ages = np.array([max((now - r[1]).total_seconds(), 0.0) / 3600.0 for r in rows], dtype=np.float64)
+        return ids, ages
+
+    @staticmethod
+    def seen_track_ids(db: Session, user_id: int) -> list[int]:
+        """Track ids the user already liked or played (one query)."""
+        liked = select(TrackLike.track_id).where(TrackLike.user_id == user_id)
+        played = select(Interaction.track_id).where(
+            Interaction.user_id == user_id, Interaction.track_id.is_not(None)
+        )
+        return [r for r in db.execute(union(liked, played)).scalars()]
+
+    @staticmethod
+    def seen_track_ids_batch(db: Session, user_ids: list[int]) -> dict[int, list[int]]:
+        """``seen_track_ids`` for many users in one query."""
+        if not user_ids:
+            return {}
+        liked = select(TrackLike.user_id, TrackLike.track_id).where(TrackLike.user_id.in_(user_ids))
+        played = select(Interaction.user_id, Interaction.track_id).where(
+            Interaction.user_id.in_(user_ids), Interaction.track_id.is_not(None)
+        )
+        seen: dict[int, list[int]] = {}
+        for uid, tid in db.execute(union(liked, played)):
+            seen.setdefault(uid, []).append(tid)
+        return seen
+
+    @staticmethod
+    def _fallback(
+        snap: CatalogSnapshot,
+        user_id: int,
+        limit: int,
+        start_id: int,
+        max_track_id: Optional[int],
     ) -> list[tuple[int, float]]:
-        rng = random.Random(user_id)
-        if max_track_id is None:
-            # probe max track id quickly (could be large; optimize later)
-            from ..models.music import Track
-            last = db.query(Track.id).order_by(Track.id.desc()).first()
-            max_track_id = last[0] if last else 200
-        candidates = list(range(start_id, max_track_id + 1))
-        rng.shuffle(candidates)
-        picked = candidates[: limit * 2]  # over-sample slightly
-        scored: list[tuple[int, float]] = []
-        for idx, tid in enumerate(picked):
-            base = 1 / (1 + math.log(idx + 2))
-            jitter = rng.random() * 0.05
-            scored.append((tid, base + jitter))
-        scored.sort(key=lambda x: x[1], reverse=True)
-        return scored[:limit]
+        """Deterministic pseudo-random pick of live ids in [start_id, max_track_id]."""
+        rng = np.random.default_rng(user_id)
+        candidates = snap.id_slice(start_id, max_track_id)
+        if candidates.size == 0:
+            return []
+        # over-sample slightly; choice without replacement is O(size) for large catalogs
+        picked = candidates[rng.choice(candidates.size, size=min(limit * 2, candidates.size), replace=False)]
+        base = 1 / (1 + np.log(np.arange(picked.size) + 2))
+        scores = base + rng.random(picked.size) * 0.05
+        order = np.argsort(-scores, kind='stable')[:limit]
+        return [(int(picked[i]), float(scores[i])) for i in order]
 
 recommendation_service = RecommendationService()
@@ -0,0 +1,167 @@
+"""Re-ranking of a retrieved candidate pool.
+
+Retrieval (MF factors, content features or the fallback) returns a pool of up
+to ``rerank_pool`` candidates; the stages below then apply business rules and
+diversity before the final ``limit`` items are cut:
+
+  - ``ExplicitFilter``: drop ``Track.is_explicit`` tracks when not allowed.
+  - ``RecentPlayDemotion``: subtract a penalty that halves every
+    ``half_life_hours`` since the user's last play of the track.
+  - ``ArtistCap``: keep at most ``cap`` tracks per ``Track.artist_id``.
+  - ``MMRSelect``: greedy maximal marginal relevance over the item vectors.
+
+Every stage works on whole NumPy arrays (MMR loops only ``limit`` times) and
+records its wall time in ``Candidates.timings`` (milliseconds).
+"""
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+import numpy as np
+
+from .catalog import CatalogSnapshot
+
+
+class Candidates:
+    """Aligned arrays for the candidate pool; stages filter / re-order them in place."""
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray, vectors: Optional[np.ndarray] = None,
+                 artist_ids: Optional[np.ndarray] = None, explicit: Optional[np.ndarray] = None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        n = len(self.ids)
+        self.vectors = vectors
+        self.artist_ids = artist_ids if artist_ids is not None else -1 - np.arange(n, dtype=np.int64)
+        self.explicit = explicit if explicit is not None else np.zeros(n, dtype=bool)
+        # min-max normalized score, so penalties and MMR similarity share one scale
+        if n:
+            lo, hi = float(self.scores.min()), float(self.scores.max())
+            self.relevance = (self.scores - lo) / (hi - lo) if hi > lo else np.ones(n, dtype=np.float32)
+        else:
+            self.relevance = np.empty(0, dtype=np.float32)
+        self.ordered = False
+        self.timings: dict[str, float] = {}
+
+    @classmethod
+    def from_pairs(cls, pairs: list[tuple[int, float]], **kwargs) -> 'Candidates':
+        ids = np.array([t for t, _ in pairs], dtype=np.int64)
+        scores = np.array([s for _, s in pairs], dtype=np.float32)
+        return cls(ids, scores, **kwargs)
+
+    def attach_catalog(self, snap: CatalogSnapshot) -> 'Candidates':
+        """Look up artist / explicit flags of the candidates in the catalog snapshot."""
+        if len(snap) and len(self.ids):
+            pos = np.searchsorted(snap.ids, self.ids)
+            pos[pos >= len(snap.ids)] = 0
+            found = snap.ids[pos] == self.ids
+            self.artist_ids = np.where(found, snap.artist_ids[pos], self.artist_ids)
+            self.explicit = found & snap.is_explicit[pos]
+        return self
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def take(self, index: np.ndarray) -> None:
+        """Keep (and re-order to) the rows selected by ``index`` (mask or positions)."""
+        self.ids = self.ids[index]
+        self.scores = self.scores[index]
+        self.relevance = self.relevance[index]
+        self.artist_ids = self.artist_ids[index]
+        self.explicit = self.explicit[index]
+        if self.vectors is not None:
+            self.vectors = self.vectors[index]
+
+    def top(self, limit: int) -> list[tuple[int, float]]:
+        """Best ``limit`` candidates as (track_id, original score)."""
+        if not self.ordered:
+            self.take(np.argsort(-self.relevance, kind='stable'))
+            self.ordered = True
+        return list(zip(self.ids[:limit].tolist(), self.scores[:limit].tolist()))
+
+
+class ExplicitFilter:
+    name = 'explicit'
+
+    def __call__(self, cand: Candidates, limit: int) -> None:
+        if cand.explicit.any():
+            cand.take(~cand.explicit)
+
+
+class RecentPlayDemotion:
+    name = 'recent'
+
+    def __init__(self, track_ids: np.ndarray, age_hours: np.ndarray, half_life_hours: float = 72.0,
+                 weight: float = 1.0):
+        order = np.argsort(track_ids)
+        self.track_ids = np.asarray(track_ids, dtype=np.int64)[order]
+        self.penalty = weight * np.power(0.5, np.asarray(age_hours, dtype=np.float64)[order] / half_life_hours)
+
+    def __call__(self, cand: Candidates, limit: int) -> None:
+        if not len(self.track_ids) or not len(cand):
+            return
+        pos = np.searchsorted(self.track_ids, cand.ids)
+        pos[pos >= len(self.track_ids)] = 0
+        hit = self.track_ids[pos] == cand.ids
+        cand.relevance = cand.relevance - np.where(hit, self.penalty[pos], 0.0).astype(np.float32)
+        cand.ordered = False
+
+
+class ArtistCap:
+    name = 'artist_cap'
+
+    def __init__(self, cap: int = 2):
+        self.cap = cap
+
+    def __call__(self, cand: Candidates, limit: int) -> None:
+        if self.cap <= 0 or len(cand) <= self.cap:
+            return
+        # rank of each candidate within its artist group, best relevance first
+        order = np.lexsort((-cand.relevance, cand.artist_ids))
+        artists = cand.artist_ids[order]
+        starts = np.flatnonzero(np.r_[True, artists[1:] != artists[:-1]])
+        group_start = np.repeat(starts, np.diff(np.r_[starts, len(artists)]))
+        rank = np.empty(len(cand), dtype=np.int64)
+        rank[order] = np.arange(len(cand)) - group_start
+        cand.take(rank < self.cap)
+
+
+class MMRSelect:
+    """Greedy MMR: pick ``argmax lam * relevance - (1 - lam) * max cosine to picked``."""
+    name = 'mmr'
+
+    def __init__(self, lam: float = 0.7):
+        self.lam = lam
+
+    def __call__(self, cand: Candidates, limit: int) -> None:
+        if cand.vectors is None or self.lam >= 1.0 or len(cand) <= 1:
+            return
+        k = min(limit, len(cand))
+        vecs = np.asarray(cand.vectors, dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1)
+        vecs = vecs / np.where(norms > 0, norms, 1.0)[:, None]
+        base = self.lam * cand.relevance
+        max_sim = np.full(len(cand), -1.0, dtype=np.float32)
+        picked = np.empty(k, dtype=np.int64)
+        for i in range(k):
+            gain = base - (1.0 - self.lam) * max_sim
+            gain[picked[:i]] = -np.inf
+            j = int(np.argmax(gain))
+            picked[i] = j
+            np.maximum(max_sim, vecs @ vecs[j], out=max_sim)
+        cand.take(picked)
+        cand.ordered = True
+
+
+class Reranker:
+    """Runs the stages in order and times each one."""
+
+    def __init__(self, stages: list):
+        self.stages = stages
+
+    def run(self, cand: Candidates, limit: int) -> list[tuple[int, float]]:
+        for stage in self.stages:
+            t0 = time.perf_counter()
+            stage(cand, limit)
+            cand.timings[stage.name] = (time.perf_counter() - t0) * 1000.0
+        return cand.top(limit)
@@ -0,0 +1,488 @@
+"""In-process full-text index over track titles, artist names and album titles.
+
+Terms are accent-folded lower-case words (``Sơn Tùng`` -> ``son``, ``tung``).
+The index is a list of immutable segments, each a CSR inverted index in NumPy
+arrays: a sorted term vocabulary, ``offsets`` into the posting arrays (track
+ids + a bit mask of the fields the term occurs in) and a trigram index over
+the vocabulary for fuzzy matching. Lookups are binary searches on the sorted
+vocabulary, so exact terms and prefixes (typeahead on the last word) cost a
+few ``searchsorted`` calls; words with no exact or prefix match fall back to
+vocabulary terms sharing enough trigrams (typos).
+
+New tracks are picked up incrementally like the catalog snapshot: rows with
+``id > max_id`` become a new small segment; when there are more than
+``MAX_SEGMENTS`` the smaller ones are merged. Segments are saved under
+``SEARCH_INDEX_DIR`` (``seg_<uuid>.npz`` + ``manifest.json``), so a restart
+only loads the arrays and catches up on the newest rows. Every uvicorn worker
+keeps its own index in memory; saves take an exclusive file lock on the
+directory and are skipped when another process already saved the same rows,
+so workers never overwrite or delete each other's files mid-save. Deleted
+tracks are not removed from the index; callers filter hits through the
+catalog snapshot.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..core.config import get_settings
+from ..core.db import SessionLocal
+from ..models.music import Album, Artist, Track
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+TITLE, ARTIST, ALBUM = 1, 2, 4
+# score weight of a posting by the best field it occurs in (index = field bit mask)
+FIELD_WEIGHT = np.array([0.0, 1.0, 0.8, 1.0, 0.6, 1.0, 0.8, 1.0], dtype=np.float32)
+PREFIX_SCORE = 0.7
+FUZZY_SCORE = 0.5
+# typeahead: completions of the last word considered (most frequent first)
+MAX_EXPANSIONS = 64
+MAX_FUZZY_TERMS = 8
+MIN_TRIGRAM_SIMILARITY = 0.3
+MAX_SEGMENTS = 8
+# postings of the rarest query word ranked per search (see SearchIndex)
+CANDIDATE_CAP = 20000
+LOAD_BATCH = 50000
+_WORD = re.compile(r'\w+')
+# letters that do not decompose into base letter + accent
+_NO_DECOMPOSITION = {'đ': 'd', 'ð': 'd', 'ø': 'o', 'ł': 'l'}
+
+
+class _FoldTable(dict):
+    """``str.translate`` table: character -> lower-case, accent-free form, computed once per character."""
+
+    def __missing__(self, code: int) -> str:
+        folded = unicodedata.normalize('NFKD', chr(code).casefold())
+        folded = ''.join(_NO_DECOMPOSITION.get(c, c) for c in folded if not unicodedata.combining(c))
+        self[code] = folded
+        return folded
+
+
+_FOLD = _FoldTable()
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    """Lower-case, accent-folded words of ``text``."""
+    if not text:
+        return []
+    return _WORD.findall(text.lower() if text.isascii() else text.translate(_FOLD))
+
+
+def trigrams(term: str) -> set[str]:
+    padded = f'${term}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _csr(keys: np.ndarray, n_keys: int) -> np.ndarray:
+    """Offsets of the runs of equal (sorted) ``keys``."""
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    return offsets
+
+
+class Segment:
+    """Immutable inverted index over a set of tracks."""
+
+    def __init__(self, vocab: np.ndarray, offsets: np.ndarray, docs: np.ndarray, fields: np.ndarray,
+                 tri_vocab: np.ndarray, tri_offsets: np.ndarray, tri_terms: np.ndarray, max_id: int):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.fields = fields
+        self.tri_vocab = tri_vocab
+        self.tri_offsets = tri_offsets
+        self.tri_terms = tri_terms
+        self.max_id = max_id
+        self.df = np.diff(offsets)
+        # a word of n characters has (at most) n trigrams
+        self.term_len = np.char.str_len(vocab).astype(np.int32)
+        self.file: Optional[str] = None
+
+    @classmethod
+    def build(cls, rows: Iterable[tuple]) -> Optional['Segment']:
+        """From ``(track_id, title, artist_name, album_title)`` rows; None if there are none."""
+        term_ids: dict[str, int] = {}
+        p_terms: list[int] = []
+        p_docs: list[int] = []
+        p_fields: list[int] = []
+        max_id = 0
+        for track_id, title, artist, album in rows:
+            bits: dict[int, int] = {}
+            for text, bit in ((title, TITLE), (artist, ARTIST), (album, ALBUM)):
+                for term in tokenize(text):
+                    tid = term_ids.setdefault(term, len(term_ids))
+                    bits[tid] = bits.get(tid, 0) | bit
+            for tid, b in bits.items():
+                p_terms.append(tid)
+                p_docs.append(track_id)
+                p_fields.append(b)
+            max_id = max(max_id, track_id)
+        if not term_ids:
+            return None
+        words = np.array(list(term_ids), dtype=str)
+        order = np.argsort(words, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        return cls._from_postings(words[order], rank[np.array(p_terms, dtype=np.int64)],
+                                  np.array(p_docs, dtype=np.int64), np.array(p_fields, dtype=np.uint8), max_id)
+
+    @classmethod
+    def merge(cls, segments: list['Segment']) -> 'Segment':
+        vocab, inverse = np.unique(np.concatenate([s.vocab for s in segments]), return_inverse=True)
+        terms, start = [], 0
+        for s in segments:
+            terms.append(np.repeat(inverse[start:start + len(s.vocab)], s.df))
+            start += len(s.vocab)
+        return cls._from_postings(vocab, np.concatenate(terms), np.concatenate([s.docs for s in segments]),
+                                  np.concatenate([s.fields for s in segments]), max(s.max_id for s in segments))
+
+    @classmethod
+    def _from_postings(cls, vocab: np.ndarray, terms: np.ndarray, docs: np.ndarray, fields: np.ndarray,
+                       max_id: int) -> 'Segment':
+        order = np.lexsort((docs, terms))
+        terms = terms[order]
+        # trigram -> vocabulary term ids, for fuzzy matching
+        tri_keys: dict[str, list[int]] = {}
+        for tid, term in enumerate(vocab.tolist()):
+            for tri in trigrams(term):
+                tri_keys.setdefault(tri, []).append(tid)
+        tri_vocab = np.array(sorted(tri_keys), dtype='<U3')
+        tri_lists = [tri_keys[t] for t in tri_vocab.tolist()]
+        tri_terms = np.array([tid for lst in tri_lists for tid in lst], dtype=np.int32)
+        tri_offsets = np.zeros(len(tri_vocab) + 1, dtype=np.int64)
+        np.cumsum([len(lst) for lst in tri_lists], out=tri_offsets[1:])
+        return cls(vocab, _csr(terms, len(vocab)), docs[order], fields[order],
+                   tri_vocab, tri_offsets, tri_terms, max_id)
+
+    # -- persistence -------------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_name(path.name + '.tmp')
+        with tmp.open('wb') as fh:
+            np.savez(fh, vocab=self.vocab, offsets=self.offsets, docs=self.docs, fields=self.fields,
+                     tri_vocab=self.tri_vocab, tri_offsets=self.tri_offsets, tri_terms=self.tri_terms,
+                     max_id=np.array(self.max_id))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'Segment':
+        with np.load(path, allow_pickle=False) as z:
+            seg = cls(z['vocab'], z['offsets'], z['docs'], z['fields'], z['tri_vocab'],
+                      z['tri_offsets'], z['tri_terms'], int(z['max_id']))
+        seg.file = path.name
+        return seg
+
+    # -- lookups -----------------------------------------------------------
+
+    def lookup(self, term: str, prefix: bool) -> tuple[np.ndarray, np.ndarray]:
+        """Vocabulary ids equal to ``term`` (or, with ``prefix``, starting with it) and their match scores."""
+        lo = int(np.searchsorted(self.vocab, term, side='left'))
+        if not prefix:
+            if lo < len(self.vocab) and self.vocab[lo] == term:
+                return np.array([lo]), np.ones(1, dtype=np.float32)
+            return _NO_TERMS
+        hi = int(np.searchsorted(self.vocab, term + '\U0010ffff', side='left'))
+        if hi <= lo:
+            return _NO_TERMS
+        ids = np.arange(lo, hi)
+        if len(ids) > MAX_EXPANSIONS:
+            ids = ids[np.argpartition(-self.df[lo:hi], MAX_EXPANSIONS)[:MAX_EXPANSIONS]]
+        # the word itself 1.0, completions score higher the less they add to the typed prefix
+        scores = PREFIX_SCORE + (1 - PREFIX_SCORE) * len(term) / self.term_len[ids]
+        return ids, scores.astype(np.float32)
+
+    def fuzzy(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        """Vocabulary ids sharing enough trigrams with ``term`` and their match scores."""
+        grams = np.array(sorted(trigrams(term)), dtype='<U3')
+        pos = np.searchsorted(self.tri_vocab, grams)
+        inside = pos < len(self.tri_vocab)
+        pos = pos[inside][self.tri_vocab[pos[inside]] == grams[inside]]
+        if not len(pos):
+            return _NO_TERMS
+        cand = np.concatenate([self.tri_terms[self.tri_offsets[p]:self.tri_offsets[p + 1]] for p in pos])
+        ids, shared = np.unique(cand, return_counts=True)
+        # Jaccard similarity of the trigram sets
+        sim = shared / (len(grams) + self.term_len[ids] - shared)
+        keep = sim >= MIN_TRIGRAM_SIMILARITY
+        ids, sim = ids[keep], sim[keep]
+        best = np.argsort(-sim, kind='stable')[:MAX_FUZZY_TERMS]
+        return ids[best], (FUZZY_SCORE * sim[best]).astype(np.float32)
+
+    def collect(self, ids: np.ndarray, scores: np.ndarray, cap: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Postings of the terms, best-scoring terms first, at most ``cap`` of them."""
+        order = np.argsort(-scores, kind='stable')
+        remaining = cap
+        docs, weights = [], []
+        for t, score in zip(ids[order].tolist(), scores[order].tolist()):
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                hi = min(hi, lo + remaining)
+                remaining -= hi - lo
+            docs.append(self.docs[lo:hi])
+            weights.append(FIELD_WEIGHT[self.fields[lo:hi]] * score)
+        if len(docs) == 1:
+            return docs[0], weights[0]
+        return np.concatenate(docs), np.concatenate(weights)
+
+    def probe(self, ids: np.ndarray, scores: np.ndarray, docs: np.ndarray) -> np.ndarray:
+        """Best score of each of ``docs`` (sorted) for the terms; 0 where none of them occurs."""
+        best = np.zeros(len(docs), dtype=np.float32)
+        for t, score in zip(ids.tolist(), scores.tolist()):
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            posting = self.docs[lo:hi]
+            pos = np.minimum(np.searchsorted(posting, docs), hi - lo - 1)
+            hit = posting[pos] == docs
+            np.maximum(best, np.where(hit, FIELD_WEIGHT[self.fields[lo + pos]] * score, 0), out=best)
+        return best
+
+
+_NO_TERMS = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+
+
+def _best_per_doc(docs: np.ndarray, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Unique sorted docs with their highest score."""
+    order = np.lexsort((-scores, docs))
+    docs, scores = docs[order], scores[order]
+    first = np.ones(len(docs), dtype=bool)
+    first[1:] = docs[1:] != docs[:-1]
+    return docs[first], scores[first]
+
+
+class SearchIndex:
+    """Immutable set of segments; ``search`` ranks tracks matching every query word.
+
+    The rarest word supplies the candidates (its most relevant ``CANDIDATE_CAP``
+    postings when it is very common); the other words are only probed for
+    those candidates, so common words never materialize their posting lists.
+    """
+
+    def __init__(self, segments: list[Segment]):
+        self.segments = segments
+        self.max_id = max((s.max_id for s in segments), default=0)
+
+    def _terms(self, word: str, prefix: bool) -> list[tuple[Segment, np.ndarray, np.ndarray]]:
+        parts = [(s, *s.lookup(word, prefix)) for s in self.segments]
+        parts = [p for p in parts if len(p[1])]
+        if not parts and len(word) >= 3:
+            parts = [(s, *s.fuzzy(word)) for s in self.segments]
+            parts = [p for p in parts if len(p[1])]
+        return parts
+
+    def search(self, query: str, limit: int = 20, prefix: bool = True) -> list[tuple[int, float]]:
+        """``(track_id, score)`` best first; the last word is matched as a prefix unless the query ends with a space."""
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words or not self.segments:
+            return []
+        last_prefix = prefix and not query[-1:].isspace()
+        matches = []
+        for i, word in enumerate(words):
+            parts = self._terms(word, last_prefix and i == len(words) - 1)
+            if not parts:
+                return []
+            matches.append((sum(int(s.df[ids].sum()) for s, ids, _ in parts), parts))
+        matches.sort(key=lambda m: m[0])
+        collected = [s.collect(ids, sc, CANDIDATE_CAP) for s, ids, sc in matches[0][1]]
+        docs = np.concatenate([d for d, _ in collected])
+        scores = np.concatenate([w for _, w in collected])
+        if len(collected) > 1 or len(matches[0][1][0][1]) > 1:
+            docs, scores = _best_per_doc(docs, scores)
+        for _, parts in matches[1:]:
+            extra = np.zeros(len(docs), dtype=np.float32)
+            for s, ids, sc in parts:
+                np.maximum(extra, s.probe(ids, sc, docs), out=extra)
+            hit = extra > 0
+            docs, scores = docs[hit], scores[hit] + extra[hit]
+            if not len(docs):
+                return []
+        if len(docs) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            docs, scores = docs[top], scores[top]
+        order = np.lexsort((docs, -scores))
+        return [(int(docs[i]), round(float(scores[i]), 4)) for i in order]
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive lock on ``path`` across processes (API workers, tools)."""
+    with open(path, 'a+b') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SearchService:
+    """Process-wide search index, caught up with new tracks and saved to ``index_dir``."""
+
+    def __init__(self, index_dir: str, refresh_seconds: float = 30.0):
+        self.index_dir = Path(index_dir)
+        self.refresh_seconds = refresh_seconds
+        self._index: Optional[SearchIndex] = None
+        self._checked_at = 0.0
+        self._stale = True
+        # last refresh failed: wait refresh_seconds before retrying, even when stale
+        self._failing = False
+        self._lock = threading.Lock()
+
+    def _due(self) -> bool:
+        if time.monotonic() - self._checked_at > self.refresh_seconds:
+            return True
+        return (self._index is None or self._stale) and not self._failing
+
+    def get(self) -> SearchIndex:
+        """The current index; never waits for a refresh running in another thread
+        (until the first build finishes, searches see an empty index)."""
+        if self._due():
+            try:
+                self.refresh(wait=False)
+            except Exception as e:
+                print(f"[search] refresh failed: {e}")
+                self._checked_at = time.monotonic()
+                self._failing = True
+        index = self._index
+        return index if index is not None else SearchIndex([])
+
+    def invalidate(self) -> None:
+        """Mark the index stale (call after inserting tracks)."""
+        self._stale = True
+
+    def start(self) -> None:
+        """Load / build the index in the background so the first search does not wait for it."""
+        threading.Thread(target=self.get, name='search-index', daemon=True).start()
+
+    @staticmethod
+    def _rows(db: Session, after: int, batch: int = LOAD_BATCH):
+        """``(id, title, artist, album)`` of tracks with ``id > after``, in keyset batches."""
+        while True:
+            stmt = (
+                select(Track.id, Track.title, Artist.name, Album.title)
+                .join(Artist, Artist.id == Track.artist_id, isouter=True)
+                .join(Album, Album.id == Track.album_id, isouter=True)
+                .where(Track.id > after).order_by(Track.id).limit(batch)
+            )
+            rows = db.execute(stmt).all()
+            yield from rows
+            if len(rows) < batch:
+                return
+            after = rows[-1][0]
+
+    def _manifest(self) -> Optional[dict]:
+        manifest = self.index_dir / 'manifest.json'
+        if not manifest.exists():
+            return None
+        return json.loads(manifest.read_text())
+
+    def _load_saved(self) -> list[Segment]:
+        if not (self.index_dir / 'manifest.json').exists():
+            return []
+        try:
+            # under the lock, so another worker's save cannot delete files while they are read
+            with _file_lock(self.index_dir / '.lock'):
+                manifest = self._manifest()
+                return [Segment.load(self.index_dir / name) for name in manifest['segments']] if manifest else []
+        except Exception as e:
+            print(f"[search] ignoring saved index: {e}")
+            return []
+
+    def _save(self, segments: list[Segment], force: bool = False) -> Optional[list[str]]:
+        """Write the manifest listing ``segments`` (and the segment files it lacks).
+
+        Skipped (None) unless ``force`` when the saved index, possibly written by
+        another worker, already covers the same rows.
+        """
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        max_id = max((seg.max_id for seg in segments), default=0)
+        with _file_lock(self.index_dir / '.lock'):
+            try:
+                saved = self._manifest()
+            except ValueError:
+                saved = None
+            if not force and saved is not None and saved.get('max_id', -1) >= max_id:
+                return None
+            for seg in segments:
+                # another process may have replaced the files this one loaded or wrote
+                if seg.file is None or not (self.index_dir / seg.file).exists():
+                    seg.file = f'seg_{uuid.uuid4().hex}.npz'
+                    seg.save(self.index_dir / seg.file)
+            names = [seg.file for seg in segments]
+            tmp = self.index_dir / 'manifest.json.tmp'
+            tmp.write_text(json.dumps({'segments': names, 'max_id': max_id}))
+            os.replace(tmp, self.index_dir / 'manifest.json')
+            for old in self.index_dir.glob('seg_*.npz'):
+                if old.name not in names:
+                    old.unlink(missing_ok=True)
+        return names
+
+    def refresh(self, db: Optional[Session] = None, rebuild: bool = False, wait: bool = True) -> Optional[SearchIndex]:
+        """Catch up with new tracks (``rebuild``: index everything again) and save.
+
+        With ``wait=False`` a refresh already running in another thread is not
+        waited for; the current index (None before the first build) is returned.
+        """
+        if not self._lock.acquire(blocking=wait):
+            return self._index
+        try:
+            if not wait and not self._due():
+                return self._index  # done by another thread meanwhile
+            own = db is None
+            db = db or SessionLocal()
+            try:
+                index = self._index
+                if index is None or rebuild:
+                    segments = [] if rebuild else self._load_saved()
+                else:
+                    segments = list(index.segments)
+                new = Segment.build(self._rows(db, after=max((s.max_id for s in segments), default=0)))
+                if new is not None or rebuild:
+                    if new is not None:
+                        segments.append(new)
+                    if len(segments) > MAX_SEGMENTS:
+                        # keep the largest segment, merge the small recent ones into one
+                        segments.sort(key=lambda s: len(s.docs), reverse=True)
+                        merged = Segment.merge(sorted(segments[1:], key=lambda s: s.max_id))
+                        segments = [segments[0], merged]
+                    try:
+                        self._save(segments, force=rebuild)
+                    except OSError as e:
+                        print(f"[search] could not save index: {e}")
+                self._index = SearchIndex(segments)
+                self._checked_at = time.monotonic()
+                self._stale = self._failing = False
+                return self._index
+            finally:
+                if own:
+                    db.close()
+        finally:
+            self._lock.release()
+
+
+_settings = get_settings()
+search_service = SearchService(_settings.search_index_dir, _settings.search_refresh_seconds)
@@ -0,0 +1,565 @@
+"""Storage backends for audio files (uploaded tracks and the Deezer preview cache).
+
+Files are addressed by name (``{id}.mp3``, ``{id}.wav``) and served through a
+``StorageBackend``:
+
+  - ``LocalStorage``: hash-sharded directory ``<root>/ab/cd/<name>`` where
+    ``abcd`` are the first hex digits of ``md5(<stem>)`` (the stem is the track
+    id), so every directory stays small even with millions of files and
+    ``{id}.wav`` / ``{id}.mp3`` of the same track share a shard. Files still
+    sitting flat in the root (the layout before sharding) are found as a
+    fallback until ``tools/migrate_audio_layout.py`` has moved them.
+  - ``S3Storage``: an S3-compatible bucket (AWS, MinIO via ``endpoint_url``)
+    through boto3, which is only imported when the backend is used. Large
+    files go up as parallel multipart uploads, and reads can be redirected
+    to presigned URLs.
+  - ``TieredStorage``: local disk in front of an object store. Reads are
+    served from disk and pulled from the bucket on a local miss (read-through);
+    writes land on disk and are uploaded in the background, so any API node
+    can serve any file.
+
+``AUDIO_STORAGE=s3`` turns both module-level stores into tiered ones.
+
+``FileIndex`` keeps the ids of the tracks with a local file in memory (one
+scan, repeated in the background, plus this process's own writes), so list
+endpoints can tell which tracks have audio without a syscall per row.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+from ..core.config import get_settings
+
+AUDIO_DIR = Path(__file__).resolve().parents[1] / 'static' / 'audio'
+SHARD_DEPTH = 2
+MEDIA_TYPES = {'mp3': 'audio/mpeg', 'wav': 'audio/wav'}
+_HEX = set('0123456789abcdef')
+
+
+def shard_of(name: str, depth: int = SHARD_DEPTH) -> str:
+    """Relative shard directory of a file name, e.g. ``'c4/ca'`` for ``'1.mp3'``."""
+    digest = hashlib.md5(name.partition('.')[0].encode()).hexdigest()
+    return '/'.join(digest[2 * i:2 * i + 2] for i in range(depth))
+
+
+def media_type(name: str) -> str:
+    return MEDIA_TYPES.get(name.rpartition('.')[2].lower(), 'application/octet-stream')
+
+
+def _is_shard(name: str) -> bool:
+    return len(name) == 2 and set(name) <= _HEX
+
+
+class StorageBackend(ABC):
+    """Common interface; ``locate`` / ``find`` never touch the network."""
+
+    # object-store tier, if any (set by TieredStorage)
+    remote: Optional['S3Storage'] = None
+
+    def locate(self, name: str) -> Optional[Path]:
+        """Local file for ``name`` or None."""
+        return None
+
+    @abstractmethod
+    def exists(self, name: str) -> bool:
+        """Whether ``name`` is stored (locally or in the remote tier)."""
+
+    def fetch(self, name: str) -> Optional[Path]:
+        """Local file for ``name``, downloading it first when the backend has a remote tier."""
+        return self.locate(name)
+
+    @abstractmethod
+    def put_file(self, name: str, path: Path) -> None:
+        """Store a finished file; ``path`` is consumed (moved or removed)."""
+
+    @abstractmethod
+    def delete(self, name: str) -> bool:
+        """Remove ``name``; True if it existed."""
+
+    def presigned_url(self, name: str) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    def temp_path(self, name: str) -> Path:
+        """Unique temp file to write ``name`` to before ``put_file``."""
+
+    def prepare(self, name: str) -> None:
+        """Make sure ``temp_path(name)`` can be written."""
+
+    def staging_path(self, suffix: str = '') -> Path:
+        """Temp file for data whose final name is not known yet (e.g. an upload in progress)."""
+        return Path(tempfile.gettempdir()) / f'{uuid.uuid4().hex}{suffix}.tmp'
+
+    def flush(self) -> None:
+        """Wait for background uploads."""
+
+    def find(self, stem: Union[str, int], exts: Iterable[str]) -> Optional[tuple[Path, str]]:
+        """First local ``<stem>.<ext>`` in ``exts`` order, as (path, ext)."""
+        for ext in exts:
+            path = self.locate(f'{stem}.{ext}')
+            if path is not None:
+                return path, ext
+        return None
+
+    def resolve(self, name: str, redirect: bool = False) -> Union[Path, str, None]:
+        """What to serve for ``name``: a local file, else (``redirect``) a presigned
+        URL of the remote copy, else the file pulled from the remote tier."""
+        path = self.locate(name)
+        if path is not None or self.remote is None:
+            return path
+        if redirect:
+            return self.presigned_url(name)
+        return self.fetch(name)
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: Path, depth: int = SHARD_DEPTH):
+        self.root = root
+        self.depth = depth
+        # kept current by put_file / delete when set (see FileIndex)
+        self.index: Optional['FileIndex'] = None
+
+    @property
+    def local(self) -> 'LocalStorage':
+        return self
+
+    def path_for(self, name: str) -> Path:
+        """Where ``name`` is (or will be) stored in the sharded layout."""
+        return self.root / shard_of(name, self.depth) / name
+
+    def legacy_path(self, name: str) -> Path:
+        return self.root / name
+
+    def locate(self, name: str) -> Optional[Path]:
+        """Existing file for ``name`` (sharded first, then the flat legacy path) or None."""
+        for path in (self.path_for(name), self.legacy_path(name)):
+            if path.is_file():
+                return path
+        return None
+
+    def exists(self, name: str) -> bool:
+        return self.locate(name) is not None
+
+    def temp_path(self, name: str) -> Path:
+        # next to the final location (same filesystem, so the rename is atomic)
+        return self.path_for(name).with_name(f'{name.partition(".")[0]}.{uuid.uuid4().hex}.tmp')
+
+    def prepare(self, name: str) -> Path:
+        path = self.path_for(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def put_file(self, name: str, path: Path) -> Path:
+        target = self.prepare(name)
+        os.replace(path, target)
+        if self.index is not None:
+            self.index.add(name)
+        return target
+
+    def staging_path(self, suffix: str = '') -> Path:
+        # inside the root so put_file can rename it; dot-directories are never scanned
+        staging = self.root / '.staging'
+        staging.mkdir(parents=True, exist_ok=True)
+        return staging / f'{uuid.uuid4().hex}{suffix}.tmp'
+
+    def write_bytes(self, name: str, data: bytes) -> Path:
+        self.prepare(name)
+        tmp = self.temp_path(name)
+        tmp.write_bytes(data)
+        return self.put_file(name, tmp)
+
+    def delete(self, name: str) -> bool:
+        removed = False
+        for path in (self.path_for(name), self.legacy_path(name)):
+            try:
+                path.unlink()
+                removed = True
+            except FileNotFoundError:
+                pass
+        if removed and self.index is not None:
+            self.index.discard(name)
+        return removed
+
+    def scan(self) -> Iterator[os.DirEntry]:
+        """Every regular file of the store: the flat root and all shard directories.
+
+        Only two-hex-digit directories are descended into, so unrelated
+        subdirectories of the root (e.g. ``audio/deezer``) are not picked up.
+        """
+        yield from self._scan(self.root, self.depth)
+
+    def _scan(self, directory: Path, depth: int) -> Iterator[os.DirEntry]:
+        try:
+            it = os.scandir(directory)
+        except FileNotFoundError:
+            return
+        with it:
+            for e in it:
+                if e.is_file(follow_symlinks=False):
+                    if not e.name.startswith('.'):
+                        yield e
+                elif depth > 0 and _is_shard(e.name) and e.is_dir(follow_symlinks=False):
+                    yield from self._scan(Path(e.path), depth - 1)
+
+    def migrate(self, dry_run: bool = False) -> tuple[int, int]:
+        """Move flat legacy files into their shards; returns (moved, skipped).
+
+        A file is skipped when its sharded copy already exists (the sharded
+        copy wins and the flat one is left for the operator to inspect).
+        """
+        moved = skipped = 0
+        if not self.root.exists():
+            return moved, skipped
+        with os.scandir(self.root) as it:
+            names = [e.name for e in it if e.is_file(follow_symlinks=False)
+                     and not e.name.startswith('.') and not e.name.endswith('.tmp')]
+        for name in names:
+            target = self.path_for(name)
+            if target.exists():
+                skipped += 1
+                continue
+            if not dry_run:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(self.root / name, target)
+            moved += 1
+        return moved, skipped
+
+
+def _is_not_found(e: Exception) -> bool:
+    code = str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+class S3Storage(StorageBackend):
+    """Objects ``<prefix><name>`` in an S3-compatible bucket.
+
+    ``client`` is a boto3 S3 client (or anything with the same methods); by
+    default one is created from the standard AWS credential chain.
+    """
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, client=None, max_concurrency: int = 8,
+                 multipart_threshold: int = 8 * 1024 * 1024, presign_seconds: int = 900):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.max_concurrency = max_concurrency
+        self.multipart_threshold = multipart_threshold
+        self.presign_seconds = presign_seconds
+        self._client = client
+        self._transfer = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3  # optional dependency, only needed with AUDIO_STORAGE=s3
+
+            self._client = boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region)
+        return self._client
+
+    def _transfer_args(self) -> dict:
+        """``Config=`` for boto3's transfer manager: parallel multipart above the threshold."""
+        if self._transfer is None:
+            try:
+                from boto3.s3.transfer import TransferConfig
+            except ImportError:
+                return {}
+            self._transfer = TransferConfig(multipart_threshold=self.multipart_threshold,
+                                            max_concurrency=self.max_concurrency)
+        return {'Config': self._transfer}
+
+    def key(self, name: str) -> str:
+        return self.prefix + name
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+            return True
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+
+    def keys(self) -> dict[str, int]:
+        """Name -> size of every object under the prefix (one listing, no per-file HEAD)."""
+        out: dict[str, int] = {}
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        while True:
+            page = self.client.list_objects_v2(**kwargs)
+            for obj in page.get('Contents', []):
+                out[obj['Key'][len(self.prefix):]] = int(obj['Size'])
+            if not page.get('IsTruncated'):
+                return out
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    def upload(self, name: str, path: Path) -> None:
+        self.client.upload_file(str(path), self.bucket, self.key(name),
+                                ExtraArgs={'ContentType': media_type(name)}, **self._transfer_args())
+
+    def put_file(self, name: str, path: Path) -> None:
+        try:
+            self.upload(name, path)
+        finally:
+            Path(path).unlink(missing_ok=True)
+
+    def submit_upload(self, name: str, path: Path, remove: bool = False) -> Future:
+        """Upload in the background (bounded worker pool); ``remove`` deletes ``path`` afterwards."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix='s3-upload')
+        return self._executor.submit(self.put_file if remove else self.upload, name, path)
+
+    def download(self, name: str, dest: Path) -> bool:
+        """Copy the object to ``dest``; False when it does not exist."""
+        try:
+            self.client.download_file(self.bucket, self.key(name), str(dest), **self._transfer_args())
+            return True
+        except Exception as e:
+            Path(dest).unlink(missing_ok=True)
+            if _is_not_found(e):
+                return False
+            raise
+
+    def delete(self, name: str) -> bool:
+        # DeleteObject succeeds for missing keys too, so ask first
+        if not self.exists(name):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        return True
+
+    def presigned_url(self, name: str) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.key(name)}, ExpiresIn=self.presign_seconds)
+
+    def temp_path(self, name: str) -> Path:
+        return Path(tempfile.gettempdir()) / f'{name}.{uuid.uuid4().hex}.tmp'
+
+
+class TieredStorage(StorageBackend):
+    """Local disk (cache) in front of an object store (source of truth).
+
+    Remote existence checks (a HEAD each) are remembered for a while: what
+    this node uploaded, pulled or looked up is trusted for ``hit_seconds``,
+    a miss for ``miss_seconds`` (another node may upload it meanwhile).
+    """
+
+    def __init__(self, local: LocalStorage, remote: S3Storage, hit_seconds: float = 600.0,
+                 miss_seconds: float = 30.0, maxsize: int = 100_000):
+        self.local = local
+        self.remote = remote
+        self.hit_seconds = hit_seconds
+        self.miss_seconds = miss_seconds
+        self.maxsize = maxsize
+        self._known: OrderedDict[str, tuple[bool, float]] = OrderedDict()
+        self._pending: set[Future] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def root(self) -> Path:
+        return self.local.root
+
+    def path_for(self, name: str) -> Path:
+        return self.local.path_for(name)
+
+    def locate(self, name: str) -> Optional[Path]:
+        return self.local.locate(name)
+
+    def exists(self, name: str) -> bool:
+        return self.local.exists(name) or self.remote_exists(name)
+
+    def remote_exists(self, name: str) -> bool:
+        """Whether the object store has ``name``; a HEAD only when not known recently."""
+        with self._lock:
+            entry = self._known.get(name)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        found = self.remote.exists(name)
+        self._remember(name, found)
+        return found
+
+    def _remember(self, name: str, found: bool) -> None:
+        until = time.monotonic() + (self.hit_seconds if found else self.miss_seconds)
+        with self._lock:
+            self._known[name] = (found, until)
+            self._known.move_to_end(name)
+            while len(self._known) > self.maxsize:
+                self._known.popitem(last=False)
+
+    def fetch(self, name: str) -> Optional[Path]:
+        path = self.local.locate(name)
+        if path is not None:
+            return path
+        self.local.prepare(name)
+        tmp = self.local.temp_path(name)
+        found = self.remote.download(name, tmp)
+        self._remember(name, found)
+        if not found:
+            return None
+        return self.local.put_file(name, tmp)
+
+    def put_file(self, name: str, path: Path) -> Path:
+        target = self.local.put_file(name, path)
+        # upload from a hard link, so the cache manager may evict ``target`` meanwhile
+        ref = self.local.temp_path(name)
+        try:
+            os.link(target, ref)
+        except OSError:
+            ref = None
+        fut = self.remote.submit_upload(name, ref or target, remove=ref is not None)
+        with self._lock:
+            self._pending.add(fut)
+        fut.add_done_callback(lambda f: self._uploaded(name, f))
+        return target
+
+    def _uploaded(self, name: str, fut: Future) -> None:
+        with self._lock:
+            self._pending.discard(fut)
+        if fut.exception() is None:
+            self._remember(name, True)
+        elif isinstance(fut.exception(), FileNotFoundError):
+            print(f"[storage] upload to {self.remote.bucket} skipped, local file already evicted")
+        elif fut.exception() is not None:
+            print(f"[storage] upload to {self.remote.bucket} failed: {fut.exception()}")
+
+    def flush(self) -> None:
+        with self._lock:
+            pending = list(self._pending)
+        for fut in pending:
+            try:
+                fut.result()
+            except Exception:
+                pass  # already logged
+
+    def delete(self, name: str) -> bool:
+        removed = self.local.delete(name)
+        deleted = self.remote.delete(name)
+        self._remember(name, False)
+        return deleted or removed
+
+    def presigned_url(self, name: str) -> Optional[str]:
+        return self.remote.presigned_url(name) if self.remote_exists(name) else None
+
+    def temp_path(self, name: str) -> Path:
+        return self.local.temp_path(name)
+
+    def prepare(self, name: str) -> Path:
+        return self.local.prepare(name)
+
+    def staging_path(self, suffix: str = '') -> Path:
+        return self.local.staging_path(suffix)
+
+
+class FileIndex:
+    """Ids of the tracks with a local ``{id}.<ext>`` file (``exts``) in ``storage``.
+
+    Filled by a scan in a background thread, repeated every ``refresh_seconds``
+    to pick up files written by other processes (tools, other workers), and
+    updated right away by this process's ``put_file`` / ``delete``. Until the
+    first scan has finished, lookups check the disk instead.
+    """
+
+    def __init__(self, storage: LocalStorage, exts: Iterable[str] = ('wav', 'mp3'), refresh_seconds: float = 300.0):
+        self.storage = storage
+        self.exts = tuple(exts)
+        self.refresh_seconds = refresh_seconds
+        self.ready = False
+        self._ids: set[int] = set()
+        # ids added while a scan is running (merged into its result)
+        self._added: Optional[set[int]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        storage.index = self
+
+    def _id(self, name: str) -> Optional[int]:
+        stem, _, ext = name.partition('.')
+        return int(stem) if ext in self.exts and stem.isdigit() else None
+
+    def __contains__(self, track_id: int) -> bool:
+        if not self.ready:
+            return self.storage.find(track_id, self.exts) is not None
+        return track_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, name: str) -> None:
+        track_id = self._id(name)
+        if track_id is None:
+            return
+        with self._lock:
+            self._ids.add(track_id)
+            if self._added is not None:
+                self._added.add(track_id)
+
+    def discard(self, name: str) -> None:
+        track_id = self._id(name)
+        # the track may still have a file with another extension
+        if track_id is not None and self.storage.find(track_id, self.exts) is None:
+            with self._lock:
+                self._ids.discard(track_id)
+
+    def rescan(self) -> int:
+        with self._lock:
+            self._added = set()
+        try:
+            ids = {i for i in (self._id(e.name) for e in self.storage.scan()) if i is not None}
+        finally:
+            with self._lock:
+                added, self._added = self._added, None
+        with self._lock:
+            self._ids = ids | added
+        self.ready = True
+        return len(ids)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='audio-file-index', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.rescan()
+            except Exception as e:
+                print(f"[storage] scan of {self.storage.root} failed: {e}")
+            if self._stop.wait(self.refresh_seconds):
+                return
+
+
+def build_storage(local: LocalStorage, subdir: str) -> StorageBackend:
+    """``local`` alone, or tiered over ``<S3_PREFIX><subdir>`` with ``AUDIO_STORAGE=s3``."""
+    s = get_settings()
+    if s.audio_storage != 's3':
+        return local
+    return TieredStorage(local, S3Storage(
+        s.s3_bucket, prefix=s.s3_prefix + subdir, endpoint_url=s.s3_endpoint_url, region=s.s3_region,
+        max_concurrency=s.s3_upload_workers, presign_seconds=s.presign_seconds,
+    ))
+
+
+# uploaded / bundled track audio ({id}.wav|mp3) and the Deezer preview cache ({id}.mp3)
+audio_storage = build_storage(LocalStorage(AUDIO_DIR), 'tracks/')
+preview_storage = build_storage(LocalStorage(AUDIO_DIR / 'deezer'), 'deezer/')
+# which tracks have uploaded / bundled audio on this node
+audio_files = FileIndex(audio_storage.local, ('wav', 'mp3'), get_settings().audio_index_refresh_seconds)
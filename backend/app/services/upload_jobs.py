@@ -0,0 +1,108 @@
+"""Background processing of uploaded track audio.
+
+``upload_track`` only streams the upload to a temp file and creates the track
+row; a small worker pool then probes the real duration / bitrate, normalizes
+the audio into the preview format when ``ffmpeg`` is available (otherwise WAV
+and MP3 are stored as uploaded), moves it into ``audio_storage`` and fills in
+``Track.duration_ms`` / ``preview_url``.
+
+Job state is kept in process memory per track id (the most recent
+``MAX_JOBS`` jobs) and exposed through ``GET /tracks/{id}/upload-status``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from ..core.audio import ProbeError, ffmpeg_path, probe, transcode_preview
+from ..core.config import get_settings
+from ..core.db import SessionLocal
+from ..models.music import Track
+from .catalog import catalog_service
+from .storage import StorageBackend, audio_storage
+
+MAX_JOBS = 1000
+# stored without transcoding when ffmpeg is missing
+NATIVE_EXTS = ('.wav', '.mp3')
+
+
+class UploadJobs:
+    def __init__(self, storage: StorageBackend = audio_storage, workers: int = 2, transcode: bool = True):
+        self.storage = storage
+        self.workers = workers
+        self.transcode = transcode
+        self._jobs: dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def can_store(self, ext: str) -> bool:
+        return ext.lower() in NATIVE_EXTS or (self.transcode and ffmpeg_path() is not None)
+
+    def status(self, track_id: int) -> Optional[dict]:
+        job = self._jobs.get(track_id)
+        return dict(job) if job is not None else None
+
+    def submit(self, track_id: int, src: Path, ext: str):
+        """Queue processing of the uploaded temp file ``src`` (consumed)."""
+        job = {'track_id': track_id, 'status': 'queued', 'error': None, 'created_at': time.time(),
+               'finished_at': None, 'format': None, 'duration_ms': None, 'bitrate': None}
+        with self._lock:
+            self._jobs[track_id] = job
+            if len(self._jobs) > MAX_JOBS:
+                for tid in [t for t, j in self._jobs.items() if j['finished_at'] is not None][:len(self._jobs) - MAX_JOBS]:
+                    del self._jobs[tid]
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='upload-worker')
+        return self._executor.submit(self._run, job, src, ext.lower())
+
+    def process(self, track_id: int, src: Path, ext: str) -> tuple[str, dict]:
+        """Probe (and normalize) ``src``; returns (stored name, probe info)."""
+        info = probe(src)
+        if self.transcode and ffmpeg_path() is not None:
+            name = f'{track_id}.mp3'
+            self.storage.prepare(name)
+            out = self.storage.temp_path(name)
+            try:
+                transcode_preview(src, out)
+                info = {**probe(out), 'source_format': info['format']}
+            except BaseException:
+                out.unlink(missing_ok=True)
+                raise
+            src.unlink(missing_ok=True)
+            self.storage.put_file(name, out)
+            return name, info
+        if ext not in NATIVE_EXTS:
+            raise ProbeError(f'{ext} needs ffmpeg to be converted')
+        name = f'{track_id}{ext}'
+        self.storage.put_file(name, src)
+        return name, info
+
+    def _run(self, job: dict, src: Path, ext: str) -> None:
+        track_id = job['track_id']
+        job['status'] = 'running'
+        db = SessionLocal()
+        try:
+            _, info = self.process(track_id, src, ext)
+            track = db.get(Track, track_id)
+            if track is not None:
+                track.duration_ms = info['duration_ms']
+                track.preview_url = f'/tracks/{track_id}/preview'
+                db.commit()
+            job.update(status='done', format=info['format'], duration_ms=info['duration_ms'], bitrate=info['bitrate'])
+            # preview_url of an existing row changed
+            catalog_service.invalidate(full=True)
+        except Exception as e:
+            db.rollback()
+            job.update(status='failed', error=str(e))
+            print(f"[upload] track {track_id} failed: {e}")
+        finally:
+            db.close()
+            src.unlink(missing_ok=True)
+            job['finished_at'] = time.time()
+
+
+_settings = get_settings()
+upload_jobs = UploadJobs(workers=_settings.upload_workers, transcode=_settings.upload_transcode)
@@ -0,0 +1,51 @@
+import numpy as np
+
+from app.services.ann_index import IVFIndex, brute_force_search
+from app.services.model_store import FactorModel
+
+
+def _clustered(n=2000, dim=16, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    return (centers[rng.integers(0, clusters, n)] + 0.1 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def test_ivf_recall_against_brute_force():
+    items = _clustered()
+    index = IVFIndex.build(items, n_lists=32)
+    assert index.offsets[-1] == len(items)
+    recalls = []
+    for i in range(0, 2000, 100):
+        ex = np.array([i])
+        approx, _ = index.search(items, items[i], 10, nprobe=4, exclude=ex)
+        exact, _ = brute_force_search(items, index.norms, items[i], 10, exclude=ex)
+        assert i not in approx
+        recalls.append(len(np.intersect1d(approx, exact)) / 10)
+    assert np.mean(recalls) > 0.9
+
+
+def test_index_round_trip_and_similar_items(tmp_path):
+    items = _clustered(n=300)
+    IVFIndex.build(items, n_lists=8).save(tmp_path, 'v')
+    loaded = IVFIndex.load(tmp_path, 'v')
+    assert loaded is not None and loaded.n_lists == 8
+    model = FactorModel('v', np.ones((1, 16), dtype=np.float32), items, np.array([1]), np.arange(1, 301), ann=loaded)
+    approx = model.similar_items(5, 5, nprobe=8)
+    exact = model.similar_items(5, 5, exact=True)
+    assert [t for t, _ in approx] == [t for t, _ in exact]
+    assert model.similar_items(999, 5) is None
+
+
+def test_out_of_range_nprobe():
+    items = _clustered(n=300)
+    index = IVFIndex.build(items, n_lists=8)
+    for nprobe in (0, -3, 100):
+        ids, _ = index.search(items, items[0], 5, nprobe=nprobe)
+        assert len(ids) == 5
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    assert client.get('/recommend/similar/1?nprobe=0').status_code == 422
+    assert client.get('/recommend/similar/1?mode=exakt').status_code == 422
@@ -0,0 +1,64 @@
+import struct
+
+from app.core.audio import ProbeError, probe
+from app.core.media import sine_wav
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz, stereo: 417-byte frames
+MP3_HEADER = b'\xff\xfb\x90\x64'
+FRAME = 417
+
+
+def _id3(size=20):
+    return b'ID3\x03\x00\x00' + bytes([0, 0, 0, size]) + b'\x00' * size
+
+
+def test_probe_wav_and_cbr_mp3(tmp_path):
+    wav = tmp_path / 'a.wav'
+    wav.write_bytes(sine_wav(440.0, seconds=2))
+    assert probe(wav) == {'format': 'wav', 'duration_ms': 2000, 'bitrate': 705600, 'sample_rate': 44100}
+
+    mp3 = tmp_path / 'a.mp3'
+    mp3.write_bytes(_id3() + (MP3_HEADER + b'\x00' * (FRAME - 4)) * 300)
+    info = probe(mp3)
+    assert info['format'] == 'mp3' and info['bitrate'] == 128000 and info['sample_rate'] == 44100
+    assert info['duration_ms'] == round(300 * FRAME * 8 / 128)
+
+
+def test_probe_vbr_mp3_uses_xing_frame_count(tmp_path):
+    first = MP3_HEADER + b'\x00' * 32 + b'Xing' + struct.pack('>II', 1, 1000)
+    mp3 = tmp_path / 'v.mp3'
+    mp3.write_bytes(first.ljust(FRAME, b'\x00') + (MP3_HEADER + b'\x00' * (FRAME - 4)) * 20)
+    assert probe(mp3)['duration_ms'] == round(1000 * 1152 / 44100 * 1000)
+
+
+def test_probe_mp3_needs_two_consecutive_frames(tmp_path):
+    import pytest
+    from app.core.audio import probe_mp3
+
+    junk = tmp_path / 'junk.mp3'
+    junk.write_bytes(b'\x00' * 100 + MP3_HEADER + b'\x01' * 5000)  # a stray sync pair only
+    with pytest.raises(ProbeError):
+        probe_mp3(junk)
+    # garbage before the real stream is skipped
+    mp3 = tmp_path / 'b.mp3'
+    mp3.write_bytes(b'\xff\xfb\x90' + (MP3_HEADER + b'\x00' * (FRAME - 4)) * 10)
+    assert probe_mp3(mp3)['bitrate'] == 128000
+
+
+def test_upload_job_stores_probed_audio(tmp_path):
+    import pytest
+    from app.services.storage import LocalStorage
+    from app.services.upload_jobs import UploadJobs
+
+    jobs = UploadJobs(LocalStorage(tmp_path), transcode=False)
+    src = LocalStorage(tmp_path).staging_path('.wav')
+    src.write_bytes(sine_wav(440.0, seconds=1))
+    name, info = jobs.process(9, src, '.wav')
+    assert name == '9.wav' and info['duration_ms'] == 1000 and not src.exists()
+    assert jobs.storage.find(9, ('wav', 'mp3'))[1] == 'wav'
+
+    bad = LocalStorage(tmp_path).staging_path('.mp3')
+    bad.write_bytes(b'not audio' * 100)
+    with pytest.raises(ProbeError):
+        jobs.process(10, bad, '.mp3')
+    assert not jobs.can_store('.flac') and jobs.can_store('.MP3')
@@ -0,0 +1,45 @@
+import json
+import os
+import time
+
+from app.services.cache_manager import CacheManager
+from app.services.storage import LocalStorage
+
+
+def _fill(tmp_path, sizes):
+    now = time.time()
+    for i, size in enumerate(sizes, start=1):
+        p = LocalStorage(tmp_path).write_bytes(f'{i}.mp3', b'x' * size)
+        os.utime(p, (now - 1000 + i, now - 1000 + i))
+
+
+def test_lru_eviction_keeps_recent_files(tmp_path):
+    _fill(tmp_path, [100] * 10)
+    tmp = LocalStorage(tmp_path).path_for('3.mp3').with_name('3.abc.tmp')
+    tmp.write_bytes(b'partial')
+    m = CacheManager(LocalStorage(tmp_path), max_bytes=600, policy='lru')
+    m.load()
+    assert m.stats()['bytes'] == 1000 and m.stats()['files'] == 10
+    m.hit(1)  # oldest file, but just played
+    freed = m.evict()
+    left = sorted(int(p.stem) for p in tmp_path.rglob('*.mp3'))
+    assert freed == 500 and left == [1, 7, 8, 9, 10]
+    assert m.stats()['evictions'] == 5 and m.stats()['bytes'] == 500
+    # fresh temp files of running downloads are left alone
+    assert tmp.exists()
+
+
+def test_lfu_eviction_and_sidecar_roundtrip(tmp_path):
+    _fill(tmp_path, [100] * 4)
+    m = CacheManager(LocalStorage(tmp_path), max_bytes=10_000, policy='lfu')
+    m.load()
+    for tid, n in ((1, 5), (2, 1), (4, 3)):
+        for _ in range(n):
+            m.hit(tid)
+    m.save()
+    assert json.loads((tmp_path / '.index.json').read_text())['entries']['1'][2] == 5
+
+    again = CacheManager(LocalStorage(tmp_path), max_bytes=250, policy='lfu')
+    again.load()
+    again.evict()
+    assert sorted(int(p.stem) for p in tmp_path.rglob('*.mp3')) == [1, 4]
@@ -0,0 +1,87 @@
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.core.db import Base
+from app.models.music import Artist, Track
+from app.services.catalog import CatalogService
+from app.services.recommendation_service import RecommendationService
+
+
+def _session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add(Artist(id=1, name='a'))
+    db.add_all([Track(id=i, title=f't{i}', artist_id=1, duration_ms=1000, preview_url='p' if i % 2 else None)
+                for i in range(1, 11)])
+    db.commit()
+    return db
+
+
+def test_incremental_refresh_and_deletes():
+    db = _session()
+    svc = CatalogService()
+    snap = svc.refresh(db)
+    assert snap.ids.tolist() == list(range(1, 11))
+    assert snap.has_preview.tolist() == [True, False] * 5
+    db.add(Track(id=11, title='new', artist_id=1, duration_ms=1, is_explicit=True))
+    db.commit()
+    snap = svc.refresh(db)
+    assert snap.max_id == 11 and snap.is_explicit[-1]
+    db.query(Track).filter(Track.id.in_([3, 4])).delete()
+    db.commit()
+    snap = svc.refresh(db)
+    assert 3 not in snap.ids and len(snap) == 9
+    assert snap.contains(np.array([2, 3, 99])).tolist() == [True, False, False]
+    assert snap.id_at_offset(0) == 11 and snap.id_at_offset(1, descending=False) == 2
+
+
+def test_fallback_only_returns_live_ids():
+    db = _session()
+    db.query(Track).filter(Track.id.in_([2, 5, 7])).delete()
+    db.commit()
+    snap = CatalogService().refresh(db)
+    recs = RecommendationService._fallback(snap, user_id=1, limit=20, start_id=1, max_track_id=None)
+    assert sorted(t for t, _ in recs) == [1, 3, 4, 6, 8, 9, 10]
+    assert recs == RecommendationService._fallback(snap, 1, 20, 1, None)
+
+
+def test_watcher_refreshes_off_the_request_path(monkeypatch):
+    import time
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+
+    from app.services import catalog
+
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    make = sessionmaker(bind=engine)
+    with make() as db:
+        db.add(Artist(id=1, name='a'))
+        db.add_all([Track(id=i, title=f't{i}', artist_id=1, duration_ms=1) for i in range(1, 4)])
+        db.commit()
+    monkeypatch.setattr(catalog, 'SessionLocal', make)
+    svc = CatalogService(refresh_seconds=60)
+    svc.start_watcher()
+    try:
+        first = svc.get()
+        assert len(first) == 3
+        loads = []
+        monkeypatch.setattr(svc, 'load', lambda *a, **kw: loads.append(a) or CatalogService.load(*a, **kw))
+        with make() as db:
+            db.add(Track(id=4, title='t4', artist_id=1, duration_ms=1))
+            db.query(Track).filter(Track.id == 2).update({'preview_url': 'p'})
+            db.commit()
+        # requests keep the current snapshot; the watcher catches up when woken
+        assert svc.get() is first and loads == []
+        svc.invalidate(full=True)
+        deadline = time.monotonic() + 5
+        while svc.get() is first and time.monotonic() < deadline:
+            time.sleep(0.01)
+        snap = svc.get()
+        assert snap.max_id == 4 and snap.has_preview.tolist() == [False, True, False, False]
+    finally:
+        svc.stop_watcher()
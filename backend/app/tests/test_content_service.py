@@ -0,0 +1,78 @@
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.core.db import Base
+from app.models.music import Artist, Track, TrackFeatures, TrackLike, User
+from app.services.catalog import CatalogService
+from app.services.content_service import ContentService, build_feature_matrix
+from app.services.recommendation_service import RecommendationService
+
+
+def _rows():
+    # tracks 1-5 are "calm acoustic", 6-10 "loud dance"
+    rows = []
+    for i in range(1, 11):
+        calm = i <= 5
+        rows.append((i, 0.2 if calm else 0.9, 0.1 if calm else 0.9, 0.3, 80.0 if calm else 128.0,
+                     0.9 if calm else 0.05, None, 0.1, 0.05, -20.0 if calm else -5.0,
+                     'Folk' if calm else 'edm'))
+    return rows
+
+
+def test_feature_matrix_is_normalized_and_handles_missing_values():
+    m = build_feature_matrix(_rows())
+    assert m.item_factors.dtype == np.float32 and m.kind == 'content'
+    assert m.item_factors.shape == (10, 9 + 2)
+    assert np.allclose(np.linalg.norm(m.item_factors, axis=1), 1.0)
+    assert build_feature_matrix([]) is None
+
+
+def test_profile_ranks_similar_tracks_first():
+    m = build_feature_matrix(_rows())
+    profile = ContentService.profile(m, [1, 2])
+    got = [t for t, _ in m.top_k(profile, 3, exclude=m.item_indices([1, 2]))]
+    assert set(got) == {3, 4, 5}
+    assert ContentService.profile(m, [99]) is None
+
+
+def test_cold_start_user_gets_content_recommendations():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add_all([Artist(id=1, name='a'), User(id=1, email='u@x', password_hash='h')])
+    db.add_all([Track(id=r[0], title=f't{r[0]}', artist_id=1, duration_ms=1) for r in _rows()])
+    db.add_all([TrackFeatures(track_id=r[0], danceability=r[1], energy=r[2], valence=r[3], tempo=r[4],
+                              acousticness=r[5], instrumentalness=r[6], liveness=r[7], speechiness=r[8],
+                              loudness=r[9], genre=r[10]) for r in _rows()])
+    db.add(TrackLike(user_id=1, track_id=7))
+    db.commit()
+    content = ContentService()
+    content.reload(db)
+    catalog = CatalogService()
+    catalog.refresh(db)
+
+    class NoModel:
+        def get(self):
+            return None
+
+    svc = RecommendationService(store=NoModel(), catalog=catalog, content=content)
+    recs = svc.recommend_for_user(db, 1, limit=4)
+    assert [t for t, _ in recs if t > 5] == [t for t, _ in recs] and 7 not in [t for t, _ in recs]
+
+
+def test_get_serves_the_loaded_matrix_without_reloading(monkeypatch):
+    content = ContentService(refresh_seconds=0.001)
+    loads = []
+
+    def load(db):
+        loads.append(db)
+        content._attempted = True
+        content._model = build_feature_matrix(_rows())
+        return content._model
+
+    monkeypatch.setattr(content, '_load', load)
+    first = content.get()
+    assert first is not None and content.get() is first and len(loads) == 1
+    content.reload()
+    assert len(loads) == 2 and content.get() is not first
@@ -0,0 +1,130 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app.core.ratelimit import CircuitBreaker
+from app.services.deezer_service import DeezerClient, DeezerUnavailable
+
+
+class FakeDeezer(BaseHTTPRequestHandler):
+    """Minimal api.deezer.com: /search echoes the query, /track/<id> knows ids < 100."""
+    calls: list = []
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.calls.append(url.path)
+        if url.path == '/search':
+            q = parse_qs(url.query)['q'][0]
+            body = {'data': [{'id': 1, 'title': q}], 'total': 1}
+        elif url.path.startswith('/track/'):
+            tid = int(url.path.rsplit('/', 1)[1])
+            if tid == 500:
+                self.send_response(503)
+                self.end_headers()
+                return
+            if tid >= 100:
+                body = {'error': {'type': 'DataException', 'message': 'no data', 'code': 800}}
+            else:
+                body = {'id': tid, 'preview': f'https://cdn.example/{tid}.mp3?hdnea=exp=4102444800~hmac=x'}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        raw = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server():
+    FakeDeezer.calls = []
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), FakeDeezer)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{srv.server_port}'
+    srv.shutdown()
+
+
+@pytest.fixture()
+def client(server):
+    c = DeezerClient(base_url=server, cache_size=100)
+    yield c
+    c.close()
+
+
+def test_search_cached_per_normalized_query_and_limit(client):
+    first = client.search_tracks('Daft  Punk', limit=5)
+    assert client.search_tracks('daft punk ', limit=5) == first
+    client.search_tracks('daft punk', limit=10)
+    assert FakeDeezer.calls == ['/search', '/search']
+    stats = client.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['upstream_calls'] == 2
+
+
+def test_track_negative_cache_and_fresh_bypass(client):
+    assert client.get_track(100) is None
+    assert client.get_track(100) is None
+    assert client.get_track(7)['id'] == 7
+    assert client.get_track(7)['id'] == 7
+    assert FakeDeezer.calls == ['/track/100', '/track/7']
+    # fresh=True always asks upstream (e.g. after the CDN rejected the signed URL)
+    client.get_track(7, fresh=True)
+    assert FakeDeezer.calls[-1] == '/track/7' and len(FakeDeezer.calls) == 3
+    assert client.stats()['negative_hits'] == 1
+
+
+def test_track_ttl_capped_by_preview_expiry(client):
+    data = {'id': 1, 'preview': 'https://cdn.example/1.mp3?hdnea=exp=1~hmac=x'}
+    # already-expired signed URL: not cached at all
+    assert client._capped(data, 3600) <= 0
+    assert client._capped({'id': 1, 'preview': 'https://cdn.example/1.mp3'}, 3600) == 3600
+
+
+def test_rate_budget_and_circuit_fail_fast(server):
+    c = DeezerClient(base_url=server, cache_size=0, rates={'track': 1}, max_wait=0.0,
+                     breaker=CircuitBreaker(failure_threshold=2, reset_seconds=60))
+    c.get_track(1)
+    with pytest.raises(DeezerUnavailable):
+        c.get_track(2)  # over the /track budget; /search has its own
+    c.buckets['track'].rate = 0
+    for _ in range(2):
+        with pytest.raises(Exception):
+            c.get_track(500)
+    with pytest.raises(DeezerUnavailable) as exc:
+        c.search_tracks('x')
+    assert exc.value.retry_after > 0 and c.buckets['search'].granted == 0  # turned away before spending budget
+    assert FakeDeezer.calls == ['/track/1', '/track/500', '/track/500']
+    stats = c.stats()
+    assert stats['circuit']['state'] == 'open' and stats['rate_limited'] == 1 and stats['short_circuited'] == 1
+    c.close()
+
+
+def test_local_fallback_treats_like_wildcards_literally(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+
+    from app.core.db import Base
+    from app.models.music import Artist, Track
+    from app.routers import deezer
+
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    make = sessionmaker(bind=engine)
+    with make() as db:
+        db.add(Artist(id=1, name='a'))
+        db.add_all([Track(id=i, title=title, artist_id=1, duration_ms=1000)
+                    for i, title in enumerate(['100% Pure', '1000 Pure', 'my_song', 'my song'], 1)])
+        db.commit()
+    monkeypatch.setattr(deezer, 'SessionLocal', make)
+    assert [t['id'] for t in deezer._local_tracks('100%')] == [1]
+    assert [t['id'] for t in deezer._local_tracks('my_')] == [3]
+    assert [t['id'] for t in deezer._local_tracks(track_id=4)] == [4]
@@ -0,0 +1,44 @@
+import numpy as np
+
+from app.ml.training.evaluate import benchmark, ranking_metrics, time_split
+
+
+def test_time_split_holds_out_only_new_tracks_of_known_users():
+    users = np.array([1, 1, 1, 2, 3, 3])
+    items = np.array([10, 11, 10, 12, 13, 14])
+    ts = np.array([1.0, 2.0, 9.0, 9.5, 3.0, 10.0])
+    train, cutoff, eval_users, truth = time_split(users, items, ts, test_fraction=0.5)
+    assert train.tolist() == [True, True, False, False, True, False]
+    # user 1 only re-listened to 10, user 2 has no training history
+    assert eval_users.tolist() == [3] and truth[3].tolist() == [14]
+
+
+def test_ranking_metrics():
+    recs = np.array([[5, 6, 7], [8, -1, -1]])
+    truth = {1: np.array([6]), 2: np.array([9, 10])}
+    m = ranking_metrics(recs, np.array([1, 2]), truth, 3, n_catalog=10)
+    assert m['recall@3'] == 0.5
+    assert np.isclose(m['ndcg@3'], (1 / np.log2(3)) / 2, atol=1e-5)
+    assert m['coverage@3'] == 0.4
+
+
+def test_benchmark_reports_latency_per_size():
+    res = benchmark(np.random.default_rng(0).random((50, 4), dtype=np.float32), [20, 500], k=5, queries=10, batch=8)
+    assert [r['items'] for r in res] == [20, 500] and [r['synthetic'] for r in res] == [False, True]
+    assert all(r['p99_ms'] >= r['p50_ms'] for r in res)
+
+
+def test_naive_db_timestamps_are_read_as_utc(monkeypatch):
+    import time
+    from datetime import datetime, timezone
+
+    from app.ml.training.evaluate import _utc_seconds
+
+    monkeypatch.setenv('TZ', 'Asia/Ho_Chi_Minh')
+    time.tzset()
+    try:
+        assert _utc_seconds(datetime(2024, 1, 1)) == datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+        assert _utc_seconds(None) == 0.0
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
@@ -0,0 +1,66 @@
+import threading
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.core.db import Base
+from app.models.music import Artist, Interaction, Track, TrackLike, User, UserFeatures
+from app.services.foldin import FoldInService, decode_vector, solve_user_vector
+from app.services.model_store import FactorModel
+
+
+class _Store:
+    def __init__(self, model):
+        self.model = model
+
+    def get(self):
+        return self.model
+
+
+def _model():
+    # two taste groups: items 1-10 along axis 0, items 11-20 along axis 1
+    items = np.zeros((20, 4), dtype=np.float32)
+    items[:10, 0] = 1.0
+    items[10:, 1] = 1.0
+    items += 0.01 * np.random.default_rng(0).standard_normal(items.shape).astype(np.float32)
+    return FactorModel('v1', np.ones((1, 4), dtype=np.float32), items, np.array([1]), np.arange(1, 21))
+
+
+def test_solve_matches_normal_equations():
+    m = _model()
+    yty = m.item_factors.T.astype(np.float64) @ m.item_factors
+    idx = np.array([0, 3, 12])
+    conf = np.array([5.0, 2.0, 1.5])
+    x = solve_user_vector(m.item_factors, yty, idx, conf, 0.1)
+    y_u = m.item_factors[idx].astype(np.float64)
+    lhs = (yty + y_u.T @ np.diag(conf - 1) @ y_u + 0.1 * np.eye(4)) @ x
+    assert np.allclose(lhs, y_u.T @ conf, atol=1e-4)
+
+
+def test_fold_in_persists_binary_vector_for_new_user():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add_all([Artist(id=1, name='a'), User(id=1, email='a@x', password_hash='h'), User(id=2, email='b@x', password_hash='h')])
+    db.add_all([Track(id=i, title=f't{i}', artist_id=1, duration_ms=1) for i in range(1, 21)])
+    db.add_all([Interaction(user_id=2, track_id=12, seconds_listened=30, is_completed=True), TrackLike(user_id=2, track_id=15)])
+    db.commit()
+    model = _model()
+    svc = FoldInService(store=_Store(model))
+    vec = svc.fold_in(db, 2)
+    row = db.get(UserFeatures, 2)
+    assert row.model_version == 'v1' and np.allclose(decode_vector(row.latent_blob), vec)
+    assert vec[1] > vec[0]
+    assert list(svc.vectors_for(db, model, [1, 2])) == [2]
+    top = [t for t, _ in model.top_k(vec, 5, exclude=model.item_indices([12, 15]))]
+    assert all(t > 10 for t in top)
+
+
+def test_enqueue_coalesces_repeated_events():
+    svc = FoldInService(store=_Store(_model()))
+    # pretend the worker is running so the queue is not drained
+    svc._worker = threading.current_thread()
+    for uid in (2, 2, 3, 2):
+        svc.enqueue(uid)
+    assert svc._queue.qsize() == 2 and svc._pending == {2, 3}
@@ -0,0 +1,82 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.core.media import parse_range, serve_bytes, serve_file
+
+DATA = bytes(range(256)) * 4000
+
+
+def _client(path):
+    app = FastAPI()
+
+    @app.api_route('/file', methods=['GET', 'HEAD'])
+    def file(request: Request):
+        return serve_file(request, path, 'audio/mpeg')
+
+    @app.get('/bytes')
+    def mem(request: Request):
+        return serve_bytes(request, DATA, 'audio/wav')
+
+    return TestClient(app)
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-99', 1000) == (0, 99)
+    assert parse_range('bytes=900-', 1000) == (900, 999)
+    assert parse_range('bytes=-100', 1000) == (900, 999)
+    assert parse_range('bytes=500-5000', 1000) == (500, 999)
+    assert parse_range('bytes=0-1,5-6', 1000) is None
+    assert parse_range('items=0-1', 1000) is None
+
+
+def test_file_ranges_and_conditionals(tmp_path):
+    path = tmp_path / 'a.mp3'
+    path.write_bytes(DATA)
+    c = _client(path)
+    full = c.get('/file')
+    assert full.status_code == 200 and full.content == DATA
+    assert full.headers['accept-ranges'] == 'bytes' and full.headers['content-length'] == str(len(DATA))
+    etag = full.headers['etag']
+
+    part = c.get('/file', headers={'Range': 'bytes=1000-300000'})
+    assert part.status_code == 206 and part.content == DATA[1000:300001]
+    assert part.headers['content-range'] == f'bytes 1000-300000/{len(DATA)}'
+
+    assert c.get('/file', headers={'If-None-Match': etag}).status_code == 304
+    assert c.get('/file', headers={'If-Modified-Since': full.headers['last-modified']}).status_code == 304
+    assert c.get('/file', headers={'Range': f'bytes={len(DATA)}-'}).status_code == 416
+    # stale If-Range -> whole file
+    stale = c.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert stale.status_code == 200 and len(stale.content) == len(DATA)
+    head = c.head('/file', headers={'Range': 'bytes=0-9'})
+    assert head.status_code == 206 and head.headers['content-length'] == '10' and head.content == b''
+
+
+def test_bytes_ranges():
+    c = _client(None)
+    r = c.get('/bytes', headers={'Range': 'bytes=-10'})
+    assert r.status_code == 206 and r.content == DATA[-10:]
+    assert c.get('/bytes', headers={'If-None-Match': r.headers['etag']}).status_code == 304
+
+
+def _loop_wav(freq, seconds, sample_rate=44100, amplitude=16000):
+    import math
+    import struct
+    n_samples = int(sample_rate * seconds)
+    pcm = b''.join(struct.pack('<h', int(amplitude * math.sin(2 * math.pi * freq * (n / sample_rate))))
+                   for n in range(n_samples))
+    return (struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + len(pcm), b'WAVE', b'fmt ', 16, 1, 1,
+                        sample_rate, sample_rate * 2, 2, 16, b'data', len(pcm)) + pcm)
+
+
+def test_sine_wav_matches_per_sample_loop_and_tones_are_cached():
+    import io
+    import wave
+    from app.core.media import sine_wav
+    from app.routers.tracks import _preview_tone
+
+    assert sine_wav(550.0, seconds=0.2) == _loop_wav(550.0, 0.2)
+    data, etag = _preview_tone(7 % 5)
+    assert _preview_tone(2)[0] is data and _preview_tone(3)[1] != etag
+    with wave.open(io.BytesIO(data)) as w:
+        assert (w.getframerate(), w.getnchannels(), w.getsampwidth(), w.getnframes()) == (44100, 1, 2, 220500)
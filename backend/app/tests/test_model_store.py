@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+
+from app.services.model_store import FactorModel, ModelStore, load_factor_model, select_top_k
+
+
+def _model():
+    rng = np.random.default_rng(0)
+    users = rng.random((3, 4), dtype=np.float32)
+    items = rng.random((50, 4), dtype=np.float32)
+    return FactorModel('v1', users, items, np.array([2, 5, 9]), np.arange(10, 60))
+
+
+def test_top_k_matches_full_sort():
+    m = _model()
+    vec = m.user_vector(5)
+    got = m.top_k(vec, 7)
+    scores = m.item_factors @ vec
+    expected = list(m.item_ids[np.argsort(-scores)[:7]])
+    assert [tid for tid, _ in got] == expected
+
+
+def test_top_k_excludes_seen_and_respects_id_range():
+    m = _model()
+    vec = m.user_vector(2)
+    best = m.top_k(vec, 1)[0][0]
+    got = m.top_k(vec, 5, exclude=m.item_indices([best, 9999]))
+    assert best not in [tid for tid, _ in got]
+    ranged = m.top_k(vec, 50, start_id=20, max_id=29)
+    assert sorted(tid for tid, _ in ranged) == list(range(20, 30))
+    assert m.user_vector(3) is None
+
+
+def test_select_top_k_drops_non_finite():
+    scores = np.array([0.5, -np.inf, 0.9, 0.1], dtype=np.float32)
+    assert list(select_top_k(scores, 10)) == [2, 0, 3]
+
+
+def test_load_legacy_artifacts_without_id_maps(tmp_path):
+    np.save(tmp_path / 'user_factors_20240101.npy', np.ones((4, 2), dtype=np.float32))
+    np.save(tmp_path / 'item_factors_20240101.npy', np.ones((6, 2), dtype=np.float32))
+    (tmp_path / 'latest.txt').write_text('20240101')
+    m = load_factor_model(tmp_path)
+    assert m is not None and m.version == '20240101'
+    assert list(m.item_ids) == [1, 2, 3, 4, 5, 6]
+    assert m.user_index(4) == 3
+
+
+def _write_version(path, version, n_items):
+    np.save(path / f'user_factors_{version}.npy', np.ones((2, 3), dtype=np.float32))
+    np.save(path / f'item_factors_{version}.npy', np.ones((n_items, 3), dtype=np.float32))
+    (path / 'latest.txt').write_text(version)
+
+
+def test_store_maps_read_only_and_hot_swaps(tmp_path):
+    _write_version(tmp_path, 'a', 4)
+    store = ModelStore(tmp_path)
+    first = store.get()
+    assert first.version == 'a' and isinstance(first.item_factors, np.memmap)
+    assert store.refresh() is False
+    _write_version(tmp_path, 'b', 6)
+    assert store.refresh() is True
+    assert store.get().n_items == 6 and store.status()['version'] == 'b'
+    # a request holding the old snapshot keeps working after the swap
+    assert first.n_items == 4 and len(first.top_k(first.user_vector(1), 2)) == 2
+
+
+def test_score_users_matches_single_user_top_k():
+    m = _model()
+    rows = np.array([0, 2])
+    excludes = [m.item_indices([10, 11]), np.empty(0, dtype=np.int64)]
+    ids, scores = m.score_users(rows, 5, excludes, max_cells=60)
+    for j, r in enumerate(rows):
+        single = m.top_k(m.user_factors[r], 5, exclude=excludes[j])
+        assert ids[j].tolist() == [tid for tid, _ in single]
+
+
+def test_precomputed_lists_skip_newly_seen_tracks():
+    m = _model()
+    ids, scores = m.score_users(np.array([0, 1, 2]), 10)
+    ids[2] = -1  # user 9 was not active when lists were built
+    m2 = m.with_topn(ids.astype(np.int32), scores)
+    got = m2.precomputed(0, 3, seen=[int(ids[0][0])])
+    assert [tid for tid, _ in got] == ids[0][1:4].tolist()
+    assert m2.precomputed(2, 3) is None
+    assert m2.precomputed(1, 20) is None
+    assert m.topn_items is None
+
+
+def test_store_reloads_rerun_topn_for_active_version(tmp_path):
+    _write_version(tmp_path, 'a', 4)
+    store = ModelStore(tmp_path)
+    assert store.get().topn_items is None
+    np.save(tmp_path / 'topn_items_a.npy', np.array([[1, 2], [3, -1]], dtype=np.int32))
+    np.save(tmp_path / 'topn_scores_a.npy', np.ones((2, 2), dtype=np.float32))
+    assert store.refresh() is True and store.get().topn_items[0].tolist() == [1, 2]
+    assert store.refresh() is False
+    # precompute re-run for the same version
+    np.save(tmp_path / 'topn_items_a.npy', np.array([[4, 3], [2, 1]], dtype=np.int32))
+    scores = tmp_path / 'topn_scores_a.npy'
+    np.save(scores, np.ones((2, 2), dtype=np.float32))
+    os.utime(scores, ns=(scores.stat().st_atime_ns, scores.stat().st_mtime_ns + 10 ** 9))
+    assert store.refresh() is True and store.get().topn_items[0].tolist() == [4, 3]
@@ -0,0 +1,168 @@
+import anyio
+import httpx
+
+from app.services.preview_cache import PreviewCache, UpstreamError
+from app.services.storage import LocalStorage
+
+AUDIO = bytes(range(256)) * 1000
+
+
+def _cache(tmp_path, handler):
+    cache = PreviewCache(LocalStorage(tmp_path))
+    cache._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return cache
+
+
+def test_concurrent_misses_share_one_download(tmp_path):
+    calls = []
+
+    def handler(req):
+        calls.append(req.url)
+        return httpx.Response(200, content=AUDIO, headers={'content-type': 'audio/mpeg'})
+
+    cache = _cache(tmp_path, handler)
+
+    async def play(results):
+        dl = await cache.fetch(7, lambda: cache.open('https://cdn.example/1.mp3'))
+        results.append(b''.join([chunk async for chunk in dl.iter_bytes()]))
+
+    async def main():
+        results = []
+        async with anyio.create_task_group() as tg:
+            for _ in range(20):
+                tg.start_soon(play, results)
+        return results
+
+    results = anyio.run(main)
+    assert len(calls) == 1 and results == [AUDIO] * 20
+    assert cache.path_for(7).read_bytes() == AUDIO
+    assert list(tmp_path.rglob('*.tmp')) == [] and cache._inflight == {}
+
+
+def test_failed_download_leaves_no_file(tmp_path):
+    def handler(req):
+        raise httpx.ReadError('connection reset')
+
+    cache = _cache(tmp_path, handler)
+
+    async def main():
+        try:
+            await cache.fetch(8, lambda: cache.open('https://cdn.example/1.mp3'))
+        except httpx.ReadError:
+            return 'raised'
+
+    assert anyio.run(main) == 'raised'
+    assert not cache.path_for(8).exists() and list(tmp_path.rglob('*.*')) == [] and cache._inflight == {}
+
+
+def test_open_retries_with_referer_then_raises(tmp_path):
+    seen = []
+
+    def handler(req):
+        seen.append(req.headers.get('referer'))
+        return httpx.Response(403, content=b'expired')
+
+    cache = _cache(tmp_path, handler)
+
+    async def main():
+        try:
+            await cache.open('https://cdn.example/1.mp3')
+        except UpstreamError as e:
+            return e
+
+    err = anyio.run(main)
+    assert err.status_code == 403 and err.body == 'expired'
+    assert seen == [None, 'https://www.deezer.com/']
+
+
+def test_preview_url_expiry_and_freshness():
+    import time
+    from app.core.upstream import preview_url_expiry
+    from app.services.preview_cache import PreviewUrls
+
+    url = 'https://cdns-preview-d.dzcdn.net/stream/c-abc-3.mp3?hdnea=exp=1700000000~acl=/api/1/*~data=user_id=0~hmac=ff'
+    assert preview_url_expiry(url) == 1700000000
+    assert preview_url_expiry('https://cdn.example/a.mp3?exp=42') == 42
+    assert preview_url_expiry('https://cdn.example/a.mp3') is None
+    urls = PreviewUrls(ttl_seconds=100)
+    urls.put(1, url)  # long expired
+    assert urls.get(1) is None
+    fresh = url.replace('1700000000', str(int(time.time()) + 3600))
+    urls.put(2, fresh)
+    urls.put(3, 'https://cdn.example/a.mp3')
+    assert urls.get(2) == fresh and urls.get(3) == 'https://cdn.example/a.mp3'
+    assert not urls.is_fresh(4, url.replace('1700000000', str(int(time.time()) + 30)))
+
+    # a stored URL without expiry is trusted for the TTL from when it was first seen
+    stale = PreviewUrls(ttl_seconds=0.05)
+    assert stale.is_fresh(5, 'https://cdn.example/b.mp3')
+    time.sleep(0.06)
+    assert not stale.is_fresh(5, 'https://cdn.example/b.mp3') and stale.get(5) is None
+    stale.put(5, 'https://cdn.example/b.mp3')
+    assert stale.is_fresh(5, 'https://cdn.example/b.mp3')
+
+    small = PreviewUrls(maxsize=2)
+    for tid in (1, 2, 3):
+        small.put(tid, f'https://cdn.example/{tid}.mp3')
+    small.get(2)
+    small.put(4, 'https://cdn.example/4.mp3')
+    assert len(small) == 2 and small.get(2) and small.get(4) and small.get(3) is None
+
+
+def test_cached_play_skips_metadata_lookup(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import deezer
+
+    def boom(*args, **kwargs):
+        raise AssertionError('network / DB touched on a cache hit')
+
+    storage = LocalStorage(tmp_path)
+    monkeypatch.setattr(deezer.preview_cache, 'storage', storage)
+    monkeypatch.setattr(deezer, '_resolve_preview_url', boom)
+    monkeypatch.setattr(deezer, 'get_track', boom)
+    storage.write_bytes('42.mp3', AUDIO)
+    r = TestClient(app).get('/deezer/stream/42', headers={'Range': 'bytes=0-99'})
+    assert r.status_code == 206 and r.content == AUDIO[:100]
+
+
+def test_refresh_serves_cached_audio_when_the_preview_is_gone(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import deezer
+
+    storage = LocalStorage(tmp_path)
+    monkeypatch.setattr(deezer.preview_cache, 'storage', storage)
+    monkeypatch.setattr(deezer, '_resolve_preview_url', lambda *args: None)
+    storage.write_bytes('42.mp3', AUDIO)
+    r = TestClient(app).get('/deezer/stream/42', params={'refresh': 'true'})
+    assert r.status_code == 200 and r.content == AUDIO
+
+
+def test_evicted_after_concurrent_download_streams_upstream(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import deezer
+
+    storage = LocalStorage(tmp_path)
+    cache = deezer.preview_cache
+    monkeypatch.setattr(cache, 'storage', storage)
+    monkeypatch.setattr(deezer.preview_urls, 'get', lambda track_id: 'https://cdn.example/43.mp3')
+
+    async def already_cached(track_id, open_upstream):
+        return None  # as if a concurrent request finished it and it was evicted right after
+
+    class Upstream:
+        headers = {'content-type': 'audio/mpeg'}
+
+    async def passthrough(resp):
+        yield AUDIO
+
+    async def open_(url):
+        return Upstream()
+
+    monkeypatch.setattr(cache, 'fetch', already_cached)
+    monkeypatch.setattr(cache, 'open', open_)
+    monkeypatch.setattr(cache, 'passthrough', passthrough)
+    r = TestClient(app).get('/deezer/stream/43')
+    assert r.status_code == 200 and r.content == AUDIO
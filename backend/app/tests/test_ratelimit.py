@@ -0,0 +1,78 @@
+import anyio
+
+from app.core.ratelimit import CircuitBreaker, TokenBucket
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_bursts_then_paces():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=100, capacity=5, clock=clock)
+    assert all(bucket.try_acquire() for _ in range(5))
+    assert not bucket.try_acquire()
+    # reservations queue up behind each other at 1/rate spacing
+    delays = [bucket.reserve() for _ in range(3)]
+    assert [round(d, 6) for d in delays] == [0.01, 0.02, 0.03]
+    stats = bucket.stats()
+    assert stats['granted'] == 8 and stats['rejected'] == 1 and stats['throttled'] == 3
+    clock.now += 0.05  # the debt is paid off, then refills up to capacity only
+    assert bucket.reserve() == 0.0 and bucket.stats()['tokens'] == 1.0
+    clock.now += 10
+    assert bucket.stats()['tokens'] == 5
+
+
+def test_async_acquire_respects_rate():
+    bucket = TokenBucket(rate=200, capacity=1, clock=FakeClock())
+    delays = []
+    reserve = bucket.reserve
+
+    def recording_reserve(tokens=1.0):
+        delays.append(reserve(tokens))
+        return delays[-1]
+
+    bucket.reserve = recording_reserve
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            for _ in range(21):
+                tg.start_soon(bucket.acquire_async)
+
+    anyio.run(main)
+    assert [round(d, 6) for d in sorted(delays)] == [i / 200 for i in range(21)]
+    assert TokenBucket(rate=0).reserve() == 0.0
+
+
+def test_acquire_timeout_takes_nothing():
+    bucket = TokenBucket(rate=10, capacity=1, clock=FakeClock())
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.01)  # next token is 0.1 s away
+    assert bucket.acquire(timeout=0.2)
+    assert bucket.stats()['rejected'] == 1
+
+
+def test_circuit_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow() and breaker.retry_in() == 30
+    clock.now += 30
+    # one trial call at a time; its failure re-opens immediately
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.retry_in() == 30
+    clock.now += 30
+    # a trial that is given back can be taken by the next caller
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.failures == 0
+    assert breaker.stats()['opened'] == 2
@@ -14,3 +14,8 @@ def test_recommend_basic():
     if data:
         first = data[0]
         assert "track_id" in first and "score" in first
+
+
+def test_recommend_limit_is_bounded():
+    assert client.get("/recommend/user/1?limit=5000").status_code == 422
+    assert client.get("/recommend/user/1?limit=0").status_code == 422
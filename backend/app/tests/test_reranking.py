@@ -0,0 +1,83 @@
+
+import numpy as np
+
+from app.services.reranking import ArtistCap, Candidates, ExplicitFilter, MMRSelect, RecentPlayDemotion, Reranker
+
+
+def _pool(n=1000, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n + 1)
+    scores = np.sort(rng.random(n).astype(np.float32))[::-1]
+    return Candidates(ids, scores, vectors=rng.standard_normal((n, dim)).astype(np.float32),
+                      artist_ids=ids % 50, explicit=ids % 7 == 0)
+
+
+def test_filters_caps_and_demotion():
+    cand = _pool()
+    played = np.array([1, 2])
+    out = Reranker([ExplicitFilter(), RecentPlayDemotion(played, np.array([0.0, 1000.0])), ArtistCap(1)]).run(cand, 100)
+    ids = [t for t, _ in out]
+    assert all(t % 7 for t in ids)
+    assert len({t % 50 for t in ids}) == len(ids) == 50
+    # played an hour ago -> demoted out of the top; played weeks ago -> barely affected
+    assert 1 not in ids[:10] and ids[0] == 2
+    assert set(cand.timings) == {'explicit', 'recent', 'artist_cap'}
+
+
+def test_mmr_spreads_near_duplicates():
+    vecs = np.array([[1, 0], [1, 0.01], [0, 1]], dtype=np.float32)
+    cand = Candidates(np.array([10, 11, 12]), np.array([1.0, 0.99, 0.5]), vectors=vecs)
+    assert [t for t, _ in Reranker([MMRSelect(0.5)]).run(cand, 2)] == [10, 12]
+    plain = Candidates(np.array([10, 11, 12]), np.array([1.0, 0.99, 0.5]), vectors=vecs)
+    assert [t for t, _ in Reranker([MMRSelect(1.0)]).run(plain, 2)] == [10, 11]
+
+
+def test_full_pipeline_on_1000_candidates():
+    cand = _pool()
+    stages = [ExplicitFilter(), RecentPlayDemotion(np.arange(1, 200), np.arange(199.0)), ArtistCap(2), MMRSelect(0.7)]
+    out = Reranker(stages).run(cand, 20)
+    ids = [t for t, _ in out]
+    assert len(ids) == len(set(ids)) == 20
+    assert all(t % 7 for t in ids)
+    assert max(np.bincount(np.array(ids) % 50)) <= 2
+    # tracks played in the last hours are pushed below unplayed ones
+    assert not set(ids) & set(range(1, 10))
+    assert set(cand.timings) == {'explicit', 'recent', 'artist_cap', 'mmr'}
+
+
+def test_single_user_excludes_old_and_recent_plays():
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from app.core.db import Base
+    from app.models.music import Artist, Interaction, Track, User
+    from app.services.catalog import CatalogService
+    from app.services.foldin import FoldInService
+    from app.services.model_store import FactorModel
+    from app.services.recommendation_service import RecommendationService
+
+    class Store:
+        def get(self):
+            return model
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add(User(id=1, email='u@x', password_hash='h'))
+    db.add_all([Artist(id=i, name=f'a{i}') for i in range(1, 11)])
+    db.add_all([Track(id=i, title=f't{i}', artist_id=i, duration_ms=1) for i in range(1, 11)])
+    now = datetime.utcnow()
+    db.add_all([Interaction(user_id=1, track_id=1, seconds_listened=30, played_at=now - timedelta(days=60)),
+                Interaction(user_id=1, track_id=2, seconds_listened=30, played_at=now - timedelta(hours=1))])
+    db.commit()
+    # item scores decrease with id, so the played tracks 1 and 2 would rank first
+    items = np.linspace(1.0, 0.1, 10, dtype=np.float32)[:, None]
+    model = FactorModel('v1', np.ones((1, 1), dtype=np.float32), items, np.array([1]), np.arange(1, 11))
+    catalog = CatalogService()
+    catalog.refresh(db)
+    svc = RecommendationService(store=Store(), catalog=catalog, foldin=FoldInService(store=Store()))
+    ids = [t for t, _ in svc.recommend_for_user(db, 1, limit=5)]
+    assert len(ids) == 5 and not {1, 2} & set(ids)
+    assert not {1, 2} & {t for t, _ in svc.recommend_batch(db, [1], limit=5)[1]}
@@ -0,0 +1,114 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.core.db import Base
+from app.models.music import Album, Artist, Track
+from app.services import search_index
+from app.services.search_index import SearchIndex, SearchService, Segment, tokenize
+
+ROWS = [
+    (1, 'Chúng Ta Của Hiện Tại', 'Sơn Tùng M-TP', None),
+    (2, 'Lạc Trôi', 'Sơn Tùng M-TP', 'm-tp M-TP'),
+    (3, 'Love Story', 'Taylor Swift', 'Fearless'),
+    (4, 'Lover', 'Taylor Swift', 'Lover'),
+    (5, 'Story of My Life', 'One Direction', 'Midnight Memories'),
+]
+
+
+def _ids(index, query, **kw):
+    return [tid for tid, _ in index.search(query, **kw)]
+
+
+def test_tokenize_folds_case_and_accents():
+    assert tokenize('Đen Vâu – Lối Nhỏ (feat. Phương Anh Đào)') == ['den', 'vau', 'loi', 'nho', 'feat', 'phuong', 'anh', 'dao']
+    assert tokenize(None) == [] and tokenize('Straße') == ['strasse']
+
+
+def test_prefix_fuzzy_and_ranking():
+    index = SearchIndex([Segment.build(ROWS)])
+    # every word must match; the last one is a prefix
+    assert _ids(index, 'son tung chu') == [1]
+    assert _ids(index, 'lov') == [3, 4]  # shorter completion ('love') ranks first
+    assert _ids(index, 'lover ') == [4]  # trailing space: whole words only
+    assert set(_ids(index, 'story')) == {3, 5}
+    assert _ids(index, 'taylor story') == [3]
+    # typo: no exact / prefix term, trigram neighbours instead
+    assert _ids(index, 'tailor swift lover') == [4]
+    assert _ids(index, 'xyzzy') == [] and _ids(index, '  ') == []
+
+
+def test_merge_and_persistence_match_single_build(tmp_path):
+    whole = SearchIndex([Segment.build(ROWS)])
+    merged = Segment.merge([Segment.build(ROWS[:2]), Segment.build(ROWS[2:])])
+    merged.save(tmp_path / 'seg.npz')
+    loaded = SearchIndex([Segment.load(tmp_path / 'seg.npz')])
+    for q in ('son', 'taylor lov', 'stor', 'direktion'):
+        assert whole.search(q) == loaded.search(q) == SearchIndex([Segment.build(ROWS[:2]), Segment.build(ROWS[2:])]).search(q)
+    assert loaded.max_id == 5
+
+
+def test_service_catches_up_and_restarts_from_disk(tmp_path, monkeypatch):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add_all([Artist(id=1, name='Taylor Swift'), Album(id=1, title='Fearless', artist_id=1)])
+    db.add(Track(id=1, title='Love Story', artist_id=1, album_id=1, duration_ms=1))
+    db.commit()
+    svc = SearchService(str(tmp_path))
+    assert _ids(svc.refresh(db), 'fearless') == [1]
+    monkeypatch.setattr(search_index, 'MAX_SEGMENTS', 2)
+    for i in range(2, 5):
+        db.add(Track(id=i, title=f'Song {i}', artist_id=1, duration_ms=1))
+        db.commit()
+        index = svc.refresh(db)
+    assert len(index.segments) <= 2 and _ids(index, 'song 4') == [4]
+    saved = sorted(p.name for p in tmp_path.glob('seg_*.npz'))
+    assert len(saved) == len(index.segments)
+    # a new process loads the saved segments and only indexes the newer rows
+    db.add(Track(id=5, title='Lover', artist_id=1, duration_ms=1))
+    db.commit()
+    fresh = SearchService(str(tmp_path)).refresh(db)
+    assert _ids(fresh, 'taylor lov') == [1, 5] and fresh.max_id == 5
+
+
+def test_failed_refresh_is_not_retried_on_every_request(tmp_path, monkeypatch):
+    svc = SearchService(str(tmp_path), refresh_seconds=60)
+    calls = []
+
+    def broken(*args, **kwargs):
+        calls.append(1)
+        raise RuntimeError('database is down')
+
+    monkeypatch.setattr(svc, 'refresh', broken)
+    assert svc.get().search('love') == [] and svc.get().search('love') == []
+    svc.invalidate()
+    svc.get()
+    assert len(calls) == 1
+
+
+def test_searches_do_not_wait_for_a_running_build(tmp_path):
+    svc = SearchService(str(tmp_path))
+    with svc._lock:  # the initial build, running in another thread
+        assert svc.get().search('love') == []
+
+
+def test_workers_sharing_an_index_dir_keep_it_consistent(tmp_path):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add(Artist(id=1, name='Taylor Swift'))
+    db.add(Track(id=1, title='Love Story', artist_id=1, duration_ms=1))
+    db.commit()
+    a, b = SearchService(str(tmp_path)), SearchService(str(tmp_path))
+    a.refresh(db)
+    saved = sorted(p.name for p in tmp_path.glob('seg_*.npz'))
+    b.refresh(db)  # same rows: a's save is kept as is
+    assert sorted(p.name for p in tmp_path.glob('seg_*.npz')) == saved
+    db.add(Track(id=2, title='Lover', artist_id=1, duration_ms=1))
+    db.commit()
+    b.refresh(db)
+    a.refresh(db)
+    # the manifest lists files that exist, whichever worker wrote it last
+    fresh = SearchService(str(tmp_path)).refresh(db)
+    assert _ids(fresh, 'lov') == [1, 2] and fresh.max_id == 2
+    assert len(list(tmp_path.glob('seg_*.npz'))) == len(fresh.segments)
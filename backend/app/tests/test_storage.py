@@ -0,0 +1,172 @@
+from pathlib import Path
+
+from app.services.storage import FileIndex, LocalStorage, shard_of
+
+
+def test_sharded_paths_and_legacy_fallback(tmp_path):
+    store = LocalStorage(tmp_path)
+    assert shard_of('1.mp3') == shard_of('1.wav') and len(shard_of('1.mp3')) == 5
+    path = store.write_bytes('1.mp3', b'abc')
+    assert path == tmp_path / shard_of('1.mp3') / '1.mp3' and path.read_bytes() == b'abc'
+    (tmp_path / '2.wav').write_bytes(b'flat')
+    assert store.find(2, ('wav', 'mp3')) == (tmp_path / '2.wav', 'wav')
+    assert store.find(3, ('wav', 'mp3')) is None
+    # unrelated subdirectories (e.g. audio/deezer) are not part of the store
+    (tmp_path / 'deezer').mkdir()
+    (tmp_path / 'deezer' / '9.mp3').write_bytes(b'x')
+    assert sorted(e.name for e in store.scan()) == ['1.mp3', '2.wav']
+    assert store.delete('2.wav') and store.locate('2.wav') is None
+
+
+
+
+def test_incomplete_backend_fails_on_creation():
+    import pytest
+    from app.services.storage import StorageBackend
+
+    class NoDelete(StorageBackend):
+        def exists(self, name):
+            return False
+
+        def put_file(self, name, path):
+            pass
+
+        def temp_path(self, name):
+            return Path(name)
+
+    with pytest.raises(TypeError):
+        NoDelete()
+
+def test_file_index_tracks_scans_and_own_writes(tmp_path):
+    store = LocalStorage(tmp_path)
+    store.write_bytes('1.mp3', b'x')
+    (tmp_path / '2.wav').write_bytes(b'flat')
+    (tmp_path / 'cover.jpg').write_bytes(b'')
+    index = FileIndex(store, ('wav', 'mp3'))
+    # before the first scan, lookups go to the disk
+    assert 1 in index and 2 in index and 9 not in index and not index.ready
+    assert index.rescan() == 2 and 1 in index and 2 in index and len(index) == 2
+    store.write_bytes('3.wav', b'y')
+    store.write_bytes('3.mp3', b'y')
+    assert 3 in index
+    store.delete('3.wav')
+    assert 3 in index  # 3.mp3 is still there
+    store.delete('3.mp3')
+    assert 3 not in index and 1 in index
+
+def test_migrate_moves_flat_files(tmp_path):
+    store = LocalStorage(tmp_path)
+    for i in range(5):
+        (tmp_path / f'{i}.mp3').write_bytes(str(i).encode())
+    store.write_bytes('4.mp3', b'sharded')
+    assert store.migrate(dry_run=True) == (4, 1) and (tmp_path / '0.mp3').exists()
+    assert store.migrate() == (4, 1)
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == ['4.mp3']
+    assert store.path_for('0.mp3').read_bytes() == b'0'
+    assert store.locate('4.mp3') == store.path_for('4.mp3')
+
+
+class _NotFound(Exception):
+    response = {'Error': {'Code': '404'}}
+
+
+class FakeS3:
+    """In-memory stand-in for an S3-compatible endpoint (boto3 client method subset)."""
+
+    def __init__(self, page_size=1000):
+        self.objects = {}
+        self.page_size = page_size
+        self.calls = []
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(('head', Key))
+        if (Bucket, Key) not in self.objects:
+            raise _NotFound()
+        return {'ContentLength': len(self.objects[Bucket, Key][0])}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        with open(Filename, 'rb') as f:
+            self.objects[Bucket, Key] = (f.read(), (ExtraArgs or {}).get('ContentType'))
+
+    def download_file(self, Bucket, Key, Filename, Config=None):
+        self.calls.append(('get', Key))
+        if (Bucket, Key) not in self.objects:
+            raise _NotFound()
+        with open(Filename, 'wb') as f:
+            f.write(self.objects[Bucket, Key][0])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def generate_presigned_url(self, op, Params, ExpiresIn):
+        return f"http://minio.local/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + self.page_size]
+        out = {'Contents': [{'Key': k, 'Size': len(self.objects[Bucket, k][0])} for k in page],
+               'IsTruncated': start + self.page_size < len(keys)}
+        if out['IsTruncated']:
+            out['NextContinuationToken'] = str(start + self.page_size)
+        return out
+
+
+def test_tiered_storage_shares_files_between_nodes(tmp_path):
+    from app.services.storage import S3Storage, TieredStorage
+
+    s3 = FakeS3(page_size=2)
+    node_a = TieredStorage(LocalStorage(tmp_path / 'a'), S3Storage('bucket', 'audio/', client=s3))
+    node_b = TieredStorage(LocalStorage(tmp_path / 'b'), S3Storage('bucket', 'audio/', client=s3))
+    for i in range(3):
+        node_a.local.prepare(f'{i}.mp3')
+        tmp = node_a.temp_path(f'{i}.mp3')
+        tmp.write_bytes(b'mp3-%d' % i)
+        node_a.put_file(f'{i}.mp3', tmp)
+    node_a.flush()
+    assert s3.objects['bucket', 'audio/1.mp3'] == (b'mp3-1', 'audio/mpeg')
+    assert node_b.remote.keys() == {'0.mp3': 5, '1.mp3': 5, '2.mp3': 5}
+
+    # redirect to the object store without pulling the file
+    url = node_b.resolve('1.mp3', redirect=True)
+    assert url.startswith('http://minio.local/bucket/audio/1.mp3') and node_b.locate('1.mp3') is None
+    # the existence check is remembered, so repeated presigns do not HEAD again
+    heads = len([c for c in s3.calls if c[0] == 'head'])
+    assert node_b.resolve('1.mp3', redirect=True) and len([c for c in s3.calls if c[0] == 'head']) == heads
+    # read-through: pulled once, then served from local disk
+    path = node_b.resolve('1.mp3')
+    assert path.read_bytes() == b'mp3-1' and path == node_b.path_for('1.mp3')
+    gets = len([c for c in s3.calls if c[0] == 'get'])
+    assert node_b.resolve('1.mp3') == path and len([c for c in s3.calls if c[0] == 'get']) == gets
+    assert node_b.resolve('9.mp3') is None and node_b.resolve('9.mp3', redirect=True) is None
+    assert list((tmp_path / 'b').rglob('*.tmp')) == []
+    assert node_b.delete('1.mp3') and not node_b.delete('1.mp3')
+    assert node_a.exists('0.mp3') and not node_b.exists('1.mp3')
+    assert not node_b.remote.delete('9.mp3')
+
+    # the local copy can be evicted while its upload is still queued
+    node_a.local.prepare('5.mp3')
+    tmp = node_a.temp_path('5.mp3')
+    tmp.write_bytes(b'mp3-5')
+    node_a.local.delete(node_a.put_file('5.mp3', tmp).name)
+    node_a.flush()
+    assert s3.objects['bucket', 'audio/5.mp3'][0] == b'mp3-5'
+    assert list((tmp_path / 'a').rglob('*.tmp')) == []
+
+
+def test_stream_redirects_to_presigned_url(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.routers import deezer
+    from app.services.storage import S3Storage, TieredStorage
+
+    s3 = FakeS3()
+    s3.objects['bucket', 'deezer/42.mp3'] = (b'ID3', 'audio/mpeg')
+    storage = TieredStorage(LocalStorage(tmp_path), S3Storage('bucket', 'deezer/', client=s3))
+    monkeypatch.setattr(deezer.preview_cache, 'storage', storage)
+    monkeypatch.setattr(deezer.settings, 'storage_redirect', True)
+    r = TestClient(app).get('/deezer/stream/42', follow_redirects=False)
+    assert r.status_code == 307 and r.headers['location'].startswith('http://minio.local/bucket/deezer/42.mp3')
+    monkeypatch.setattr(deezer.settings, 'storage_redirect', False)
+    r = TestClient(app).get('/deezer/stream/42')
+    assert r.status_code == 200 and r.content == b'ID3' and storage.locate('42.mp3') is not None
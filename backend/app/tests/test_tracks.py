@@ -0,0 +1,84 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.core.db import Base, get_db
+from app.main import app
+from app.models.music import Artist, Track
+from app.routers import tracks
+from app.services.storage import FileIndex, LocalStorage
+
+
+def _client(tmp_path, monkeypatch):
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(Artist(id=1, name='a'))
+        db.add_all([Track(id=i, title=f't{i}', artist_id=1, duration_ms=1000, preview_url='p' if i == 2 else None)
+                    for i in range(1, 8)])
+        db.commit()
+
+    def override():
+        with Session(engine) as db:
+            yield db
+
+    store = LocalStorage(tmp_path)
+    store.write_bytes('3.wav', b'x')
+    files = FileIndex(store)
+    files.rescan()
+    monkeypatch.setattr(tracks, 'audio_files', files)
+    monkeypatch.setitem(app.dependency_overrides, get_db, override)
+    return TestClient(app)
+
+
+def test_list_tracks_cursor_pages(tmp_path, monkeypatch):
+    client = _client(tmp_path, monkeypatch)
+    pages, cursor = [], None
+    while True:
+        r = client.get('/tracks/', params={'limit': 3, **({'cursor': cursor} if cursor else {})})
+        assert r.status_code == 200
+        pages.append([t['id'] for t in r.json()])
+        cursor = r.headers.get('x-next-cursor')
+        if not cursor:
+            break
+    assert pages == [[7, 6, 5], [4, 3, 2], [1]]
+    r = client.get('/tracks/', params={'limit': 4, 'order': 'asc'})
+    assert [t['id'] for t in r.json()] == [1, 2, 3, 4]
+    r = client.get('/tracks/', params={'limit': 4, 'cursor': r.headers['x-next-cursor'], 'order': 'desc'})
+    assert [t['id'] for t in r.json()] == [5, 6, 7] and 'x-next-cursor' not in r.headers
+    # preview fallback comes from the file index; the stored URL wins
+    by_id = {t['id']: t['preview_url'] for t in client.get('/tracks/', params={'limit': 10}).json()}
+    assert by_id[3] == '/tracks/3/preview' and by_id[2] == 'p' and by_id[1] is None
+    assert client.get('/tracks/', params={'cursor': 'bm9wZQ'}).status_code == 400
+
+
+def test_search_pages_with_offset(tmp_path, monkeypatch):
+    from app.services.catalog import CatalogSnapshot
+    from app.services.search_index import SearchIndex, Segment
+
+    client = _client(tmp_path, monkeypatch)
+    index = SearchIndex([Segment.build([(i, f'song {i}', 'a', None) for i in range(1, 8)])])
+    snapshot = CatalogSnapshot.from_rows([(i, None, False, 1) for i in range(1, 8)], version=1)
+    monkeypatch.setattr(tracks.search_service, 'get', lambda: index)
+    monkeypatch.setattr(tracks.catalog_service, 'get', lambda: snapshot)
+    seen = []
+    for offset in (0, 3, 6):
+        r = client.get('/tracks/search', params={'q': 'son', 'limit': 3, 'offset': offset})
+        seen += [t['id'] for t in r.json()]
+    assert sorted(seen) == list(range(1, 8)) and len(seen) == 7
+    # same preview fallback as the list endpoint
+    by_id = {t['id']: t['preview_url'] for t in client.get('/tracks/search', params={'q': 'song', 'limit': 10}).json()}
+    assert by_id[3] == '/tracks/3/preview' and by_id[2] == 'p' and by_id[1] is None
+
+
+def test_batch_lookup_keeps_request_order(tmp_path, monkeypatch):
+    client = _client(tmp_path, monkeypatch)
+    r = client.post('/tracks/batch', json={'ids': [5, 99, 3, 5, 1]})
+    assert r.status_code == 200 and r.headers['content-type'] == 'application/json'
+    rows = r.json()
+    assert [t['id'] for t in rows] == [5, 3, 1]
+    assert rows[0]['artist_name'] == 'a' and rows[0]['album_title'] is None
+    assert rows[1]['preview_url'] == '/tracks/3/preview'
+    assert client.post('/tracks/batch', json={'ids': []}).json() == []
+    assert client.post('/tracks/batch', json={'ids': list(range(501))}).status_code == 400
@@ -0,0 +1,51 @@
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.core.db import Base
+from app.models.music import Artist, Track, User, Interaction, TrackLike
+from app.ml.feedback import LIKE_WEIGHT
+from app.ml.training.train_mf import als_fit, build_confidence_matrix, stream_feedback
+
+
+def test_confidence_matrix_sums_duplicates_and_maps_ids():
+    users = np.array([7, 7, 3, 7])
+    items = np.array([100, 100, 200, 300])
+    cui, user_ids, item_ids = build_confidence_matrix(users, items, np.ones(4, dtype=np.float32), alpha=1.0)
+    assert list(user_ids) == [3, 7] and list(item_ids) == [100, 200, 300]
+    assert cui.shape == (2, 3) and cui.nnz == 3
+    assert np.isclose(cui[1, 0], 1 + np.log1p(2.0))
+
+
+def test_als_separates_two_taste_clusters():
+    # users 0-9 listen to items 0-19, users 10-19 to items 20-39
+    rng = np.random.default_rng(1)
+    rows, cols = [], []
+    for u in range(20):
+        base = 0 if u < 10 else 20
+        picks = rng.choice(20, size=12, replace=False) + base
+        rows += [u] * len(picks)
+        cols += list(picks)
+    cui, _, _ = build_confidence_matrix(np.array(rows), np.array(cols), np.ones(len(rows), dtype=np.float32))
+    X, Y = als_fit(cui, factors=8, iterations=10, threads=2, block_size=4)
+    assert X.dtype == np.float32 and Y.shape == (40, 8)
+    scores = X @ Y.T
+    assert scores[:10, :20].mean() > scores[:10, 20:].mean()
+    assert scores[10:, 20:].mean() > scores[10:, :20].mean()
+
+
+def test_stream_feedback_reads_interactions_and_likes():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add_all([Artist(id=1, name='a'), User(id=1, email='u@x', password_hash='h')])
+        db.add_all([Track(id=i, title=f't{i}', artist_id=1, duration_ms=1000) for i in (1, 2)])
+        db.add_all([
+            Interaction(user_id=1, track_id=1, seconds_listened=15, is_completed=False),
+            Interaction(user_id=1, track_id=None, external_track_id='dz', seconds_listened=30),
+            TrackLike(user_id=1, track_id=2),
+        ])
+        db.commit()
+        users, items, strength = stream_feedback(db, chunk_size=1)
+    assert list(items) == [1, 2]
+    assert np.allclose(strength, [0.5, LIKE_WEIGHT])
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""Rebuild the /tracks/search index from scratch.
+
+The API indexes new tracks by itself; a rebuild only matters after titles or
+names were edited, or to drop deleted tracks and old segments:
+
+  python tools/build_search_index.py
+"""
+import sys
+import time
+from pathlib import Path
+
+# Ensure app package importable when running from repo root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.search_index import search_service
+
+
+def main():
+    started = time.monotonic()
+    index = search_service.refresh(rebuild=True)
+    terms = sum(len(s.vocab) for s in index.segments)
+    print(f'Indexed tracks up to id {index.max_id}: {terms} terms, {len(index.segments)} segment(s) '
+          f'in {search_service.index_dir} ({time.monotonic() - started:.1f}s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,15 @@ Usage examples:
 """
 from pathlib import Path
 import argparse
+import sys
 import time
+
+# Ensure app package importable when running from repo root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.storage import LocalStorage, preview_storage
+
+
 def fmt_bytes(n: int) -> str:
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
         if n < 1024.0:
@@ -32,11 +40,14 @@ def parse_size(s: str) -> int:
 
 
 def get_files(cache_dir: Path):
+    """Cached mp3s in the sharded layout (and any not yet migrated flat files)."""
     files = []
-    for p in cache_dir.glob('*.mp3'):
+    for e in LocalStorage(cache_dir).scan():
+        if not e.name.endswith('.mp3'):
+            continue
         try:
-            stat = p.stat()
-            files.append({'path': p, 'size': stat.st_size, 'mtime': stat.st_mtime})
+            stat = e.stat()
+            files.append({'path': Path(e.path), 'size': stat.st_size, 'mtime': stat.st_mtime})
         except Exception:
             continue
     return files
@@ -46,7 +57,7 @@ def main():
     p = argparse.ArgumentParser()
     p.add_argument('--max-age-days', type=int, default=0, help='Delete files older than N days (0=disabled)')
     p.add_argument('--max-bytes', type=str, default='', help='Ensure total cache <= bytes (e.g. 200MB). Empty=disabled')
-    p.add_argument('--cache-dir', default=str(Path(__file__).resolve().parents[2] / 'app' / 'static' / 'audio' / 'deezer'))
+    p.add_argument('--cache-dir', default=str(preview_storage.root))
     p.add_argument('--dry-run', action='store_true')
     p.add_argument('--delete', action='store_true', help='Perform deletion (default is dry-run)')
     args = p.parse_args()
@@ -6,19 +6,21 @@ Usage:
   python fill_preview_from_deezer.py --execute --limit 100 --batch-size 50
 
 This is best-effort and uses simple title+artist searches; results should be reviewed.
+Searches go through the shared Deezer client, so they are paced by its /search budget
+(DEEZER_SEARCH_RATE) and wait out the circuit breaker instead of failing.
 """
 import argparse
-import time
 import csv
 from typing import Optional
-from urllib.parse import quote_plus
 
 import requests
 
 from app.core.db import SessionLocal
 from app.models.music import Track, Artist
+from app.services.deezer_service import deezer_client
 
-DEEZER_SEARCH = "https://api.deezer.com/search"
+# batch job: wait for rate tokens / a closed circuit rather than failing fast
+deezer_client.max_wait = None
 
 
 def find_preview_for_track(title: str, artist_name: Optional[str]) -> Optional[str]:
@@ -26,11 +28,11 @@ def find_preview_for_track(title: str, artist_name: Optional[str]) -> Optional[s
     q = title
     if artist_name:
         q = f"{title} {artist_name}"
-    params = {"q": q, "limit": 5}
-    r = requests.get(DEEZER_SEARCH, params=params, timeout=10)
-    if r.status_code != 200:
+    try:
+        data = deezer_client.search_tracks(q, limit=5)
+    except requests.RequestException as e:
+        print(f"[deezer] search failed: {e}")
         return None
-    data = r.json()
     for item in data.get("data", []):
         preview = item.get("preview")
         if preview:
@@ -83,7 +85,6 @@ def main():
             if preview:
                 # record candidate (dry-run or execute)
                 candidates.append((t.id, t.title, artist_name or "", preview))
-            time.sleep(0.25)  # rate-limit
 
         if args.execute:
             session.commit()
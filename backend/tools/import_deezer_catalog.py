@@ -1,16 +1,16 @@
 """Import Deezer catalog data (charts / artist top) into local DB.
 
 Usage example (from repo root):
-  python backend\tools\import_deezer_catalog.py --charts --limit 20 --delay 0.2
+  python backend\tools\import_deezer_catalog.py --charts --limit 20
 
 The script is resumable: it keeps a small JSON state file under backend/.deezer_import_state.json
-recording processed artist IDs. It is rate-limited by --delay seconds between requests.
+recording processed artist IDs. API calls go through the shared Deezer client, which paces
+them (DEEZER_OTHER_RATE requests/s) and waits out its circuit breaker.
 """
 from __future__ import annotations
 
 import sys
 from pathlib import Path
-import time
 import json
 import argparse
 from typing import Optional
@@ -21,10 +21,11 @@ sys.path.insert(0, str(HERE))
 
 import requests
 from app.core.db import SessionLocal
+from app.core.ratelimit import TokenBucket
 from app.models.music import Artist, Album, Track
+from app.services.deezer_service import deezer_client
 
 STATE_PATH = HERE / '.deezer_import_state.json'
-BASE = 'https://api.deezer.com'
 
 
 def load_state():
@@ -54,16 +55,13 @@ def get_or_create(session, model, lookup: dict, defaults: dict | None = None):
     return instance, True
 
 
-def fetch_json(path: str, params: dict | None = None, timeout=10) -> Optional[dict]:
-    url = f"{BASE}{path}"
+def fetch_json(path: str, params: dict | None = None) -> Optional[dict]:
     try:
-        r = requests.get(url, params=params or {}, timeout=timeout)
-        if r.status_code == 200:
-            return r.json()
-        else:
-            print(f"Deezer {url} -> {r.status_code}")
-            return None
-    except Exception as e:
+        data = deezer_client.get_json(path, params=params or {})
+        if data is None:
+            print(f"Deezer {path} -> not found")
+        return data
+    except requests.RequestException as e:
         print('Request failed', e)
         return None
 
@@ -101,7 +99,7 @@ def import_track(session, dtrack: dict):
     return track
 
 
-def import_from_charts(limit: int = 50, delay: float = 0.25):
+def import_from_charts(limit: int = 50):
     session = SessionLocal()
     try:
         print('Fetching charts...')
@@ -114,12 +112,11 @@ def import_from_charts(limit: int = 50, delay: float = 0.25):
         for t in tracks:
             import_track(session, t)
             session.commit()
-            time.sleep(delay)
     finally:
         session.close()
 
 
-def import_artist_top(artist_id: int, limit: int = 50, delay: float = 0.2):
+def import_artist_top(artist_id: int, limit: int = 50):
     session = SessionLocal()
     try:
         print(f'Fetching top for artist {artist_id}...')
@@ -131,7 +128,6 @@ def import_artist_top(artist_id: int, limit: int = 50, delay: float = 0.2):
         for t in tracks:
             import_track(session, t)
             session.commit()
-            time.sleep(delay)
     finally:
         session.close()
 
@@ -141,13 +137,17 @@ def main():
     p.add_argument('--charts', action='store_true')
     p.add_argument('--artist-top', type=int, help='Artist id to import top tracks for')
     p.add_argument('--limit', type=int, default=50)
-    p.add_argument('--delay', type=float, default=0.25)
+    p.add_argument('--delay', type=float, default=0.0, help='deprecated: same as DEEZER_OTHER_RATE=1/DELAY')
     args = p.parse_args()
+    # batch job: wait for rate tokens / a closed circuit rather than failing fast
+    deezer_client.max_wait = None
+    if args.delay:
+        deezer_client.buckets['other'] = TokenBucket(1.0 / args.delay)
 
     if args.charts:
-        import_from_charts(limit=args.limit, delay=args.delay)
+        import_from_charts(limit=args.limit)
     elif args.artist_top:
-        import_artist_top(args.artist_top, limit=args.limit, delay=args.delay)
+        import_artist_top(args.artist_top, limit=args.limit)
     else:
         print('Nothing to do. Use --charts or --artist-top')
 
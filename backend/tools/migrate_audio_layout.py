@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Move flat audio files into the hash-sharded layout.
+
+Before sharding, audio was stored as app/static/audio/{id}.wav|mp3 and
+app/static/audio/deezer/{id}.mp3. The server now writes ab/cd/{id}.ext under
+the same roots (see app/services/storage.py) and still finds flat files as a
+fallback, so this can run while the API is serving.
+
+Usage:
+  # show what would move
+  python tools/migrate_audio_layout.py --dry-run
+
+  # move both the uploaded audio and the Deezer preview cache
+  python tools/migrate_audio_layout.py
+"""
+from pathlib import Path
+import argparse
+import sys
+
+# Ensure app package importable when running from repo root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.storage import LocalStorage, audio_storage, preview_storage
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--root', action='append', default=None,
+                   help='Audio directory to migrate (repeatable). Default: static/audio and static/audio/deezer')
+    p.add_argument('--dry-run', action='store_true')
+    args = p.parse_args()
+
+    stores = [LocalStorage(Path(r)) for r in args.root] if args.root else [audio_storage.local, preview_storage.local]
+    for store in stores:
+        if not store.root.exists():
+            print('Skip (not found):', store.root)
+            continue
+        moved, skipped = store.migrate(dry_run=args.dry_run)
+        verb = 'would move' if args.dry_run else 'moved'
+        print(f'{store.root}: {verb} {moved} files, skipped {skipped} (sharded copy already present)')
+
+
+if __name__ == '__main__':
+    main()
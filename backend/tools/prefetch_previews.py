@@ -1,106 +1,255 @@
 #!/usr/bin/env python3
-"""Prefetch Deezer preview mp3 files listed in a CSV.
+"""Prefetch Deezer preview mp3 files into the preview cache, concurrently.
 
 Usage:
-  python tools/prefetch_previews.py --csv preview_candidates_all.csv --sleep 0.2 --limit 0
+  # from a CSV with columns id,title,artist,found_preview_url (or preview_url)
+  python tools/prefetch_previews.py --csv preview_candidates_all.csv --workers 32 --rate 50
 
-This reads a CSV with columns: id,title,artist,found_preview_url and downloads the URL into
-app/static/audio/deezer/{id}.mp3 if not already present.
+  # straight from the tracks table (every track with an http(s) preview_url)
+  python tools/prefetch_previews.py --from-db --workers 64 --rate 100
+
+Downloads go to the preview cache (app/static/audio/deezer/ab/cd/{id}.mp3, plus the
+object store with AUDIO_STORAGE=s3) through one pooled HTTP client, limited to --rate
+requests/s by a token bucket and retried with jittered exponential backoff on
+network errors, 429 and 5xx. Targets are streamed (the CSV / table is never loaded
+whole) and every finished id is appended to a journal (--journal), so an interrupted
+run resumes exactly where it stopped; --start / --limit still slice the input.
 """
-import csv
 import argparse
-from pathlib import Path
-import requests
-import shutil
+import asyncio
+import csv
+import random
+import sys
 import time
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional
 
+import httpx
+
+# Ensure app package importable when running from repo root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.ratelimit import TokenBucket
+from app.core.upstream import DEEZER_REFERER, UPSTREAM_HEADERS
+from app.services.storage import StorageBackend, preview_storage
+
+DEFAULT_JOURNAL = Path(__file__).resolve().parent / '.prefetch_journal'
+DB_BATCH = 1000
+# statuses that are final: not retried when resuming
+DONE = ('ok', 'cached')
+PERMANENT = ('fail',)
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
-def download_preview(track_id: str, url: str, cache_dir: Path, timeout=20, max_retries=2) -> bool:
-    target = cache_dir / f"{track_id}.mp3"
-    if target.exists():
-        print(f"SKIP {track_id} (cached)")
-        return True
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
-                      '(KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36',
-        'Accept': 'audio/*,*/*',
-        'Referer': 'https://www.deezer.com/'
-    }
+class Journal:
+    """Append-only ``<id> <status>`` lines; the last status of an id wins."""
 
-    tmp = cache_dir / f"{track_id}.tmp"
-    for attempt in range(1, max_retries + 1):
+    def __init__(self, path: Path):
+        self.path = path
+        self.status: dict[str, str] = {}
+        if path.exists():
+            with path.open(encoding='utf-8') as fh:
+                for line in fh:
+                    tid, _, status = line.strip().partition(' ')
+                    if tid:
+                        self.status[tid] = status
+        # line-buffered: every finished id reaches the file even if the run is killed
+        self._fh = path.open('a', encoding='utf-8', buffering=1)
+
+    def finished(self, track_id: str, retry_failed: bool) -> bool:
+        status = self.status.get(track_id)
+        return status in DONE or (status in PERMANENT and not retry_failed)
+
+    def record(self, track_id: str, status: str) -> None:
+        self.status[track_id] = status
+        self._fh.write(f'{track_id} {status}\n')
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def csv_targets(path: Path) -> Iterator[tuple[str, Optional[str]]]:
+    with path.open(newline='', encoding='utf-8') as fh:
+        for r in csv.DictReader(fh):
+            url = r.get('found_preview_url') or r.get('preview_url')
+            if url and url.strip().lower() in ('', 'miss'):
+                url = None
+            yield r.get('id'), url
+
+
+async def db_targets() -> AsyncIterator[tuple[str, Optional[str]]]:
+    """Tracks with an absolute preview URL, in id order, read in keyset batches."""
+    from app.core.db import SessionLocal
+    from app.models.music import Track
+
+    def batch(after: int) -> list:
+        db = SessionLocal()
         try:
-            with requests.get(url, stream=True, timeout=timeout, headers=headers) as r:
-                r.raise_for_status()
-                with tmp.open('wb') as fh:
-                    shutil.copyfileobj(r.raw, fh)
-            tmp.replace(target)
-            print(f"OK   {track_id}")
-            return True
-        except requests.exceptions.HTTPError as he:
-            status = getattr(he, 'response', None)
-            code = status.status_code if status is not None else 'n/a'
-            print(f"HTTP {code} for {track_id} attempt {attempt}: {he}")
-            # try again; continue loop
-        except Exception as e:
-            print(f"ERR  {track_id} attempt {attempt}: {e}")
-        time.sleep(0.5)
-
-    # cleanup tmp
+            return db.query(Track.id, Track.preview_url).filter(
+                Track.id > after, Track.preview_url.like('http%'),
+            ).order_by(Track.id).limit(DB_BATCH).all()
+        finally:
+            db.close()
+
+    after = 0
+    while True:
+        rows = await asyncio.to_thread(batch, after)
+        for tid, url in rows:
+            yield str(tid), url
+        if len(rows) < DB_BATCH:
+            return
+        after = rows[-1][0]
+
+
+async def _iterate(args) -> AsyncIterator[tuple[str, Optional[str]]]:
+    source = db_targets() if args.from_db else _aiter(csv_targets(Path(args.csv)))
+    stop = args.start + args.limit if args.limit > 0 else None
+    i = 0
+    async for item in source:
+        if stop is not None and i >= stop:
+            return
+        if i >= args.start:
+            yield item
+        i += 1
+
+
+async def _aiter(it):
+    for item in it:
+        yield item
+
+
+def _store(storage: StorageBackend, name: str, data: bytes) -> None:
+    storage.prepare(name)
+    tmp = storage.temp_path(name)
     try:
-        if tmp.exists():
-            tmp.unlink()
-    except Exception:
-        pass
-    return False
+        tmp.write_bytes(data)
+        storage.put_file(name, tmp)
+    finally:
+        # put_file consumed it unless the write or the move failed
+        tmp.unlink(missing_ok=True)
+
+
+async def _stored(storage: StorageBackend, bucket: TokenBucket, name: str) -> bool:
+    """Whether the preview is stored: the local tier first, a HEAD of the object
+    store (through the rate limiter) only on a local miss."""
+    if await asyncio.to_thread(storage.locate, name) is not None:
+        return True
+    if storage.remote is None:
+        return False
+    await bucket.acquire_async()
+    return await asyncio.to_thread(storage.exists, name)
+
+
+async def download_preview(client: httpx.AsyncClient, bucket: TokenBucket, storage: StorageBackend,
+                           track_id: str, url: str, retries: int = 3, backoff: float = 0.5) -> str:
+    """Fetch one preview; returns the journal status ('ok' / 'cached' / 'fail' / 'error')."""
+    name = f'{track_id}.mp3'
+    if await _stored(storage, bucket, name):
+        return 'cached'
+    for attempt in range(retries + 1):
+        await bucket.acquire_async()
+        try:
+            resp = await client.get(url)
+            if resp.status_code == 403:
+                # some CDNs want a deezer.com referer
+                resp = await client.get(url, headers={'Referer': DEEZER_REFERER})
+            if resp.status_code == 200 and resp.content:
+                try:
+                    await asyncio.to_thread(_store, storage, name, resp.content)
+                except OSError as e:
+                    # disk full / permissions: not worth retrying the download
+                    print(f"ERR  {track_id}: cannot store preview: {e}")
+                    return 'error'
+                return 'ok'
+            if resp.status_code not in RETRY_STATUS:
+                print(f"HTTP {resp.status_code} for {track_id}")
+                return 'fail'
+            err = f'HTTP {resp.status_code}'
+        except httpx.HTTPError as e:
+            err = f'{type(e).__name__}: {e}'
+        if attempt < retries:
+            # exponential backoff with full jitter
+            await asyncio.sleep(random.uniform(0, backoff * 2 ** attempt))
+    print(f"ERR  {track_id}: {err} after {retries + 1} attempts")
+    return 'error'
+
+
+async def run(args) -> dict:
+    journal = Journal(Path(args.journal))
+    bucket = TokenBucket(args.rate, capacity=args.burst or None)
+    counts = {'ok': 0, 'cached': 0, 'fail': 0, 'error': 0, 'skipped': 0, 'no_url': 0}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.workers * 4)
+    started = time.monotonic()
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            track_id, url = item
+            try:
+                status = await download_preview(client, bucket, preview_storage, track_id, url, args.retries)
+            except Exception as e:
+                # e.g. an object-store error from the existence check / upload: keep the worker
+                # alive, or the producer blocks on a full queue once every worker has died
+                print(f"ERR  {track_id}: {type(e).__name__}: {e}")
+                status = 'error'
+            counts[status] += 1
+            journal.record(track_id, status)
+            done = counts['ok'] + counts['cached'] + counts['fail'] + counts['error']
+            if done % args.progress_every == 0:
+                elapsed = time.monotonic() - started
+                print(f"[{done}] ok={counts['ok']} cached={counts['cached']} fail={counts['fail']} "
+                      f"error={counts['error']} {done / elapsed:.1f}/s")
+
+    limits = httpx.Limits(max_connections=args.workers, max_keepalive_connections=args.workers)
+    async with httpx.AsyncClient(headers=UPSTREAM_HEADERS, limits=limits, follow_redirects=True,
+                                 timeout=httpx.Timeout(args.timeout, connect=5.0)) as client:
+        workers = [asyncio.create_task(worker(client)) for _ in range(args.workers)]
+        try:
+            async for track_id, url in _iterate(args):
+                if not track_id or not url:
+                    counts['no_url'] += 1
+                    continue
+                if journal.finished(track_id, args.retry_failed):
+                    counts['skipped'] += 1
+                    continue
+                await queue.put((track_id, url))
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers, return_exceptions=True)
+            journal.close()
+            await asyncio.to_thread(preview_storage.flush)
+    counts['seconds'] = round(time.monotonic() - started, 1)
+    return counts
 
 
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--csv', default='preview_candidates_all.csv')
+    p.add_argument('--from-db', action='store_true', help='read targets from the tracks table instead of --csv')
     p.add_argument('--limit', type=int, default=0, help='0=all')
     p.add_argument('--start', type=int, default=0, help='start index (0-based)')
-    p.add_argument('--sleep', type=float, default=0.0, help='seconds to sleep between downloads')
+    p.add_argument('--workers', type=int, default=16, help='concurrent downloads')
+    p.add_argument('--rate', type=float, default=20.0, help='max requests per second (0=unlimited)')
+    p.add_argument('--burst', type=float, default=0, help='token bucket size (default: one second of --rate)')
+    p.add_argument('--sleep', type=float, default=0.0, help='deprecated: same as --rate 1/SLEEP')
+    p.add_argument('--retries', type=int, default=3)
+    p.add_argument('--timeout', type=float, default=20.0)
+    p.add_argument('--journal', default=str(DEFAULT_JOURNAL), help='progress journal used to resume')
+    p.add_argument('--retry-failed', action='store_true', help='retry ids that failed permanently (403/404) last time')
+    p.add_argument('--progress-every', type=int, default=100)
     args = p.parse_args()
+    if args.sleep:
+        args.rate = 1.0 / args.sleep
 
-    csv_path = Path(args.csv)
-    if not csv_path.exists():
-        print('CSV not found:', csv_path)
+    if not args.from_db and not Path(args.csv).exists():
+        print('CSV not found:', args.csv)
         return
 
-    cache_dir = Path(__file__).resolve().parents[2] / 'app' / 'static' / 'audio' / 'deezer'
-    cache_dir.mkdir(parents=True, exist_ok=True)
-
-    rows = []
-    with csv_path.open(newline='', encoding='utf-8') as fh:
-        reader = csv.DictReader(fh)
-        for r in reader:
-            rows.append(r)
-
-    total = len(rows)
-    limit = args.limit if args.limit > 0 else total
-    start = args.start
-
-    ok = 0
-    fail = 0
-    for idx, r in enumerate(rows[start:start+limit]):
-        track_id = r.get('id')
-        url = r.get('found_preview_url') or r.get('preview_url')
-        if not track_id or not url or url.strip().lower() in ('', 'miss'):
-            print(f"MISS {track_id} - no url")
-            fail += 1
-            continue
-        print(f"[{idx+start+1}/{total}] Downloading {track_id} ...")
-        ok_flag = download_preview(track_id, url, cache_dir)
-        if ok_flag:
-            ok += 1
-        else:
-            fail += 1
-        if args.sleep:
-            time.sleep(args.sleep)
-
-    print(f"Done. ok={ok} fail={fail} total={total}")
+    counts = asyncio.run(run(args))
+    print('Done. ' + ' '.join(f'{k}={v}' for k, v in counts.items()))
 
 
 if __name__ == '__main__':
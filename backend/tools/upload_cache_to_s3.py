@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""Upload cached preview mp3s to AWS S3.
+"""Upload cached preview mp3s to S3 (or any S3-compatible store such as MinIO).
 
 Usage:
   # dry-run (lists files that would be uploaded)
@@ -8,8 +8,8 @@ Usage:
   # upload and keep local files
   python tools/upload_cache_to_s3.py --bucket my-bucket --prefix previews/
 
-  # upload and delete local files after success
-  python tools/upload_cache_to_s3.py --bucket my-bucket --prefix previews/ --delete-after
+  # upload to a local MinIO with 16 parallel uploads, delete local files after success
+  python tools/upload_cache_to_s3.py --bucket my-bucket --endpoint-url http://localhost:9000 --workers 16 --delete-after
 
 Authentication:
   The script uses standard boto3 auth methods:
@@ -17,43 +17,25 @@ Authentication:
    - Configure a profile in ~/.aws/credentials and pass --profile PROFILE
 
 Notes:
-  - This script does NOT attempt to upload files already present in S3 with the same key (it checks ETag/size)
-  - It sets ContentType to audio/mpeg
+  - Objects already present with the same size are skipped; the bucket is listed once
+    instead of one HEAD request per file
+  - Uploads run in parallel (--workers); large files use multipart uploads
+  - The server reads the same keys with AUDIO_STORAGE=s3 when --prefix matches
+    S3_PREFIX + 'deezer/' (default audio/deezer/)
 """
 from pathlib import Path
 import argparse
-import boto3
-from botocore.exceptions import ClientError
-import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# Ensure app package importable when running from repo root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
-def list_cache(cache_dir: Path):
-    return sorted([p for p in cache_dir.glob('*.mp3') if p.is_file()])
-
-
-def s3_key_for(path: Path, prefix: str):
-    return (prefix.rstrip('/') + '/' + path.name) if prefix else path.name
-
+from app.services.storage import LocalStorage, S3Storage, preview_storage
 
-def upload_file(s3, bucket, key, path):
-    extra = {'ContentType': 'audio/mpeg'}
-    try:
-        s3.upload_file(str(path), bucket, key, ExtraArgs=extra)
-        return True
-    except ClientError as e:
-        print('Upload failed for', path.name, e)
-        return False
 
-
-def exists_with_same_size(s3, bucket, key, size):
-    try:
-        head = s3.head_object(Bucket=bucket, Key=key)
-        return int(head.get('ContentLength', -1)) == size
-    except ClientError as e:
-        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
-            return False
-        # other errors => assume not present
-        return False
+def list_cache(cache_dir: Path):
+    return sorted(Path(e.path) for e in LocalStorage(cache_dir).scan() if e.name.endswith('.mp3'))
 
 
 def main():
@@ -61,7 +43,9 @@ def main():
     p.add_argument('--bucket', required=True)
     p.add_argument('--prefix', default='')
     p.add_argument('--profile', default=None, help='AWS profile to use from ~/.aws/credentials')
-    p.add_argument('--cache-dir', default=str(Path(__file__).resolve().parents[2] / 'app' / 'static' / 'audio' / 'deezer'))
+    p.add_argument('--endpoint-url', default=None, help='S3-compatible endpoint (e.g. MinIO)')
+    p.add_argument('--workers', type=int, default=8, help='Parallel uploads')
+    p.add_argument('--cache-dir', default=str(preview_storage.root))
     p.add_argument('--dry-run', action='store_true')
     p.add_argument('--delete-after', action='store_true', help='Delete local file after successful upload')
     args = p.parse_args()
@@ -71,11 +55,11 @@ def main():
         print('Cache dir not found:', cache_dir)
         return
 
-    session_kwargs = {}
-    if args.profile:
-        session_kwargs['profile_name'] = args.profile
-    session = boto3.Session(**session_kwargs) if session_kwargs else boto3.Session()
-    s3 = session.client('s3')
+    import boto3
+
+    session = boto3.Session(profile_name=args.profile) if args.profile else boto3.Session()
+    store = S3Storage(args.bucket, prefix=args.prefix, client=session.client('s3', endpoint_url=args.endpoint_url),
+                      max_concurrency=args.workers)
 
     files = list_cache(cache_dir)
     if not files:
@@ -83,32 +67,40 @@ def main():
         return
 
     print(f'Found {len(files)} files in cache. Bucket={args.bucket} prefix="{args.prefix}"')
-    uploaded = 0
+    remote = store.keys()
+    todo = []
     skipped = 0
-    failed = 0
     for pth in files:
-        key = s3_key_for(pth, args.prefix)
-        size = pth.stat().st_size
-        if exists_with_same_size(s3, args.bucket, key, size):
-            print('SKIP (exists) ', pth.name)
+        if remote.get(pth.name) == pth.stat().st_size:
             skipped += 1
             continue
+        todo.append(pth)
+    print(f'{skipped} already uploaded, {len(todo)} to upload')
 
-        if args.dry_run:
-            print('DRY  ', pth.name, '->', key)
-            uploaded += 1
-            continue
+    if args.dry_run:
+        for pth in todo:
+            print('DRY  ', pth.name, '->', store.key(pth.name))
+        print(f'Done. uploaded={len(todo)} skipped={skipped} failed=0')
+        return
 
-        ok = upload_file(s3, args.bucket, key, pth)
-        if ok:
+    uploaded = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(store.upload, pth.name, pth): pth for pth in todo}
+        for fut in as_completed(futures):
+            pth = futures[fut]
+            try:
+                fut.result()
+            except Exception as e:
+                print('Upload failed for', pth.name, e)
+                failed += 1
+                continue
             uploaded += 1
             if args.delete_after:
                 try:
                     pth.unlink()
                 except Exception as e:
                     print('Warning: failed to delete', pth, e)
-        else:
-            failed += 1
 
     print(f'Done. uploaded={uploaded} skipped={skipped} failed={failed}')
 